@@ -0,0 +1,55 @@
+"""
+Background upkeep of the sales summary tables behind admin analytics.
+
+A checkout only queues its order in SalesPending, so concurrent checkouts never update the
+same summary row. The refresher folds the queued orders into the summary tables in batches
+every interval, off the checkout path; async_db.get_sales_summary refreshes once more before
+reading, so the admin sees every committed order.
+"""
+import asyncio
+import logging
+from typing import Optional
+
+import async_db
+
+
+class SalesSummaryRefresher:
+    def __init__(self, interval: float = 5.0, batch_size: int = 1000):
+        self.interval = interval
+        self.batch_size = batch_size
+
+        self._task: Optional[asyncio.Task] = None
+        self.refreshed = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"refreshed": self.refreshed, "failed": self.failed}
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                added = await async_db.refresh_sales_summary(self.batch_size)
+                if added is None:
+                    self.failed += 1
+                else:
+                    self.refreshed += added
+                    if added == self.batch_size:
+                        # More are queued: a backlog is worked off without waiting
+                        continue
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("Sales summary refresh failed")
+            await asyncio.sleep(self.interval)
+
+
+sales_summary = SalesSummaryRefresher()
@@ -0,0 +1,159 @@
+"""
+Non-blocking access to db.py for the aiogram handlers.
+
+Every function mirrors its counterpart in db.py but runs the blocking database call
+in a bounded thread pool, so a slow query no longer stalls the event loop.
+Catalog reads are served from the in-process catalog cache, and catalog edits made
+through this module, or checkouts that sell a product out, invalidate it. Registration
+checks consult the registered-user cache before querying the database.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Tuple, Optional
+
+import db
+from catalog import catalog, CatalogSnapshot
+from user_cache import registered_users
+from config import DB_POOL_MAX
+from metrics import db_executor_wait
+
+# One worker per pooled connection: extra calls queue here instead of inside the pool
+_executor = ThreadPoolExecutor(max_workers=DB_POOL_MAX, thread_name_prefix="db")
+
+
+async def run(func, *args, **kwargs):
+    """Runs a blocking function in the database executor."""
+    loop = asyncio.get_running_loop()
+    queued_at = time.perf_counter()
+
+    def call():
+        db_executor_wait.observe("", time.perf_counter() - queued_at)
+        return func(*args, **kwargs)
+    return await loop.run_in_executor(_executor, call)
+
+
+async def get_users() -> List[Tuple[int, str]]:
+    return await run(db.get_users)
+
+async def get_users_page(after_id: Optional[int] = None, before_id: Optional[int] = None,
+                         limit: int = 20) -> Tuple[List[Tuple[int, str]], int]:
+    return await run(db.get_users_page, after_id, before_id, limit)
+
+async def user_exists(user_id: int) -> bool:
+    if user_id in registered_users:
+        return True
+    exists = await run(db.user_exists, user_id)
+    if exists:
+        registered_users.add(user_id)
+    return exists
+
+async def add_user(user_id: int, username: str, full_name: str, phone_number: str) -> bool:
+    added = await run(db.add_user, user_id, username, full_name, phone_number)
+    if added:
+        registered_users.add(user_id)
+    return added
+
+async def get_user(user_id: int) -> Optional[Tuple[str, str]]:
+    return await run(db.get_user, user_id)
+
+async def get_catalog() -> CatalogSnapshot:
+    """Returns the cached catalog snapshot, reloading it off the event loop when stale."""
+    snapshot = catalog.current()
+    if snapshot is None:
+        snapshot = await run(catalog.snapshot)
+    return snapshot
+
+async def get_products_by_category(category_id: int):
+    return (await get_catalog()).products_by_category.get(category_id, [])
+
+async def get_category_by_id(category_id: int):
+    category = (await get_catalog()).categories_by_id.get(category_id)
+    return category[1] if category else None
+
+async def get_categories():
+    return (await get_catalog()).categories
+
+async def add_category(name: str) -> None:
+    await run(db.add_category, name)
+    catalog.invalidate()
+
+async def delete_category(category_id: int) -> bool:
+    deleted = await run(db.delete_category, category_id)
+    catalog.invalidate()
+    return deleted
+
+async def get_product_by_id(product_id: int):
+    return await run(db.get_product_by_id, product_id)
+
+async def get_products():
+    return (await get_catalog()).products
+
+async def search_products(query: str, limit: int = 20) -> List[Tuple[int, int, str, int]]:
+    if db.get_engine().name == "sqlite":
+        # No full-text index to query: the catalog's in-memory index answers without a thread hop
+        return (await get_catalog()).search(query, limit)
+    results = await run(db.search_products, query, limit)
+    if results is None:
+        # Database unavailable: answer from the cached catalog
+        results = (await get_catalog()).search(query, limit)
+    return results
+
+async def get_products_page(after_id: Optional[int] = None, before_id: Optional[int] = None,
+                            limit: int = 10) -> Tuple[List[Tuple[int, int, str, int]], int]:
+    return await run(db.get_products_page, after_id, before_id, limit)
+
+async def add_product(category_id: int, name: str, price: int) -> None:
+    await run(db.add_product, category_id, name, price)
+    catalog.invalidate()
+
+async def set_product_stock(product_id: int, stock: Optional[int]) -> bool:
+    updated = await run(db.set_product_stock, product_id, stock)
+    catalog.invalidate()
+    return updated
+
+async def delete_product(product_id: int) -> bool:
+    deleted = await run(db.delete_product, product_id)
+    catalog.invalidate()
+    return deleted
+
+async def import_products(rows: Iterable[Tuple[int, str, str, int]]) -> Optional[dict]:
+    """Imports price-list rows; the catalog is reloaded once afterwards if anything changed."""
+    result = await run(db.import_products, rows)
+    if result is not None and (result["inserted"] or result["updated"] or result["categories"]):
+        catalog.invalidate()
+        await get_catalog()
+    return result
+
+async def create_order(user_id: int, cart: list, location: str, idempotency_key: Optional[str] = None,
+                       notify_chat_id: Optional[str] = None) -> Optional[Tuple[int, bool]]:
+    """
+    Returns (order_id, created) and drops products that sold out from the catalog.
+    Raises db.OutOfStock, after the same, if some items are not available.
+    """
+    try:
+        result = await run(db.create_order, user_id, cart, location, idempotency_key, notify_chat_id)
+    except db.OutOfStock:
+        # The catalog showed a product that is gone
+        catalog.invalidate()
+        raise
+    if result is None:
+        return None
+    order_id, created, sold_out = result
+    if sold_out:
+        catalog.invalidate()
+    return order_id, created
+
+async def get_order(order_id: int) -> Optional[dict]:
+    return await run(db.get_order, order_id)
+
+async def get_user_orders(user_id: int) -> List[Tuple[int, str, str, int, int]]:
+    return await run(db.get_user_orders, user_id)
+
+async def refresh_sales_summary(limit: int = 1000) -> Optional[int]:
+    return await run(db.refresh_sales_summary, limit)
+
+async def get_sales_summary(days: int, top: int = 10) -> Optional[dict]:
+    """Counts the orders placed since the last background refresh first, so the figures are current."""
+    await refresh_sales_summary()
+    return await run(db.get_sales_summary, days, top)
@@ -0,0 +1,84 @@
+"""
+Overlapping broadcasts: two broadcasts started together reach the same chats at the same
+time and share their per-chat token buckets. Both must finish with every user sent both
+messages, and no bucket may be left behind.
+
+    python benchmarks/broadcast_overlap.py --users 50
+
+Runs on a scratch SQLite database of its own with a fake bot that records the messages,
+so no real user is messaged whatever DATABASE_URL points at.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+from collections import Counter
+from types import SimpleNamespace
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+ADMIN_CHAT_ID = 1
+
+
+class FakeBot:
+    """Records sends; a send takes a few milliseconds so the broadcasts overlap."""
+
+    def __init__(self):
+        self.received = Counter()
+        self.message_ids = 0
+
+    async def send_message(self, chat_id: int, text: str, reply_markup=None):
+        self.message_ids += 1
+        if chat_id == ADMIN_CHAT_ID:
+            return SimpleNamespace(chat=SimpleNamespace(id=chat_id), message_id=self.message_ids,
+                                   edit_text=self.edit_text)
+        await asyncio.sleep(0.005)
+        self.received[chat_id, text] += 1
+
+    async def edit_text(self, text: str, reply_markup=None):
+        pass
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="broadcast_overlap")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'bot.db')}"
+    import db
+    from broadcast import Broadcaster
+
+    db.create_tables()
+    user_ids = range(ADMIN_CHAT_ID + 1, ADMIN_CHAT_ID + 1 + args.users)
+    for user_id in user_ids:
+        db.add_user(user_id, f"user{user_id}", "Broadcast Test", "998000000000")
+
+    bot = FakeBot()
+    broadcaster = Broadcaster(rate=1000, per_chat_rate=100, batch_size=10)
+    await broadcaster.start(bot)
+    first, second = await asyncio.gather(broadcaster.create(ADMIN_CHAT_ID, "first"),
+                                         broadcaster.create(ADMIN_CHAT_ID, "second"))
+    await asyncio.gather(*broadcaster._tasks.values())
+
+    with db.reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT broadcast_id, status, sent, blocked, failed FROM Broadcasts ORDER BY broadcast_id")
+        rows = cursor.fetchall()
+    for row in rows:
+        print(f"broadcast #{row[0]}: {row[1]}, sent {row[2]}, blocked {row[3]}, failed {row[4]}")
+    delivered = all(bot.received[user_id, text] == 1 for user_id in user_ids for text in ("first", "second"))
+    print(f"every user got both messages once: {'yes' if delivered else 'no'}; "
+          f"chat buckets left: {len(broadcaster._chat_buckets)}")
+
+    ok = (delivered and [row[0] for row in rows] == [first, second]
+          and all(row[1:] == ("done", args.users, 0, 0) for row in rows)
+          and not broadcaster._chat_buckets and not broadcaster._chat_senders)
+    print("ok" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
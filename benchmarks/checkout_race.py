@@ -0,0 +1,61 @@
+"""
+Concurrent duplicate checkouts: N simultaneous create_order calls with the same
+idempotency key must produce exactly one order.
+
+    python benchmarks/checkout_race.py --callbacks 50
+
+Runs against DATABASE_URL; creates a test user, category and product if needed.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import db  # noqa: E402
+import async_db  # noqa: E402
+from handlers.user import checkout_key  # noqa: E402
+
+USER_ID = 999000111
+
+
+def prepare() -> list:
+    db.create_tables()
+    db.add_user(USER_ID, "race", "Race Test", "998000000000")
+    db.add_category("Race test")
+    category_id = next(c[0] for c in db.get_categories() if c[1] == "Race test")
+    db.add_product(category_id, f"Race product {uuid.uuid4().hex[:6]}", 1000)
+    product_id = max(p[0] for p in db.get_products() if p[1] == category_id)
+    return [{"product_id": product_id, "name": "Race product", "price": 1000, "quantity": 2}]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--callbacks", type=int, default=50)
+    args = parser.parse_args()
+
+    cart = prepare()
+    location = [41.31, 69.28]
+    key = checkout_key(USER_ID, uuid.uuid4().hex, cart, location)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(
+        async_db.create_order(USER_ID, cart, "41.31, 69.28", idempotency_key=key)
+        for _ in range(args.callbacks)
+    ))
+    elapsed = time.perf_counter() - started
+
+    order_ids = {result[0] for result in results if result}
+    created = sum(1 for result in results if result and result[1])
+    print(f"{args.callbacks} concurrent checkouts in {elapsed * 1000:.1f} ms: "
+          f"{created} created, order ids {sorted(order_ids)}")
+    ok = created == 1 and len(order_ids) == 1 and None not in results
+    print("ok" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
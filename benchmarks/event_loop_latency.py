@@ -0,0 +1,81 @@
+"""
+Event-loop latency under concurrent simulated users: blocking db.py vs async_db.py.
+
+Every simulated user repeatedly browses a category (the query behind category_selection)
+while a probe task measures how late the event loop wakes it up.
+
+    python benchmarks/event_loop_latency.py --users 50 --requests 20 --query-ms 20
+
+Requires DATABASE_URL (and the other variables config.py reads) to point at a test database.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import db  # noqa: E402
+import async_db  # noqa: E402
+
+PROBE_INTERVAL = 0.005
+
+
+def slow_query(ms: int):
+    """A browse query padded with pg_sleep to emulate a loaded server."""
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_sleep(%s)", (ms / 1000,))
+        cursor.execute("SELECT * FROM Products WHERE category_id = %s ORDER BY name", (1,))
+        return cursor.fetchall()
+
+
+async def probe(lags: list, stop: asyncio.Event):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(loop.time() - started - PROBE_INTERVAL)
+
+
+async def simulated_user(mode: str, requests: int, query_ms: int):
+    for _ in range(requests):
+        if mode == "blocking":
+            slow_query(query_ms)
+        else:
+            await async_db.run(slow_query, query_ms)
+        await asyncio.sleep(0)
+
+
+async def run(mode: str, users: int, requests: int, query_ms: int):
+    lags = []
+    stop = asyncio.Event()
+    probe_task = asyncio.create_task(probe(lags, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(simulated_user(mode, requests, query_ms) for _ in range(users)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe_task
+
+    lags.sort()
+    p50 = statistics.median(lags) * 1000
+    p99 = lags[int(len(lags) * 0.99) - 1] * 1000 if len(lags) > 1 else lags[0] * 1000
+    print(f"{mode:>9}: {users * requests / elapsed:8.1f} queries/s, "
+          f"loop lag p50 {p50:7.2f} ms, p99 {p99:7.2f} ms, max {lags[-1] * 1000:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=20, help="queries per user")
+    parser.add_argument("--query-ms", type=int, default=20, help="server-side delay per query")
+    args = parser.parse_args()
+
+    for mode in ("blocking", "async"):
+        asyncio.run(run(mode, args.users, args.requests, args.query_ms))
+
+
+if __name__ == "__main__":
+    main()
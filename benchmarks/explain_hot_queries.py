@@ -0,0 +1,150 @@
+"""
+EXPLAIN-based check that the hot queries in db.py use index scans.
+
+Applies the migrations to DATABASE_URL, seeds it (once) with generated users, products
+and orders, and fails if any hot query plans a sequential scan on a large table.
+
+    python benchmarks/explain_hot_queries.py --orders 1000000
+
+Run it against a scratch database: seeding inserts millions of rows.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import db  # noqa: E402
+
+# (name, query, params) copied from db.py; keep them in step with it
+HOT_QUERIES = [
+    ("user_exists", "SELECT 1 FROM Users WHERE user_id = %s", (4242,)),
+    ("get_products_by_category", f'''
+        SELECT product_id, category_id, name, price FROM Products
+        WHERE category_id = %s AND {db.IN_STOCK} ORDER BY name
+    ''', (7,)),
+    ("get_user_orders", '''
+        SELECT Orders.order_id, Orders.status, COALESCE(Products.name, '—'), OrderItems.quantity, OrderItems.price
+        FROM Orders
+        JOIN OrderItems ON OrderItems.order_id = Orders.order_id
+        LEFT JOIN Products ON Products.product_id = OrderItems.product_id
+        WHERE Orders.user_id = %s
+        ORDER BY Orders.status, Orders.order_id, OrderItems.item_id
+    ''', (4242,)),
+    ("get_order items", '''
+        SELECT COALESCE(Products.name, '—'), OrderItems.quantity, OrderItems.price
+        FROM OrderItems
+        LEFT JOIN Products ON Products.product_id = OrderItems.product_id
+        WHERE OrderItems.order_id = %s
+        ORDER BY OrderItems.item_id
+    ''', (500000,)),
+    ("get_users_page (first page)",
+     "SELECT user_id, username FROM Users ORDER BY COALESCE(username, ''), user_id LIMIT %s", (20,)),
+    ("get_users_page (next page)", '''
+        SELECT user_id, username FROM Users
+        WHERE (COALESCE(username, ''), user_id) >
+              (SELECT COALESCE(username, ''), user_id FROM Users WHERE user_id = %s)
+        ORDER BY COALESCE(username, ''), user_id
+        LIMIT %s
+    ''', (4242, 20)),
+    ("get_users_page (previous page)", '''
+        SELECT user_id, username FROM Users
+        WHERE (COALESCE(username, ''), user_id) <
+              (SELECT COALESCE(username, ''), user_id FROM Users WHERE user_id = %s)
+        ORDER BY COALESCE(username, '') DESC, user_id DESC
+        LIMIT %s
+    ''', (4242, 20)),
+    ("search_products", f'''
+        SELECT product_id, category_id, name, price FROM Products
+        WHERE {db.IN_STOCK} AND to_tsvector('simple', name) @@ to_tsquery('simple', 'product:* & 42:*')
+        ORDER BY starts_with(lower(name), 'product') DESC, length(name), lower(name), product_id
+        LIMIT 20
+    ''', ()),
+    ("delete_product (ON DELETE SET NULL lookup)",
+     "SELECT 1 FROM OrderItems WHERE product_id = %s", (17,)),
+]
+
+LARGE_TABLES = {"users", "products", "orders", "orderitems"}
+
+
+def seed(cursor, users: int, categories: int, products: int, orders: int) -> None:
+    cursor.execute("SELECT COUNT(*) FROM Orders")
+    if cursor.fetchone()[0] >= orders:
+        return
+
+    print(f"Seeding {users} users, {products} products, {orders} orders...")
+    started = time.perf_counter()
+    cursor.execute('''
+        INSERT INTO Users (user_id, username, full_name, phone_number)
+        SELECT g, 'user' || g, 'User ' || g, '998' || g FROM generate_series(1, %s) g
+        ON CONFLICT DO NOTHING
+    ''', (users,))
+    cursor.execute('''
+        INSERT INTO Categories (name)
+        SELECT 'Category ' || g FROM generate_series(1, %s) g
+        ON CONFLICT DO NOTHING
+    ''', (categories,))
+    cursor.execute('''
+        INSERT INTO Products (category_id, name, price)
+        SELECT (SELECT MIN(category_id) FROM Categories) + g %% %s, 'Product ' || g, 1000 + g %% 50000
+        FROM generate_series(1, %s) g
+    ''', (categories, products))
+    cursor.execute('''
+        INSERT INTO Orders (user_id, location, status, created_at)
+        SELECT 1 + g %% %s, '41.3, 69.2', CASE WHEN g %% 10 = 0 THEN 'New' ELSE 'Done' END,
+               NOW() - (g %% 365) * INTERVAL '1 day'
+        FROM generate_series(1, %s) g
+    ''', (users, orders))
+    cursor.execute('''
+        INSERT INTO OrderItems (order_id, product_id, quantity, price)
+        SELECT Orders.order_id, Products.product_id, 1 + Orders.order_id %% 3, Products.price
+        FROM Orders
+        JOIN Products ON Products.product_id = (SELECT MIN(product_id) FROM Products) + Orders.order_id %% %s
+    ''', (products,))
+    cursor.execute("ANALYZE")
+    print(f"Seeded in {time.perf_counter() - started:.1f}s")
+
+
+def seq_scans(plan: dict) -> list:
+    """Returns the large tables scanned sequentially anywhere in the plan."""
+    found = []
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") in LARGE_TABLES:
+        found.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        found.extend(seq_scans(child))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--categories", type=int, default=20)
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--orders", type=int, default=1000000)
+    args = parser.parse_args()
+
+    db.create_tables()
+    failed = False
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        seed(cursor, args.users, args.categories, args.products, args.orders)
+        conn.commit()
+
+        for name, query, params in HOT_QUERIES:
+            cursor.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + query, params)
+            result = cursor.fetchone()[0]
+            result = json.loads(result) if isinstance(result, str) else result
+            plan = result[0]["Plan"]
+            scans = seq_scans(plan)
+            status = "FAIL" if scans else "ok"
+            failed = failed or bool(scans)
+            detail = f" (seq scan on {', '.join(scans)})" if scans else ""
+            print(f"{status:>4}  {name}: {result[0]['Execution Time']:.2f} ms{detail}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+Memory and throughput of the admin order export on a large generated order history.
+
+Generates --orders orders (one or two items each, five seconds apart from 2023-01-01) for
+benchmark users with IDs from 6e9 up, then exports growing date ranges covering the given
+fractions of them with order_export.write_orders. Each export runs in a fresh process, so
+its peak RSS (Linux VmHWM) is its own:
+
+    python benchmarks/export_memory.py --orders 5000000 --fractions 0.01,0.1,1
+
+Peak RSS should stay flat while the row count grows a hundredfold. --naive adds the same
+exports done with fetchall() for comparison. The generated orders are kept between runs and
+regenerated only when --orders changes; --drop deletes them.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+USER_BASE = 6_000_000_000
+USERS = 10_000
+CATEGORY = "Export benchmark"
+START = datetime(2023, 1, 1)
+INTERVAL = 5  # seconds between generated orders
+
+
+def generated_orders(db) -> int:
+    with db.reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM Orders WHERE user_id >= %s AND user_id < %s",
+                       (USER_BASE, USER_BASE + USERS))
+        return cursor.fetchone()[0]
+
+
+def drop(db) -> None:
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM Orders WHERE user_id >= %s AND user_id < %s", (USER_BASE, USER_BASE + USERS))
+        cursor.execute("DELETE FROM Users WHERE user_id >= %s AND user_id < %s", (USER_BASE, USER_BASE + USERS))
+        conn.commit()
+
+
+def generate(db, orders: int) -> None:
+    drop(db)
+    sqlite = db.get_engine().name == "sqlite"
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            "INSERT INTO Users (user_id, username, full_name, phone_number) VALUES (%s, %s, %s, %s)",
+            [(USER_BASE + n, f"export{n}", f"Покупатель {n}", f"99890{n:07d}") for n in range(USERS)]
+        )
+        cursor.execute("INSERT INTO Categories (name) VALUES (%s) ON CONFLICT DO NOTHING", (CATEGORY,))
+        cursor.execute("SELECT category_id FROM Categories WHERE name = %s", (CATEGORY,))
+        category_id = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM Products WHERE category_id = %s", (category_id,))
+        if cursor.fetchone()[0] == 0:
+            cursor.executemany(
+                "INSERT INTO Products (category_id, name, price) VALUES (%s, %s, %s)",
+                [(category_id, f"Товар {n}", 10000 + n * 500) for n in range(100)]
+            )
+        cursor.execute("SELECT MIN(product_id) FROM Products WHERE category_id = %s", (category_id,))
+        first_product = cursor.fetchone()[0]
+
+        # Generated in the database: no rows travel through Python
+        if sqlite:
+            cursor.execute('''
+                WITH RECURSIVE series (n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM series WHERE n < %s)
+                INSERT INTO Orders (user_id, location, status, created_at)
+                SELECT %s + n %% %s, '41.31, 69.28', CASE WHEN n %% 10 = 0 THEN 'Cancelled' ELSE 'New' END,
+                       datetime(%s, '+' || (n * %s) || ' seconds')
+                FROM series
+            ''', (orders, USER_BASE, USERS, START.isoformat(" "), INTERVAL))
+        else:
+            cursor.execute('''
+                INSERT INTO Orders (user_id, location, status, created_at)
+                SELECT %s + n %% %s, '41.31, 69.28', CASE WHEN n %% 10 = 0 THEN 'Cancelled' ELSE 'New' END,
+                       %s::timestamp + n * make_interval(secs => %s)
+                FROM generate_series(1, %s) AS n
+            ''', (USER_BASE, USERS, START, INTERVAL, orders))
+        cursor.execute('''
+            INSERT INTO OrderItems (order_id, product_id, quantity, price)
+            SELECT Orders.order_id, %s + (Orders.order_id + item.n) %% 100, 1 + Orders.order_id %% 3, 10000
+            FROM Orders
+            JOIN (SELECT 1 AS n UNION ALL SELECT 2) AS item ON item.n = 1 OR Orders.order_id %% 2 = 0
+            WHERE Orders.user_id >= %s AND Orders.user_id < %s
+        ''', (first_product, USER_BASE, USER_BASE + USERS))
+        conn.commit()
+    if not sqlite:
+        with db.connection() as conn:
+            conn.cursor().execute("ANALYZE Orders; ANALYZE OrderItems")
+            conn.commit()
+
+
+def memory_kb(field: str) -> int:
+    """VmRSS (current) or VmHWM (peak) of this process; unlike ru_maxrss, VmHWM starts afresh at exec."""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    raise KeyError(field)
+
+
+def worker(orders: int, fraction: float, naive: bool) -> dict:
+    import db
+    import order_export
+    from order_export import ExportFilters
+
+    date_to = (START + timedelta(seconds=orders * fraction * INTERVAL)).date()
+    filters = ExportFilters(date(2023, 1, 1), date_to)
+    baseline = memory_kb("VmRSS")
+    started = time.perf_counter()
+    with tempfile.TemporaryFile() as file:
+        if naive:
+            # What a fetchall()-style export would do: the whole result in memory, then written
+            batches = list(db.stream_orders(filters.date_from, filters.date_to + timedelta(days=1),
+                                            batch_size=10 ** 9))
+            original, db.stream_orders = db.stream_orders, lambda *args, **kwargs: iter(batches)
+            rows = order_export.write_orders(file, filters)
+            db.stream_orders = original
+        else:
+            rows = order_export.write_orders(file, filters)
+        size = file.tell()
+    elapsed = time.perf_counter() - started
+    return {
+        "rows": rows,
+        "seconds": elapsed,
+        "size": size,
+        "baseline_kb": baseline,
+        "peak_kb": memory_kb("VmHWM"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=5_000_000)
+    parser.add_argument("--fractions", default="0.01,0.1,1", help="comma-separated shares of the orders to export")
+    parser.add_argument("--naive", action="store_true", help="also export with fetchall() for comparison")
+    parser.add_argument("--drop", action="store_true", help="delete the generated orders and exit")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        fraction, naive = args.worker.split(":")
+        print(json.dumps(worker(args.orders, float(fraction), naive == "naive")))
+        return
+
+    import db
+    db.create_tables()
+    if args.drop:
+        drop(db)
+        return
+    if generated_orders(db) != args.orders:
+        print(f"Generating {args.orders} orders…", flush=True)
+        started = time.perf_counter()
+        generate(db, args.orders)
+        print(f"Generated in {time.perf_counter() - started:.0f}s")
+
+    print(f"{'mode':>8} {'fraction':>8} {'rows':>10} {'seconds':>8} {'rows/s':>9} {'MB gz':>7} "
+          f"{'RSS MB':>7} {'peak MB':>8}")
+    for mode in ["stream"] + (["naive"] if args.naive else []):
+        for fraction in args.fractions.split(","):
+            process = subprocess.run(
+                [sys.executable, __file__, "--orders", str(args.orders), "--worker", f"{fraction}:{mode}"],
+                capture_output=True, text=True
+            )
+            if process.returncode != 0:
+                sys.exit(f"{mode} export of {fraction} failed:\n{process.stderr}")
+            result = json.loads(process.stdout.strip().splitlines()[-1])
+            print(f"{mode:>8} {float(fraction):>8} {result['rows']:>10} {result['seconds']:>8.1f} "
+                  f"{result['rows'] / result['seconds']:>9.0f} {result['size'] / 2 ** 20:>7.1f} "
+                  f"{result['baseline_kb'] / 1024:>7.0f} {result['peak_kb'] / 1024:>8.0f}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
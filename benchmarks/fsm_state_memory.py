@@ -0,0 +1,59 @@
+"""
+FSM memory: a copy of the product list per user vs. a category id and catalog version.
+
+Fills aiogram's MemoryStorage the way product_listing does for N concurrent shoppers,
+once with the old per-user product list and once with the shared-catalog state.
+
+    python benchmarks/fsm_state_memory.py --users 5000 --products 200
+
+Needs no database.
+"""
+import argparse
+import asyncio
+import tracemalloc
+
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+
+
+def generate_products(count: int, category_id: int = 1):
+    # Shaped like a fetchall() row from Products
+    return [(i, category_id, f"Product {i:05d}", 10000 + i * 10) for i in range(1, count + 1)]
+
+
+async def fill(storage: MemoryStorage, users: int, products: int, shared: bool) -> None:
+    catalog = generate_products(products)
+    for user_id in range(users):
+        common = {"selected_category": (1, "Category"), "product_list_message_id": 1000 + user_id}
+        if shared:
+            await storage.update_data(chat=user_id, user=user_id, data=dict(common, category_id=1, catalog_version=1))
+        else:
+            # Every product_listing call fetched its own copy of the rows (new tuples and strings)
+            rows = [(pid, cid, name.encode().decode(), price) for pid, cid, name, price in catalog]
+            await storage.update_data(chat=user_id, user=user_id, data=dict(common, category_id=1, products=rows))
+
+
+def measure(users: int, products: int, shared: bool) -> int:
+    storage = MemoryStorage()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    asyncio.run(fill(storage, users, products, shared))
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--products", type=int, default=200, help="products in the browsed category")
+    args = parser.parse_args()
+
+    copied = measure(args.users, args.products, shared=False)
+    shared = measure(args.users, args.products, shared=True)
+    print(f"{args.users} users browsing a {args.products}-product category:")
+    print(f"  product list in state: {copied / 2**20:8.2f} MiB ({copied / args.users:8.0f} B/user)")
+    print(f"  category + version:    {shared / 2**20:8.2f} MiB ({shared / args.users:8.0f} B/user)")
+
+
+if __name__ == "__main__":
+    main()
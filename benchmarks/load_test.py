@@ -0,0 +1,277 @@
+"""
+Load test of the real Dispatcher from bot.py against a fake Bot API server and DATABASE_URL.
+
+Synthetic mode: N users walk the whole order flow concurrently, each sending its next
+update once the previous one is processed:
+
+    /start -> name -> contact -> 🛍 Заказать -> location -> category -> product
+    -> + -> + -> add to cart -> checkout
+
+    python benchmarks/load_test.py --users 200 --api-latency 30 --record run.jsonl
+
+Replay mode processes recorded updates (one Update JSON per line), each user's updates in
+order and different users concurrently:
+
+    python benchmarks/load_test.py --replay run.jsonl
+
+Both print p50/p99 latency per step and overall, and updates per second. Synthetic users get
+IDs from --user-base up; they and their orders are deleted before each run. Run it against
+a scratch database, PostgreSQL or SQLite (DATABASE_URL=sqlite:///load_test.db).
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from aiohttp import web
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+CATEGORY = "Load test"
+
+
+class FakeBotAPI:
+    """Answers Bot API methods with plausible results and remembers each chat's inline keyboards."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = defaultdict(int)
+        self.message_ids = itertools.count(1)
+        self.last_inline = {}  # chat_id -> (message_id, callback data of the buttons)
+
+    def message(self, chat_id, **fields) -> dict:
+        message = {"message_id": next(self.message_ids), "date": int(time.time()),
+                   "chat": {"id": int(chat_id), "type": "private"}}
+        message.update(fields)
+        return message
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = dict(await request.post())
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        chat_id = data.get("chat_id", 0)
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Load test", "username": "load_test_bot"}
+        elif method in ("sendMessage", "editMessageText"):
+            if method == "sendMessage":
+                result = self.message(chat_id, text=data.get("text", ""))
+            else:
+                result = self.message(chat_id, text=data.get("text", ""))
+                result["message_id"] = int(data.get("message_id", result["message_id"]))
+            markup = json.loads(data["reply_markup"]) if data.get("reply_markup") else {}
+            if "inline_keyboard" in markup:
+                buttons = [button["callback_data"] for row in markup["inline_keyboard"] for button in row
+                           if "callback_data" in button]
+                self.last_inline[int(chat_id)] = (result["message_id"], buttons)
+        elif method == "sendPhoto":
+            result = self.message(chat_id, photo=[{"file_id": "photo", "file_unique_id": "photo",
+                                                   "width": 1, "height": 1}])
+        elif method == "sendLocation":
+            result = self.message(chat_id, location={"latitude": float(data.get("latitude", 0)),
+                                                     "longitude": float(data.get("longitude", 0))})
+        else:
+            # answerCallbackQuery, deleteMessage, answerInlineQuery, ...
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self, port: int) -> web.AppRunner:
+        app = web.Application(client_max_size=10 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        return runner
+
+
+class Updates:
+    """Builds Telegram updates sent by one simulated user."""
+
+    ids = itertools.count(1)
+
+    def __init__(self, user_id: int):
+        self.user = {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}
+        self.chat = {"id": user_id, "type": "private"}
+
+    def message(self, text: str = None, **fields) -> dict:
+        message = {"message_id": next(self.ids), "date": int(time.time()), "chat": self.chat, "from": self.user}
+        if text is not None:
+            message["text"] = text
+            if text.startswith("/"):
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+        message.update(fields)
+        return {"update_id": next(self.ids), "message": message}
+
+    def callback(self, message_id: int, data: str) -> dict:
+        return {"update_id": next(self.ids), "callback_query": {
+            "id": str(next(self.ids)), "from": self.user, "chat_instance": str(self.user["id"]), "data": data,
+            "message": {"message_id": message_id, "date": int(time.time()), "chat": self.chat, "text": ""},
+        }}
+
+
+def prepare_database(user_base: int, users: int) -> None:
+    import db
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        user_range = (user_base, user_base + users)
+        cursor.execute("DELETE FROM Orders WHERE user_id >= %s AND user_id < %s", user_range)
+        cursor.execute("DELETE FROM Users WHERE user_id >= %s AND user_id < %s", user_range)
+        cursor.execute("INSERT INTO Categories (name) VALUES (%s) ON CONFLICT DO NOTHING", (CATEGORY,))
+        cursor.execute("SELECT category_id FROM Categories WHERE name = %s", (CATEGORY,))
+        category_id = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM Products WHERE category_id = %s", (category_id,))
+        if cursor.fetchone()[0] == 0:
+            cursor.executemany(
+                "INSERT INTO Products (category_id, name, price) VALUES (%s, %s, %s)",
+                [(category_id, f"Load test product {n}", 10000 + n * 1000) for n in range(1, 31)]
+            )
+
+
+async def run_user(dispatcher, api: FakeBotAPI, user_id: int, latencies, recorded, think_time: float) -> None:
+    from aiogram import types
+
+    updates = Updates(user_id)
+
+    async def send(step: str, update: dict) -> None:
+        recorded.append(update)
+        started = time.perf_counter()
+        await dispatcher.process_updates([types.Update(**update)])
+        latencies[step].append(time.perf_counter() - started)
+        if think_time:
+            await asyncio.sleep(think_time)
+
+    def tap(data: str) -> dict:
+        message_id, buttons = api.last_inline[user_id]
+        if data not in buttons:
+            raise RuntimeError(f"user {user_id}: no {data!r} button in {buttons}")
+        return updates.callback(message_id, data)
+
+    await send("start", updates.message("/start"))
+    await send("name", updates.message(f"User {user_id}"))
+    await send("contact", updates.message(contact={"phone_number": f"998{user_id}", "first_name": "User",
+                                                   "user_id": user_id}))
+    await send("order", updates.message("🛍 Заказать"))
+    await send("location", updates.message(location={"latitude": 41.31, "longitude": 69.28}))
+    await send("category", updates.message(CATEGORY))
+    await send("product", tap("item_0"))
+    await send("quantity", tap("increase_quantity"))
+    await send("quantity", tap("increase_quantity"))
+    await send("add_to_cart", tap("add_to_cart"))
+    await send("checkout", tap("checkout_order"))
+
+
+async def replay(dispatcher, path: str, latencies) -> int:
+    from aiogram import types
+    from middlewares import update_user_id
+
+    by_user = defaultdict(list)
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                update = types.Update(**json.loads(line))
+                by_user[update_user_id(update)].append(update)
+
+    async def run(updates):
+        for update in updates:
+            started = time.perf_counter()
+            await dispatcher.process_updates([update])
+            kind = next((name for name in ("message", "callback_query", "inline_query") if update[name]), "other")
+            latencies[kind].append(time.perf_counter() - started)
+
+    await asyncio.gather(*(run(updates) for updates in by_user.values()))
+    return sum(len(updates) for updates in by_user.values())
+
+
+def percentile(values, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def report(latencies, elapsed: float) -> None:
+    everything = [value for values in latencies.values() for value in values]
+    print(f"{'step':>14} {'count':>7} {'p50 ms':>8} {'p99 ms':>8}")
+    for step, values in list(latencies.items()) + [("all", everything)]:
+        print(f"{step:>14} {len(values):>7} {statistics.median(values) * 1000:>8.1f} "
+              f"{percentile(values, 0.99) * 1000:>8.1f}")
+    print(f"{len(everything)} updates in {elapsed:.2f}s: {len(everything) / elapsed:.0f} updates/s")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--user-base", type=int, default=7_000_000_000)
+    parser.add_argument("--api-latency", type=float, default=0.0, help="fake Bot API latency in milliseconds")
+    parser.add_argument("--think-time", type=float, default=0.0, help="pause between a user's updates in ms")
+    parser.add_argument("--api-port", type=int, default=8099)
+    parser.add_argument("--record", help="write the synthetic updates to this .jsonl file")
+    parser.add_argument("--replay", help="replay updates from this .jsonl file instead")
+    args = parser.parse_args()
+
+    # bot.py reads its configuration on import
+    os.environ["TELEGRAM_API_URL"] = f"http://127.0.0.1:{args.api_port}"
+    os.environ.setdefault("BOT_TOKEN", "123456:load-test")
+    os.environ.setdefault("GROUP_CHAT_ID", "-100")
+    os.environ.setdefault("ADMIN_ID", "1")
+    os.environ["METRICS_PORT"] = "0"
+    os.environ["FSM_STORAGE_PATH"] = os.path.join(tempfile.mkdtemp(), "fsm.db")
+
+    api = FakeBotAPI(args.api_latency / 1000)
+    runner = await api.start(args.api_port)
+
+    import logging
+    from aiogram import Bot, Dispatcher
+    import bot as app
+    logging.getLogger().setLevel(logging.WARNING)
+
+    dispatcher = app.dp
+    Bot.set_current(dispatcher.bot)
+    Dispatcher.set_current(dispatcher)
+    prepare_database(args.user_base, args.users)
+    await app.on_startup(dispatcher)
+
+    latencies = defaultdict(list)
+    started = time.perf_counter()
+    try:
+        if args.replay:
+            await replay(dispatcher, args.replay, latencies)
+        else:
+            recorded = []
+            await asyncio.gather(*(
+                run_user(dispatcher, api, args.user_base + n, latencies, recorded, args.think_time / 1000)
+                for n in range(args.users)
+            ))
+            if args.record:
+                with open(args.record, "w") as f:
+                    f.writelines(json.dumps(update, ensure_ascii=False) + "\n" for update in recorded)
+        elapsed = time.perf_counter() - started
+    finally:
+        await app.on_shutdown(dispatcher)
+        await dispatcher.storage.close()
+        await dispatcher.storage.wait_closed()
+        await (await dispatcher.bot.get_session()).close()
+        await runner.cleanup()
+
+    report(latencies, elapsed)
+    print("Bot API calls: " + ", ".join(f"{method} {count}" for method, count in sorted(api.calls.items())))
+    if not args.replay:
+        import db
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM Orders WHERE user_id >= %s AND user_id < %s",
+                           (args.user_base, args.user_base + args.users))
+            orders = cursor.fetchone()[0]
+        print(f"{orders}/{args.users} orders created")
+        sys.exit(0 if orders == args.users else 1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
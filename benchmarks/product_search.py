@@ -0,0 +1,136 @@
+"""
+Product search latency on a generated catalog: db.search_products (full-text index)
+and the in-memory ProductSearchIndex used when the database is unavailable.
+
+    python benchmarks/product_search.py --products 50000
+
+Seeds DATABASE_URL (once) with products in "Search bench" categories and fails if the
+p99 latency of either search is above --budget milliseconds. --cleanup removes them.
+SQLite has no full-text index and always answers from ProductSearchIndex, so only that
+is measured there.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import db  # noqa: E402
+from search import ProductSearchIndex  # noqa: E402
+
+CATEGORY_PREFIX = "Search bench"
+BRANDS = ["Балтика", "Арсенал", "Жигулёвское", "Охота", "Хамовники", "Сарбаст", "Tuborg", "Carlsberg",
+          "Heineken", "Stella Artois", "Corona", "Hoegaarden", "Grimbergen", "Kozel", "Pilsner Urquell",
+          "Jameson", "Jack Daniel's", "Absolut", "Finlandia", "Царская", "Русский стандарт", "Hennessy",
+          "Martini", "Jägermeister", "Bacardi", "Captain Morgan", "Beluga", "Old Tbilisi", "Киндзмараули",
+          "Хванчкара", "Massandra", "Borjomi", "Coca-Cola", "Pepsi", "Red Bull", "Flash", "Nestle"]
+KINDS = ["светлое", "тёмное", "нефильтрованное", "пшеничное", "лагер", "эль", "портер", "виски", "водка",
+         "коньяк", "ром", "джин", "вино красное", "вино белое", "сухое", "полусладкое", "игристое",
+         "вермут", "ликёр", "энергетик", "газировка", "сок", "вода"]
+VOLUMES = ["0.33л", "0.5л", "0.7л", "0.75л", "1л", "1.5л", "2л", "ж/б", "стекло", "ПЭТ"]
+QUERIES = ["балт", "балтика светлое", "jack", "вино красное", "коньяк 0.5", "heineken 0.33",
+           "хамов", "пшен", "red bull", "ликёр", "carls", "водка 1л", "сар", "stella", "ром 0.7",
+           "игрист", "old", "borjomi 0.5", "нефильтр", "несуществующий товар"]
+
+
+def product_name(rng: random.Random, n: int) -> str:
+    return f"{rng.choice(BRANDS)} {rng.choice(KINDS)} {rng.choice(VOLUMES)} #{n}"
+
+
+def seed(products: int, categories: int) -> None:
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT COUNT(*) FROM Products
+            JOIN Categories ON Categories.category_id = Products.category_id
+            WHERE Categories.name LIKE %s
+        ''', (CATEGORY_PREFIX + "%",))
+        if cursor.fetchone()[0] >= products:
+            return
+
+        print(f"Seeding {products} products...")
+        cursor.executemany("INSERT INTO Categories (name) VALUES (%s) ON CONFLICT DO NOTHING",
+                           [(f"{CATEGORY_PREFIX} {n}",) for n in range(1, categories + 1)])
+        cursor.execute("SELECT category_id FROM Categories WHERE name LIKE %s", (CATEGORY_PREFIX + "%",))
+        category_ids = [row[0] for row in cursor.fetchall()]
+        rng = random.Random(42)
+        rows = [(rng.choice(category_ids), product_name(rng, n), rng.randrange(5000, 500000, 1000))
+                for n in range(products)]
+        db.get_engine().copy_rows(cursor, "Products", ("category_id", "name", "price"), rows)
+        cursor.execute("ANALYZE Products")
+
+
+def cleanup() -> None:
+    with db.connection() as conn:
+        conn.cursor().execute("DELETE FROM Categories WHERE name LIKE %s", (CATEGORY_PREFIX + "%",))
+
+
+def measure(search, rounds: int) -> list:
+    timings = []
+    for _ in range(rounds):
+        for query in QUERIES:
+            started = time.perf_counter()
+            search(query)
+            timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def report(name: str, timings: list) -> float:
+    timings = sorted(timings)
+    p99 = timings[int(len(timings) * 0.99) - 1]
+    print(f"{name}: p50 {statistics.median(timings):.2f} ms, p99 {p99:.2f} ms, max {timings[-1]:.2f} ms")
+    return p99
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=50000)
+    parser.add_argument("--categories", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--budget", type=float, default=20.0, help="p99 budget in milliseconds")
+    parser.add_argument("--cleanup", action="store_true", help="remove the generated products and exit")
+    args = parser.parse_args()
+
+    db.create_tables()
+    if args.cleanup:
+        cleanup()
+        return
+    seed(args.products, args.categories)
+
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT product_id, category_id, name, price FROM Products")
+        products = cursor.fetchall()
+        if db.get_engine().name == "sqlite":
+            plan = None
+        else:
+            cursor.execute('''
+                EXPLAIN SELECT product_id FROM Products
+                WHERE to_tsvector('simple', name) @@ to_tsquery('simple', 'балт:*')
+            ''')
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+
+    db_p99 = 0.0
+    if plan is None:
+        print(f"{len(products)} products; sqlite: searched in memory only")
+    else:
+        print(f"{len(products)} products; search index used: {'idx_products_name_search' in plan}")
+        for query in QUERIES[:5]:
+            print(f"  {query!r}: {[p[2] for p in db.search_products(query, 3)]}")
+        db_p99 = report("db.search_products", measure(lambda q: db.search_products(q), args.rounds))
+
+    started = time.perf_counter()
+    index = ProductSearchIndex(products)
+    print(f"ProductSearchIndex built in {(time.perf_counter() - started) * 1000:.0f} ms")
+    memory_p99 = report("ProductSearchIndex.search", measure(lambda q: index.search(q), args.rounds))
+
+    ok = db_p99 < args.budget and memory_p99 < args.budget
+    print("ok" if ok else f"FAIL: p99 above {args.budget} ms")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
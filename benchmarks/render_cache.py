@@ -0,0 +1,66 @@
+"""
+Per-tap CPU cost of rendering a category page in the order flow, with and without
+the render cache of the catalog snapshot.
+
+    python benchmarks/render_cache.py --products 200 --taps 20000
+
+"render" is building the page text and keyboard; "render + serialise" adds the JSON
+encoding aiogram does for every request, which the cache does not save.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from catalog import CatalogSnapshot  # noqa: E402
+from handlers.user import items_per_page, listed_page, product_page  # noqa: E402
+
+
+def per_tap(taps: int, pages: int, tap) -> float:
+    """Microseconds per tap, cycling through the category's pages."""
+    started = time.process_time()
+    for n in range(taps):
+        tap(n % pages + 1)
+    return (time.process_time() - started) / taps * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=200, help="products in the category")
+    parser.add_argument("--taps", type=int, default=20000)
+    args = parser.parse_args()
+
+    products = [(n, 1, f"Product {n} светлое 0.5л", 12000 + n * 500) for n in range(1, args.products + 1)]
+    snapshot = CatalogSnapshot(1, [(1, "Пиво")], products)
+    listed = snapshot.products_by_category[1]
+    pages = (len(listed) - 1) // items_per_page + 1
+    user_data = {"category_id": 1, "search_results": None}
+
+    def uncached(page):
+        return product_page(listed, page)
+
+    def cached(page):
+        return listed_page(user_data, snapshot, listed, page)
+
+    def serialised(render):
+        def tap(page):
+            text, keyboard = render(page)
+            json.dumps(keyboard.to_python())
+        return tap
+
+    print(f"{args.products} products, {pages} pages, {args.taps} taps")
+    for name, before, after in [
+        ("render", uncached, cached),
+        ("render + serialise", serialised(uncached), serialised(cached)),
+    ]:
+        before_us = per_tap(args.taps, pages, before)
+        after_us = per_tap(args.taps, pages, after)
+        print(f"{name:>18}: {before_us:7.1f} us/tap uncached, {after_us:7.1f} us/tap cached "
+              f"({before_us / after_us:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Admin analytics from the summary tables vs the same numbers computed ad hoc from Orders.
+
+Run it against a database with a sizeable order history, e.g. after
+benchmarks/export_memory.py has generated its orders:
+
+    python benchmarks/sales_summary.py --repeat 20
+
+Prints the median time of db.get_sales_summary and of the equivalent aggregate queries over
+Orders and OrderItems for the last 1, 7 and 30 days, and checks that they agree, after adding
+the orders still queued for the summary (db.refresh_sales_summary). They will not agree
+if orders were deleted outside create_order, as the other benchmarks do with theirs: --rebuild
+first recomputes the summary tables (db.rebuild_sales_summary) and reports how long that took.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+
+def ad_hoc_summary(db, days: int, top: int = 10) -> dict:
+    """get_sales_summary's numbers straight from the order history."""
+    if db.get_engine().name == "sqlite":
+        day, since, param = "date(Orders.created_at)", "date('now', %s)", f"-{days - 1} days"
+    else:
+        day, since, param = "Orders.created_at::date", "CURRENT_DATE - %s", days - 1
+    with db.reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT day, COUNT(*), SUM(items), CAST(SUM(revenue) AS BIGINT)
+            FROM (
+                SELECT {day} AS day, SUM(OrderItems.quantity) AS items,
+                       SUM(CAST(OrderItems.quantity AS BIGINT) * OrderItems.price) AS revenue
+                FROM Orders JOIN OrderItems ON OrderItems.order_id = Orders.order_id
+                WHERE {day} >= {since}
+                GROUP BY Orders.order_id, {day}
+            ) AS totals
+            GROUP BY day ORDER BY day DESC
+        ''', (param,))
+        daily = cursor.fetchall()
+        cursor.execute(f'''
+            SELECT COALESCE(MAX(Products.name), '—'), COUNT(DISTINCT Orders.order_id), SUM(OrderItems.quantity),
+                   CAST(SUM(CAST(OrderItems.quantity AS BIGINT) * OrderItems.price) AS BIGINT)
+            FROM Orders
+            JOIN OrderItems ON OrderItems.order_id = Orders.order_id
+            LEFT JOIN Products ON Products.product_id = OrderItems.product_id
+            WHERE {day} >= {since}
+            GROUP BY OrderItems.product_id ORDER BY 3 DESC, 4 DESC LIMIT %s
+        ''', (param, top))
+        products = cursor.fetchall()
+        cursor.execute(f'''
+            SELECT COUNT(DISTINCT Orders.user_id) FROM Orders
+            JOIN OrderItems ON OrderItems.order_id = Orders.order_id
+            WHERE {day} >= {since}
+        ''', (param,))
+        customers = cursor.fetchone()[0]
+    return {"daily": daily, "products": products, "customers": customers}
+
+
+def timed(func, repeat: int):
+    times, result = [], None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--rebuild", action="store_true", help="recompute the summary tables first")
+    args = parser.parse_args()
+
+    import db
+    db.create_tables()
+    with db.reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM Orders")
+        print(f"{db.get_engine().name}, {cursor.fetchone()[0]} orders")
+    if args.rebuild:
+        started = time.perf_counter()
+        if not db.rebuild_sales_summary():
+            sys.exit("rebuild failed")
+        print(f"Summary tables rebuilt in {time.perf_counter() - started:.1f}s")
+    # Checkouts only queue their orders; count the ones the bot's refresher has not reached yet
+    queued = 0
+    while True:
+        added = db.refresh_sales_summary()
+        if added is None:
+            sys.exit("refresh failed")
+        if not added:
+            break
+        queued += added
+    print(f"{queued} queued orders added to the summary")
+
+    print(f"{'days':>5} {'summary ms':>11} {'ad hoc ms':>10} {'orders':>8} {'match':>6}")
+    for days in (1, 7, 30):
+        summary_ms, summary = timed(lambda: db.get_sales_summary(days), args.repeat)
+        ad_hoc_ms, ad_hoc = timed(lambda: ad_hoc_summary(db, days), max(1, args.repeat // 10))
+        # SQLite returns the ad hoc days as text
+        match = ([(str(day), *rest) for day, *rest in summary["daily"]]
+                 == [(str(day), *rest) for day, *rest in ad_hoc["daily"]]
+                 and [row[1:] for row in summary["products"]] == [row[1:] for row in ad_hoc["products"]]
+                 and summary["customers"] == ad_hoc["customers"])
+        orders = sum(row[1] for row in summary["daily"])
+        print(f"{days:>5} {summary_ms:>11.2f} {ad_hoc_ms:>10.1f} {orders:>8} {'yes' if match else 'NO':>6}")
+
+
+if __name__ == "__main__":
+    main()
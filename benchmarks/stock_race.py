@@ -0,0 +1,117 @@
+"""
+Concurrent checkouts for the last units of a product: N simultaneous create_order calls
+compete for a product with S units left. Exactly S units must be sold, the rest of the
+checkouts must fail with OutOfStock and leave nothing behind, and the product must
+disappear from the catalog once it sells out.
+
+    python benchmarks/stock_race.py --checkouts 500 --stock 50
+
+Every cart also holds a product whose stock is not tracked, so a failed checkout that left
+its items behind would show. The same checkouts are then run against a product with stock
+for all of them and one with no stock tracking, to compare the throughput with and without
+the contended decrement.
+Runs against DATABASE_URL; creates a test user, category and products.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import db  # noqa: E402
+import async_db  # noqa: E402
+
+USER_ID = 999000112
+
+
+def add_product(category_id: int, name: str) -> int:
+    db.add_product(category_id, f"{name} {uuid.uuid4().hex[:6]}", 1000)
+    return max(p[0] for p in db.get_products() if p[1] == category_id)
+
+
+def sold(order_ids: list, product_id: int) -> tuple:
+    """(orders, units of product_id) of the given orders as stored."""
+    if not order_ids:
+        return 0, 0
+    with db.reader() as conn:
+        cursor = conn.cursor()
+        placeholders = ", ".join(["%s"] * len(order_ids))
+        cursor.execute(f'''
+            SELECT COUNT(DISTINCT order_id), COALESCE(SUM(quantity), 0) FROM OrderItems
+            WHERE order_id IN ({placeholders}) AND product_id = %s
+        ''', [*order_ids, product_id])
+        return cursor.fetchone()
+
+
+async def checkout(cart: list):
+    try:
+        return await async_db.create_order(USER_ID, cart, "41.31, 69.28", idempotency_key=uuid.uuid4().hex)
+    except db.OutOfStock as e:
+        return e
+
+
+async def race(product_id: int, filler_id: int, checkouts: int, quantity: int):
+    cart = [{"product_id": product_id, "quantity": quantity}, {"product_id": filler_id, "quantity": 1}]
+    started = time.perf_counter()
+    results = await asyncio.gather(*(checkout(cart) for _ in range(checkouts)))
+    return results, time.perf_counter() - started
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checkouts", type=int, default=500)
+    parser.add_argument("--stock", type=int, default=50)
+    parser.add_argument("--quantity", type=int, default=1, help="units of the scarce product per checkout")
+    args = parser.parse_args()
+
+    db.create_tables()
+    db.add_user(USER_ID, "stock", "Stock Test", "998000000001")
+    db.add_category("Stock test")
+    category_id = next(c[0] for c in db.get_categories() if c[1] == "Stock test")
+    product_id = add_product(category_id, "Scarce product")
+    plenty_id = add_product(category_id, "Plentiful product")
+    untracked_id = add_product(category_id, "Untracked product")
+    filler_id = add_product(category_id, "Filler product")
+    db.set_product_stock(product_id, args.stock)
+    db.set_product_stock(plenty_id, args.checkouts * args.quantity)
+    print(f"{db.get_engine().name}: {args.checkouts} concurrent checkouts of {args.quantity} "
+          f"for {args.stock} units in stock")
+
+    results, elapsed = await race(product_id, filler_id, args.checkouts, args.quantity)
+    created = [result[0] for result in results if isinstance(result, tuple) and result[1]]
+    rejected = [result for result in results if isinstance(result, db.OutOfStock)]
+    errors = sum(1 for result in results if result is None)
+    orders, units = sold(created, product_id)
+    filler_orders, _ = sold(created, filler_id)
+    left = db.get_product_by_id(product_id)["stock"]
+    expected = min(args.stock // args.quantity, args.checkouts) * args.quantity
+    listed = product_id in {p[0] for p in (await async_db.get_catalog()).products}
+    print(f"  scarce:    {elapsed * 1000:8.1f} ms, {args.checkouts / elapsed:7.0f} checkouts/s: "
+          f"{len(created)} created, {len(rejected)} out of stock, {errors} errors")
+    print(f"  sold {units} units in {orders} orders, {left} left, "
+          f"{'still' if listed else 'not'} in the catalog")
+
+    baseline_created = {}
+    for name, baseline_id in (("plentiful", plenty_id), ("untracked", untracked_id)):
+        baseline, baseline_elapsed = await race(baseline_id, filler_id, args.checkouts, args.quantity)
+        baseline_created[name] = sum(1 for result in baseline if isinstance(result, tuple) and result[1])
+        print(f"  {name + ':':<10} {baseline_elapsed * 1000:8.1f} ms, {args.checkouts / baseline_elapsed:7.0f} "
+              f"checkouts/s: {baseline_created[name]} created")
+    plenty_left = db.get_product_by_id(plenty_id)["stock"]
+
+    ok = (units == expected and units + left == args.stock and errors == 0
+          and len(created) + len(rejected) == args.checkouts
+          and orders == filler_orders == len(created)
+          and all(available < args.quantity for _, _, available in (r.shortages[0] for r in rejected))
+          and listed == (left > 0)
+          and baseline_created == {"plentiful": args.checkouts, "untracked": args.checkouts}
+          and plenty_left == 0)
+    print("ok" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,158 @@
+"""
+PostgreSQL vs SQLite head to head: the same db.py functions under the same concurrent workload.
+
+Each engine runs in its own process with DATABASE_URL set to it. Worker threads, as many as
+async_db's executor has, run a mix modelled on the bot: product and user lookups, order
+history, admin pages, registrations and checkouts with their outbox rows.
+
+    python benchmarks/storage_engines.py --ops 20000 \
+        --url "$DATABASE_URL" --url sqlite:////tmp/bench.db --url "sqlite:////tmp/bench.db?synchronous=FULL"
+
+On a sqlite: URL, a ?synchronous=... suffix sets SQLITE_SYNCHRONOUS for that run. Prints
+throughput and p50/p99 per operation for each engine. Benchmark users get IDs from 8e9 up
+and are deleted with their orders before each run.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+USER_BASE = 8_000_000_000
+CATEGORY = "Engine benchmark"
+
+# (operation, weight)
+MIX = [
+    ("get_product_by_id", 35),
+    ("get_user", 15),
+    ("get_user_orders", 15),
+    ("get_products_page", 5),
+    ("add_user", 10),
+    ("create_order", 15),
+    ("claim_and_send_outbox", 5),
+]
+
+
+def prepare(db, users: int) -> list:
+    db.create_tables()
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM Orders WHERE user_id >= %s", (USER_BASE,))
+        cursor.execute("DELETE FROM Users WHERE user_id >= %s", (USER_BASE,))
+        cursor.execute("INSERT INTO Categories (name) VALUES (%s) ON CONFLICT DO NOTHING", (CATEGORY,))
+        cursor.execute("SELECT category_id FROM Categories WHERE name = %s", (CATEGORY,))
+        category_id = cursor.fetchone()[0]
+        cursor.execute("SELECT product_id FROM Products WHERE category_id = %s", (category_id,))
+        product_ids = [row[0] for row in cursor.fetchall()]
+        if not product_ids:
+            cursor.executemany(
+                "INSERT INTO Products (category_id, name, price) VALUES (%s, %s, %s)",
+                [(category_id, f"Benchmark product {n}", 1000 + n) for n in range(200)]
+            )
+            cursor.execute("SELECT product_id FROM Products WHERE category_id = %s", (category_id,))
+            product_ids = [row[0] for row in cursor.fetchall()]
+    for n in range(users):
+        db.add_user(USER_BASE + n, f"bench{n}", f"Bench {n}", "998000000000")
+    return product_ids
+
+
+def worker(url: str, ops: int, threads: int, users: int) -> dict:
+    if url.startswith("sqlite:"):
+        url, _, options = url.partition("?")
+        for option in filter(None, options.split("&")):
+            key, _, value = option.partition("=")
+            os.environ[f"SQLITE_{key.upper()}"] = value
+    os.environ["DATABASE_URL"] = url
+    sys.path.insert(0, ROOT)
+    import db
+
+    product_ids = prepare(db, users)
+    new_user_ids = itertools.count(USER_BASE + users)
+    operations, weights = zip(*MIX)
+    rng = random.Random(1)
+    plan = rng.choices(operations, weights, k=ops)
+
+    def run(operation: str) -> tuple:
+        user_id = USER_BASE + random.randrange(users)
+        started = time.perf_counter()
+        if operation == "get_product_by_id":
+            db.get_product_by_id(random.choice(product_ids))
+        elif operation == "get_user":
+            db.get_user(user_id)
+        elif operation == "get_user_orders":
+            db.get_user_orders(user_id)
+        elif operation == "get_products_page":
+            db.get_products_page(after_id=random.choice(product_ids))
+        elif operation == "add_user":
+            db.add_user(next(new_user_ids), "new", "New user", "998000000001")
+        elif operation == "create_order":
+            cart = [{"product_id": product_id, "quantity": random.randint(1, 3)}
+                    for product_id in random.sample(product_ids, random.randint(1, 4))]
+            db.create_order(user_id, cart, "41.31, 69.28", os.urandom(16).hex(), "-100")
+        else:
+            claimed = db.claim_outbox(10)
+            if claimed:
+                db.mark_outbox_sent([row[0] for row in claimed])
+        return operation, time.perf_counter() - started
+
+    latencies = defaultdict(list)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        for operation, seconds in executor.map(run, plan):
+            latencies[operation].append(seconds)
+    elapsed = time.perf_counter() - started
+
+    stats = db.pool_stats()
+    return {
+        "engine": db.get_engine().name,
+        "ops_per_second": ops / elapsed,
+        "latency_ms": {operation: (statistics.median(values) * 1000,
+                                   sorted(values)[int(len(values) * 0.99)] * 1000)
+                       for operation, values in latencies.items()},
+        "transactions_per_commit": stats.get("transactions_per_commit"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", action="append", help="DATABASE_URL to compare; repeat for each engine")
+    parser.add_argument("--ops", type=int, default=20000)
+    parser.add_argument("--threads", type=int, default=int(os.getenv("DB_POOL_MAX", 10)))
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(worker(args.worker, args.ops, args.threads, args.users)))
+        return
+
+    results = []
+    for url in args.url or [os.environ["DATABASE_URL"]]:
+        process = subprocess.run(
+            [sys.executable, __file__, "--worker", url, "--ops", str(args.ops), "--threads", str(args.threads),
+             "--users", str(args.users)],
+            capture_output=True, text=True
+        )
+        if process.returncode != 0:
+            sys.exit(f"{url} failed:\n{process.stderr}")
+        results.append((url, json.loads(process.stdout.strip().splitlines()[-1])))
+
+    for url, result in results:
+        batching = result["transactions_per_commit"]
+        print(f"\n{url} ({result['engine']}): {result['ops_per_second']:.0f} ops/s"
+              + (f", {batching:.2f} transactions per commit" if batching else ""))
+        print(f"{'operation':>22} {'p50 ms':>8} {'p99 ms':>8}")
+        for operation, _ in MIX:
+            p50, p99 = result["latency_ms"][operation]
+            print(f"{operation:>22} {p50:>8.2f} {p99:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,92 @@
 import logging
-from aiogram import Bot, Dispatcher, types
+from aiogram import Dispatcher, types
+from aiogram.bot.api import TELEGRAM_PRODUCTION, TelegramAPIServer
 from aiogram.contrib.middlewares.logging import LoggingMiddleware
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.utils import executor
-from config import BOT_TOKEN
-from db import create_tables
+from config import (BOT_TOKEN, TELEGRAM_API_URL, REGISTERED_USERS_CACHE_SIZE, FSM_STORAGE_PATH, FSM_HOT_SIZE,
+                    FSM_SESSION_TTL, FSM_FLUSH_INTERVAL, BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH,
+                    WEBHOOK_SECRET, WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE,
+                    MAX_PENDING_UPDATES_PER_USER, METRICS_HOST, METRICS_PORT)
+import metrics
+from catalog import catalog
+from db import create_tables, get_user_ids, pool_stats
+from fsm_storage import SQLiteStorage
+from middlewares import UserSerialMiddleware
+from outbox import outbox
+from analytics import sales_summary
+from broadcast import broadcaster
+from edits import message_edits
+from media import media
+from user_cache import registered_users
 from handlers import admin, user
+from webhook import start_webhook
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
-bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
+api_server = TelegramAPIServer.from_base(TELEGRAM_API_URL) if TELEGRAM_API_URL else TELEGRAM_PRODUCTION
+bot = metrics.InstrumentedBot(token=BOT_TOKEN, server=api_server)
+storage = SQLiteStorage(FSM_STORAGE_PATH, hot_size=FSM_HOT_SIZE, ttl=FSM_SESSION_TTL, flush_interval=FSM_FLUSH_INTERVAL)
 dp = Dispatcher(bot, storage=storage)
 dp.middleware.setup(LoggingMiddleware())
+serial_middleware = UserSerialMiddleware(max_pending=MAX_PENDING_UPDATES_PER_USER)
+dp.middleware.setup(serial_middleware)
+dp.middleware.setup(metrics.MetricsMiddleware())
 
 # Create tables on start
 create_tables()
 
+# Warm the registration cache so main-menu taps skip the user_exists query
+registered_users.warm(get_user_ids(REGISTERED_USERS_CACHE_SIZE))
+
 # Register handlers
 admin.register_admin_handlers(dp)
 user.register_user_handlers(dp)
 
+# Gauges read on every scrape and /stats
+metrics.register_stats("db_pool", pool_stats)
+metrics.register_stats("catalog", catalog.stats)
+metrics.register_stats("registered_users", registered_users.stats)
+metrics.register_stats("fsm_storage", storage.stats)
+metrics.register_stats("outbox", outbox.stats)
+metrics.register_stats("sales_summary", sales_summary.stats)
+metrics.register_stats("broadcasts", broadcaster.stats)
+metrics.register_stats("message_edits", message_edits.stats)
+metrics.register_stats("media", media.stats)
+metrics.register_stats("updates", lambda: {"dropped": serial_middleware.dropped})
+metrics_runner = None
+
+
+async def on_startup(dp: Dispatcher):
+    """Runs once the bot starts receiving updates, in either mode."""
+    global metrics_runner
+    outbox.start(dp.bot)
+    sales_summary.start()
+    await broadcaster.start(dp.bot)
+    if METRICS_PORT:
+        metrics_runner = await metrics.start_server(METRICS_HOST, METRICS_PORT)
+
+
+async def on_shutdown(dp: Dispatcher):
+    """Runs before the bot stops, in either mode."""
+    await outbox.stop()
+    await sales_summary.stop()
+    await broadcaster.stop()
+    await message_edits.close()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+
+
 if __name__ == '__main__':
-    executor.start_polling(dp, skip_updates=True)
+    if BOT_MODE == 'webhook':
+        start_webhook(
+            dp, WEBHOOK_PATH, WEBAPP_HOST, WEBAPP_PORT,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            workers=WEBHOOK_WORKERS,
+            queue_size=WEBHOOK_QUEUE_SIZE,
+            admit=serial_middleware.admit,
+            on_startup=on_startup,
+            on_shutdown=on_shutdown,
+        )
+    else:
+        executor.start_polling(dp, skip_updates=True, on_startup=on_startup, on_shutdown=on_shutdown)
@@ -0,0 +1,244 @@
+"""
+Admin broadcasts: one message to every registered user.
+
+Recipients are streamed from the database in user_id order and sent in batches through
+token buckets, a global one at BROADCAST_RATE and one per chat. After each batch the
+progress is saved, so a broadcast interrupted by a restart resumes after the last finished
+batch. The admin gets a status message with the counts and throughput, updated as it goes.
+
+The bot keeps answering users meanwhile: sends are paced below Telegram's global limit
+and the database work runs on a thread and a connection of its own.
+"""
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from aiogram import Bot, types
+from aiogram.utils.exceptions import BadRequest, ChatNotFound, RetryAfter, TelegramAPIError, Unauthorized
+
+import db
+from config import BROADCAST_RATE, BROADCAST_BATCH_SIZE
+from edits import message_edits
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, in bursts of up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Stops handing out tokens for `seconds`, e.g. after a 429."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class _Progress:
+    __slots__ = ("broadcast_id", "admin_chat_id", "text", "total", "last_user_id", "sent", "blocked", "failed",
+                 "started_at", "handled", "status_message", "cancelled")
+
+    def __init__(self, broadcast: dict):
+        self.broadcast_id = broadcast["broadcast_id"]
+        self.admin_chat_id = broadcast["admin_chat_id"]
+        self.text = broadcast["text"]
+        self.total = broadcast["total"]
+        self.last_user_id = broadcast["last_user_id"]
+        self.sent = broadcast["sent"]
+        self.blocked = broadcast["blocked"]
+        self.failed = broadcast["failed"]
+        self.started_at = time.monotonic()
+        self.handled = 0  # recipients handled since this run started, for the throughput
+        self.status_message: Optional[types.Message] = None
+        self.cancelled = False
+
+    def report(self, finished: str = "") -> str:
+        done = self.sent + self.blocked + self.failed
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        return (
+            f"📣 Рассылка #{self.broadcast_id}{finished}: {done}/{self.total}\n"
+            f"Доставлено: {self.sent}\n"
+            f"Заблокировали бота: {self.blocked}\n"
+            f"Ошибок: {self.failed}\n"
+            f"Скорость: {self.handled / elapsed:.1f} сообщ./с"
+        )
+
+
+class Broadcaster:
+    def __init__(self, rate: float = 25.0, per_chat_rate: float = 1.0, batch_size: int = 100,
+                 max_attempts: int = 3):
+        self.bucket = TokenBucket(rate, capacity=rate)
+        self.per_chat_rate = per_chat_rate
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+
+        self.bot: Optional[Bot] = None
+        # Shared by overlapping broadcasts; dropped when the last send to the chat is done
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._chat_senders: Dict[int, int] = {}
+        self._running: Dict[int, _Progress] = {}
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._stopping = False
+        # Broadcast queries never wait behind, or hold up, the handlers' database calls
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="broadcast")
+
+    async def _db(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def start(self, bot: Bot) -> None:
+        """Resumes the broadcasts interrupted by the last shutdown."""
+        self.bot = bot
+        self._stopping = False
+        for broadcast in await self._db(db.get_running_broadcasts):
+            logging.info(f"Resuming broadcast #{broadcast['broadcast_id']} after user {broadcast['last_user_id']}")
+            self._launch(broadcast)
+
+    async def create(self, admin_chat_id: int, text: str) -> Optional[int]:
+        """Starts a broadcast of `text` to all users and returns its ID."""
+        broadcast = await self._db(db.create_broadcast, admin_chat_id, text)
+        if broadcast is None:
+            return None
+        self._launch(broadcast)
+        return broadcast["broadcast_id"]
+
+    def cancel(self, broadcast_id: int) -> bool:
+        """Stops a broadcast after its current batch; it will not be resumed."""
+        progress = self._running.get(broadcast_id)
+        if progress is None:
+            return False
+        progress.cancelled = True
+        return True
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Lets running broadcasts finish their current batch, then stops them until the next start."""
+        self._stopping = True
+        tasks = list(self._tasks.values())
+        if tasks:
+            done, pending = await asyncio.wait(tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def stats(self) -> dict:
+        """Counts over the running broadcasts."""
+        running = list(self._running.values())
+        return {
+            "running": len(running),
+            "total": sum(progress.total for progress in running),
+            "sent": sum(progress.sent for progress in running),
+            "blocked": sum(progress.blocked for progress in running),
+            "failed": sum(progress.failed for progress in running),
+            "chats_in_flight": len(self._chat_buckets),
+        }
+
+    def _launch(self, broadcast: dict) -> None:
+        progress = _Progress(broadcast)
+        self._running[progress.broadcast_id] = progress
+        self._tasks[progress.broadcast_id] = asyncio.get_running_loop().create_task(self._run(progress))
+
+    async def _run(self, progress: _Progress) -> None:
+        try:
+            await self._report(progress)
+            batches = db.stream_user_ids(progress.last_user_id, self.batch_size)
+            try:
+                while not (progress.cancelled or self._stopping):
+                    batch = await self._db(next, batches, None)
+                    if batch is None:
+                        break
+                    outcomes = await asyncio.gather(*(self._deliver(chat_id, progress.text) for chat_id in batch))
+                    progress.sent += outcomes.count("sent")
+                    progress.blocked += outcomes.count("blocked")
+                    progress.failed += outcomes.count("failed")
+                    progress.handled += len(batch)
+                    progress.last_user_id = batch[-1]
+                    await self._save(progress)
+                    await self._report(progress)
+            finally:
+                await self._db(batches.close)
+
+            if self._stopping and not progress.cancelled:
+                return
+            status = 'cancelled' if progress.cancelled else 'done'
+            await self._save(progress, status)
+            await self._report(progress, " отменена" if progress.cancelled else " завершена")
+            logging.info(progress.report(f" {status}").replace("\n", "; "))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Saved progress is kept; the broadcast resumes on the next start
+            logging.exception(f"Broadcast #{progress.broadcast_id} failed")
+        finally:
+            self._running.pop(progress.broadcast_id, None)
+            self._tasks.pop(progress.broadcast_id, None)
+
+    async def _save(self, progress: _Progress, status: str = 'running') -> None:
+        await self._db(db.save_broadcast_progress, progress.broadcast_id, progress.last_user_id,
+                       progress.sent, progress.blocked, progress.failed, status)
+
+    async def _report(self, progress: _Progress, finished: str = "") -> None:
+        keyboard = None
+        if not finished:
+            keyboard = types.InlineKeyboardMarkup().add(
+                types.InlineKeyboardButton("Остановить", callback_data=f"broadcast_cancel:{progress.broadcast_id}")
+            )
+        try:
+            if progress.status_message is None:
+                progress.status_message = await self.bot.send_message(
+                    progress.admin_chat_id, progress.report(finished), reply_markup=keyboard
+                )
+            else:
+                await message_edits.edit(progress.status_message, progress.report(finished), reply_markup=keyboard)
+        except TelegramAPIError as e:
+            logging.warning(f"Failed to report broadcast #{progress.broadcast_id}: {e}")
+
+    async def _deliver(self, chat_id: int, text: str) -> str:
+        """Sends one message; returns "sent", "blocked" or "failed"."""
+        chat_bucket = self._chat_buckets.setdefault(chat_id, TokenBucket(self.per_chat_rate))
+        self._chat_senders[chat_id] = self._chat_senders.get(chat_id, 0) + 1
+        try:
+            for attempt in range(self.max_attempts):
+                await chat_bucket.acquire()
+                await self.bucket.acquire()
+                try:
+                    await self.bot.send_message(chat_id, text)
+                    return "sent"
+                except RetryAfter as e:
+                    # Flood control applies to the whole bot: hold every send, not just this chat
+                    self.bucket.pause(e.timeout)
+                    chat_bucket.pause(e.timeout)
+                except (Unauthorized, ChatNotFound):
+                    # Blocked the bot, deleted the account or never started a chat with it
+                    return "blocked"
+                except BadRequest as e:
+                    logging.warning(f"Broadcast to {chat_id} rejected: {e}")
+                    return "failed"
+                except (TelegramAPIError, asyncio.TimeoutError, OSError) as e:
+                    logging.warning(f"Broadcast to {chat_id} failed (attempt {attempt + 1}): {e}")
+                    await asyncio.sleep(2 ** attempt)
+            return "failed"
+        finally:
+            self._chat_senders[chat_id] -= 1
+            if not self._chat_senders[chat_id]:
+                del self._chat_senders[chat_id]
+                del self._chat_buckets[chat_id]
+
+
+broadcaster = Broadcaster(rate=BROADCAST_RATE, batch_size=BROADCAST_BATCH_SIZE)
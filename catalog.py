@@ -0,0 +1,131 @@
+"""
+In-process catalog cache.
+
+Holds an immutable, versioned snapshot of categories and the products in stock. The snapshot
+is reloaded when it is invalidated by an admin edit or a checkout that sells a product out,
+or when it is older than CATALOG_TTL, which covers edits made outside the bot. The version
+only changes when the catalog content actually changes.
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+import db
+from config import CATALOG_TTL
+from search import ProductSearchIndex
+
+Category = Tuple[int, str]
+Product = Tuple[int, int, str, int]
+
+
+class CatalogSnapshot:
+    """Categories and products indexed for the bot's lookups."""
+
+    __slots__ = ("version", "loaded_at", "categories", "categories_by_id", "categories_by_name",
+                 "products", "products_by_id", "products_by_category", "_search_index", "_rendered")
+
+    def __init__(self, version: int, categories: List[Category], products: List[Product]):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.categories = categories
+        self.categories_by_id: Dict[int, Category] = {c[0]: c for c in categories}
+        self.categories_by_name: Dict[str, Category] = {c[1]: c for c in categories}
+        self.products = products
+        self.products_by_id: Dict[int, Product] = {p[0]: p for p in products}
+
+        by_category: Dict[int, List[Product]] = {}
+        for product in products:
+            by_category.setdefault(product[1], []).append(product)
+        for items in by_category.values():
+            items.sort(key=lambda p: p[2])
+        self.products_by_category = by_category
+        self._search_index: Optional[ProductSearchIndex] = None
+        self._rendered: Dict[Hashable, Any] = {}
+
+    def search(self, query: str, limit: int = 20) -> List[Product]:
+        """Searches the snapshot's products; the index is built on first use."""
+        if self._search_index is None:
+            self._search_index = ProductSearchIndex(self.products)
+        return self._search_index.search(query, limit)
+
+    def rendered(self, key: Hashable, render: Callable[[], Any]) -> Any:
+        """
+        Returns render() memoised under key for this snapshot. Output that depends only on the
+        catalog (a category page, its keyboard) is built once per version and shared by all users;
+        the result must not be modified.
+        """
+        value = self._rendered.get(key)
+        if value is None:
+            value = render()
+            self._rendered[key] = value
+        return value
+
+
+class CatalogCache:
+    """Thread-safe holder of the current catalog snapshot."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._expires_at = 0.0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def current(self) -> Optional[CatalogSnapshot]:
+        """Returns the snapshot if it is still fresh, without touching the database."""
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() < self._expires_at:
+            self.hits += 1
+            return snapshot
+        return None
+
+    def snapshot(self) -> CatalogSnapshot:
+        """Returns a fresh snapshot, loading it from the database if needed (blocking)."""
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and time.monotonic() < self._expires_at:
+                self.hits += 1
+                return snapshot
+
+            self.misses += 1
+            generation = self._generation
+            loaded = db.get_catalog()
+            if loaded is None:
+                # Database unavailable: keep serving the previous snapshot if there is one
+                return snapshot or CatalogSnapshot(0, [], [])
+
+            categories, products = loaded
+            if snapshot is not None and snapshot.categories == categories and snapshot.products == products:
+                snapshot.loaded_at = time.monotonic()
+            else:
+                version = snapshot.version + 1 if snapshot is not None else 1
+                snapshot = CatalogSnapshot(version, categories, products)
+                self._snapshot = snapshot
+
+            # An invalidation that raced with the load leaves the snapshot stale
+            self._expires_at = snapshot.loaded_at + self.ttl if generation == self._generation else 0.0
+            return snapshot
+
+    def invalidate(self) -> None:
+        """Marks the snapshot stale; the next read reloads it."""
+        self._generation += 1
+        self._expires_at = 0.0
+        self.invalidations += 1
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            "version": snapshot.version if snapshot else 0,
+            "categories": len(snapshot.categories) if snapshot else 0,
+            "products": len(snapshot.products) if snapshot else 0,
+            "rendered": len(snapshot._rendered) if snapshot else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
+
+
+catalog = CatalogCache(CATALOG_TTL)
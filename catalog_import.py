@@ -0,0 +1,132 @@
+"""
+Parsing of supplier price lists uploaded by admins.
+
+A price list is a CSV file with a category, a name and a price per row: exported from Excel
+or Google Sheets, comma-, semicolon- or tab-separated, in UTF-8 or Windows-1251. A header row
+naming the columns is optional; without one the columns are taken in that order.
+
+PriceList reads the file lazily, row by row, so db.import_products can stream it into
+PostgreSQL without holding it in memory; on SQLite it is read in full before the import
+takes the writer. Rows that cannot be imported are counted with a
+reason instead of failing the whole file.
+"""
+import codecs
+import csv
+import io
+import re
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+# Column name aliases, lower-case
+HEADERS = {
+    "category": {"category", "категория", "раздел"},
+    "name": {"name", "product", "название", "наименование", "товар"},
+    "price": {"price", "цена", "стоимость"},
+}
+MAX_PRICE = 2_000_000_000  # Products.price is an INTEGER
+MAX_NAME_LENGTH = 200
+MAX_REPORTED_ERRORS = 10
+
+_PRICE = re.compile(r"(\d+)(?:[.,]0+)?")
+_SPACES = re.compile(r"\s")
+
+
+class PriceListError(ValueError):
+    """The file is not a readable price list at all."""
+
+
+def parse_price(value: str) -> Optional[int]:
+    """Whole sums such as "12500", "12 500" or "12500.00"; None if the value is not one."""
+    match = _PRICE.fullmatch(_SPACES.sub("", value))
+    if match is None:
+        return None
+    price = int(match.group(1))
+    return price if price <= MAX_PRICE else None
+
+
+class PriceList:
+    """
+    Iterating yields (line, category, name, price) for every importable row; the other rows
+    are counted in `rejected`, the first few with their reasons in `errors`.
+    """
+
+    def __init__(self, file: BinaryIO):
+        self.file = file
+        self.rows = 0
+        self.rejected = 0
+        self.errors: List[Tuple[int, str]] = []
+
+    def _text(self):
+        head = self.file.read(64 * 1024)
+        self.file.seek(0)
+        try:
+            # A multi-byte character may be cut at the end of the sample
+            codecs.getincrementaldecoder("utf-8-sig")().decode(head)
+            encoding = "utf-8-sig"
+        except UnicodeDecodeError:
+            encoding = "cp1251"
+        # Whole lines only: the last one may be cut off
+        lines = head.decode(encoding, errors="ignore").splitlines()
+        sample = "\n".join(lines[:20] if len(lines) <= 1 else lines[:min(20, len(lines) - 1)])
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        return io.TextIOWrapper(self.file, encoding=encoding, newline=""), dialect
+
+    def _columns(self, header: List[str]) -> Optional[Dict[str, int]]:
+        """Column positions named by a header row, or None if the row is not a header."""
+        names = [cell.strip().lower() for cell in header]
+        columns = {}
+        for column, aliases in HEADERS.items():
+            position = next((i for i, name in enumerate(names) if name in aliases), None)
+            if position is not None:
+                columns[column] = position
+        if not columns:
+            return None
+        if len(columns) < len(HEADERS):
+            missing = ", ".join(sorted(set(HEADERS) - set(columns)))
+            raise PriceListError(f"В заголовке нет столбцов: {missing}")
+        return columns
+
+    def _reject(self, line: int, reason: str) -> None:
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, reason))
+
+    def __iter__(self) -> Iterator[Tuple[int, str, str, int]]:
+        text, dialect = self._text()
+        reader = csv.reader(text, dialect)
+        columns = {"category": 0, "name": 1, "price": 2}
+        try:
+            for row in reader:
+                line = reader.line_num
+                if not any(cell.strip() for cell in row):
+                    continue
+                if line == 1:
+                    header = self._columns(row)
+                    if header is not None:
+                        columns = header
+                        continue
+
+                self.rows += 1
+                if len(row) <= max(columns.values()):
+                    self._reject(line, "не хватает столбцов")
+                    continue
+                category = row[columns["category"]].strip()
+                name = row[columns["name"]].strip()
+                price = parse_price(row[columns["price"]])
+                if not category or not name:
+                    self._reject(line, "пустая категория или название")
+                elif len(name) > MAX_NAME_LENGTH or len(category) > MAX_NAME_LENGTH:
+                    self._reject(line, "слишком длинное название")
+                elif price is None:
+                    self._reject(line, f"некорректная цена «{row[columns['price']].strip()[:20]}»")
+                else:
+                    yield line, category, name, price
+        except UnicodeDecodeError:
+            raise PriceListError("Файл должен быть в кодировке UTF-8 или Windows-1251")
+        except csv.Error as e:
+            raise PriceListError(f"Ошибка в строке {reader.line_num}: {e}")
+        finally:
+            # Leave the caller's file open
+            text.detach()
@@ -6,4 +6,59 @@ load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 GROUP_CHAT_ID = os.getenv("GROUP_CHAT_ID")
-ADMIN_ID = [int(id) for id in os.getenv("ADMIN_ID").split(",")]
\ No newline at end of file
+# Bot API server; set to a local Bot API server or the load-test fake, e.g. http://localhost:8081
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+ADMIN_ID = [int(id) for id in os.getenv("ADMIN_ID").split(",")]
+
+# Connection pool (PostgreSQL)
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+DB_POOL_MAX_AGE = float(os.getenv("DB_POOL_MAX_AGE", 1800))
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", 300))
+DB_POOL_CHECK_INTERVAL = float(os.getenv("DB_POOL_CHECK_INTERVAL", 30))
+
+# SQLite engine, used when DATABASE_URL is sqlite:///path/to/file.db: pooled read-only connections,
+# the most write transactions one commit may carry, and PRAGMA synchronous (FULL syncs every commit)
+SQLITE_READERS = int(os.getenv("SQLITE_READERS", 4))
+SQLITE_MAX_BATCH = int(os.getenv("SQLITE_MAX_BATCH", 64))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+
+# Catalog cache: seconds before a snapshot is reloaded to pick up edits made outside the bot
+CATALOG_TTL = float(os.getenv("CATALOG_TTL", 300))
+
+# Registered-user cache: maximum number of user IDs kept in memory
+REGISTERED_USERS_CACHE_SIZE = int(os.getenv("REGISTERED_USERS_CACHE_SIZE", 100000))
+
+# Persistent FSM storage
+FSM_STORAGE_PATH = os.getenv("FSM_STORAGE_PATH", "fsm_storage.db")
+FSM_HOT_SIZE = int(os.getenv("FSM_HOT_SIZE", 10000))
+FSM_SESSION_TTL = float(os.getenv("FSM_SESSION_TTL", 14 * 86400))
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", 1))
+
+# Update delivery: "polling" or "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # public URL registered with Telegram, e.g. https://example.com/webhook
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("PORT", 8080))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 32))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 1000))
+
+# Per-user update serialisation: updates kept in flight per user before new ones are dropped
+MAX_PENDING_UPDATES_PER_USER = int(os.getenv("MAX_PENDING_UPDATES_PER_USER", 10))
+
+# Coalesced message edits: at most one edit per message in this many seconds
+EDIT_COALESCE_WINDOW = float(os.getenv("EDIT_COALESCE_WINDOW", 1.0))
+
+# Product photos, one <product_id>.jpg per product; uploaded once and then sent by file_id
+PRODUCT_PHOTOS_DIR = os.getenv("PRODUCT_PHOTOS_DIR", "statics/products")
+
+# Broadcasts: messages per second to all users, kept below Telegram's ~30/s so interactive replies still fit
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 25))
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", 100))
+
+# Prometheus metrics on http://METRICS_HOST:METRICS_PORT/metrics; 0 disables the endpoint
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9100))
@@ -1,123 +1,178 @@
-import psycopg2
 import logging
-from typing import List, Tuple, Optional
+import threading
+from datetime import date
+from typing import Dict, Iterable, List, Tuple, Optional
+from psycopg2.extras import execute_values
 from config import DATABASE_URL
+from storage import DatabaseError, Engine, create_engine
+from search import search_terms
+import metrics
+
+_engine: Optional[Engine] = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> Engine:
+    """Returns the storage engine for DATABASE_URL, creating it on first use."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_engine(DATABASE_URL)
+    return _engine
+
+
+def connection():
+    """Checks out a connection for a read-write transaction; commits on exit."""
+    return get_engine().connection()
+
+
+def reader():
+    """Checks out a connection for read-only queries."""
+    return get_engine().reader()
+
+
+def pool_stats() -> dict:
+    """Returns runtime statistics of the storage engine."""
+    return get_engine().stats() if _engine is not None else {}
+
 
 # Подключаемся к базе данных
 try:
-    with psycopg2.connect(DATABASE_URL) as conn:
+    with reader() as conn:
         with conn.cursor() as cursor:
             cursor.execute("SELECT 1;")
             print("Database connected successfully!")
-except psycopg2.Error as e:
+except DatabaseError as e:
     print(f"Error: {e}")
 
 
 def create_tables() -> None:
-    """Creates tables if they do not already exist."""
-    with psycopg2.connect(DATABASE_URL) as conn:
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS Users (
-                user_id BIGINT PRIMARY KEY,
-                username TEXT,
-                full_name TEXT,
-                phone_number TEXT
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS Categories (
-                category_id SERIAL PRIMARY KEY,
-                name TEXT UNIQUE NOT NULL
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS Products (
-                product_id SERIAL PRIMARY KEY,
-                category_id INTEGER NOT NULL,
-                name TEXT NOT NULL,
-                price INTEGER CHECK(price >= 0),
-                FOREIGN KEY (category_id) REFERENCES Categories (category_id) ON DELETE CASCADE
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS Orders (
-                order_id SERIAL PRIMARY KEY,
-                user_id INTEGER NOT NULL,
-                product_id INTEGER NOT NULL,
-                location TEXT NOT NULL,
-                status TEXT DEFAULT 'New',
-                FOREIGN KEY (user_id) REFERENCES Users (user_id) ON DELETE SET NULL,
-                FOREIGN KEY (product_id) REFERENCES Products (product_id) ON DELETE SET NULL
-            )
-        ''')
-        conn.commit()
+    """Creates or upgrades the schema by applying pending migrations."""
+    get_engine().migrate()
 
 def get_users() -> List[Tuple[int, str]]:
     """Получает список пользователей из базы данных."""
     try:
-        with psycopg2.connect(DATABASE_URL) as conn:
+        with reader() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT user_id, username FROM Users ORDER BY username")
             return cursor.fetchall()
-    except psycopg2.Error as e:
+    except DatabaseError as e:
         logging.error(f"Ошибка получения пользователей: {e}")
         return []
 
+def get_users_page(after_id: Optional[int] = None, before_id: Optional[int] = None,
+                   limit: int = 20) -> Tuple[List[Tuple[int, str]], int]:
+    """
+    Returns one page of users ordered by username, user_id, and the total number of users.
+    The page starts after the user `after_id` or ends before the user `before_id`.
+    """
+    try:
+        with reader() as conn:
+            cursor = conn.cursor()
+            if after_id is not None:
+                cursor.execute('''
+                    SELECT user_id, username FROM Users
+                    WHERE (COALESCE(username, ''), user_id) >
+                          (SELECT COALESCE(username, ''), user_id FROM Users WHERE user_id = %s)
+                    ORDER BY COALESCE(username, ''), user_id
+                    LIMIT %s
+                ''', (after_id, limit))
+                users = cursor.fetchall()
+            elif before_id is not None:
+                cursor.execute('''
+                    SELECT user_id, username FROM Users
+                    WHERE (COALESCE(username, ''), user_id) <
+                          (SELECT COALESCE(username, ''), user_id FROM Users WHERE user_id = %s)
+                    ORDER BY COALESCE(username, '') DESC, user_id DESC
+                    LIMIT %s
+                ''', (before_id, limit))
+                users = cursor.fetchall()[::-1]
+            else:
+                cursor.execute(
+                    "SELECT user_id, username FROM Users ORDER BY COALESCE(username, ''), user_id LIMIT %s",
+                    (limit,)
+                )
+                users = cursor.fetchall()
+            cursor.execute("SELECT COUNT(*) FROM Users")
+            return users, cursor.fetchone()[0]
+    except DatabaseError as e:
+        logging.error(f"Ошибка получения пользователей: {e}")
+        return [], 0
+
 def user_exists(user_id: int) -> bool:
     """Checks if a user exists in the database."""
     try:
-        with psycopg2.connect(DATABASE_URL) as conn:
+        with reader() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT 1 FROM Users WHERE user_id = %s", (user_id,))
             return cursor.fetchone() is not None
-    except psycopg2.Error as e:
+    except DatabaseError as e:
         logging.error(f"Error checking if user exists: {e}")
         return False
 
-def add_user(user_id: int, username: str, full_name: str, phone_number: str) -> None:
-    """Adds a new user to the database if they do not already exist."""
+def add_user(user_id: int, username: str, full_name: str, phone_number: str) -> bool:
+    """
+    Adds a new user to the database if they do not already exist.
+    Returns True if the user is registered afterwards.
+    """
     try:
-        with psycopg2.connect(DATABASE_URL) as conn:
+        with connection() as conn:
             cursor = conn.cursor()
             cursor.execute(
                 "INSERT INTO Users (user_id, username, full_name, phone_number) VALUES (%s, %s, %s, %s) ON CONFLICT DO NOTHING",
                 (user_id, username, full_name, phone_number)
             )
             conn.commit()
-    except psycopg2.Error as e:
+            return True
+    except DatabaseError as e:
         logging.error(f"Error adding user: {e}")
+        return False
+
+def get_user_ids(limit: int) -> List[int]:
+    """Returns up to `limit` registered user IDs, used to warm the registration cache."""
+    try:
+        with reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT user_id FROM Users LIMIT %s", (limit,))
+            return [row[0] for row in cursor.fetchall()]
+    except DatabaseError as e:
+        logging.error(f"Error retrieving user IDs: {e}")
+        return []
 
 def get_user(user_id: int) -> Optional[Tuple[str, str]]:
     """Получаем полное имя и номер телефона пользователя из базы данных."""
     try:
-        with psycopg2.connect(DATABASE_URL) as conn:
+        with reader() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT full_name, phone_number FROM Users WHERE user_id = %s", (user_id,))
             return cursor.fetchone()
-    except psycopg2.Error as e:
+    except DatabaseError as e:
         logging.error(f"Ошибка получения данных пользователя: {e}")
         return None
     
+# Products a customer can order: stock is NULL when it is not tracked
+IN_STOCK = "(stock IS NULL OR stock > 0)"
+
 def get_products_by_category(category_id: int):
-    """Возвращает все товары в определенной категории, отсортированные по имени."""
+    """Возвращает товары в наличии из определенной категории, отсортированные по имени."""
     try:
-        with psycopg2.connect(DATABASE_URL) as conn:
+        with reader() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM Products WHERE category_id = %s ORDER BY name", (category_id,))
+            cursor.execute(f'''
+                SELECT product_id, category_id, name, price FROM Products
+                WHERE category_id = %s AND {IN_STOCK} ORDER BY name
+            ''', (category_id,))
             return cursor.fetchall()
-    except psycopg2.Error as e:
+    except DatabaseError as e:
         logging.error(f"Ошибка при получении товаров по категории: {e}")
         return []
 
 def get_category_by_id(category_id: int):
     """Получает название категории по её ID из базы данных PostgreSQL."""
     try:
-        with psycopg2.connect(DATABASE_URL) as conn:
+        with reader() as conn:
             cursor = conn.cursor()
             cursor.execute(
                 "SELECT name FROM Categories WHERE category_id = %s",
@@ -125,29 +180,29 @@ def get_category_by_id(category_id: int):
             )
             result = cursor.fetchone()
             return result[0] if result else None
-    except psycopg2.Error as e:
+    except DatabaseError as e:
         logging.error(f"Ошибка при получении категории по ID: {e}")
         return None
 
 def get_categories():
     """Получает все категории из базы данных PostgreSQL."""
     try:
-        with psycopg2.connect(DATABASE_URL) as conn:
+        with reader() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT category_id, name FROM Categories ORDER BY category_id")
             return cursor.fetchall()
-    except psycopg2.Error as e:
+    except DatabaseError as e:
         logging.error(f"Ошибка получения категорий: {e}")
         return []
 
 def add_category(name: str) -> None:
     """Adds a new category to the database."""
     try:
-        with psycopg2.connect(DATABASE_URL) as conn:
+        with connection() as conn:
             cursor = conn.cursor()
             cursor.execute("INSERT INTO Categories (name) VALUES (%s) ON CONFLICT DO NOTHING", (name,))
             conn.commit()
-    except psycopg2.Error as e:
+    except DatabaseError as e:
         logging.error(f"Error adding category: {e}")
 
 def delete_category(category_id: int) -> bool:
@@ -156,23 +211,23 @@ def delete_category(category_id: int) -> bool:
     Возвращает True, если категория была успешно удалена, иначе False.
     """
     try:
-        with psycopg2.connect(DATABASE_URL) as conn:
+        with connection() as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM Categories WHERE category_id = %s", (category_id,))
             deleted = cursor.rowcount > 0
             conn.commit()
             return deleted
-    except psycopg2.Error as e:
+    except DatabaseError as e:
         logging.error(f"Ошибка удаления категории: {e}")
         return False
 
 def get_product_by_id(product_id: int):
     """Получает данные продукта по его ID из PostgreSQL."""
     try:
-        with psycopg2.connect(DATABASE_URL) as conn:
+        with reader() as conn:
             cursor = conn.cursor()
             cursor.execute(
-                "SELECT product_id, category_id, name, price FROM Products WHERE product_id = %s",
+                "SELECT product_id, category_id, name, price, stock FROM Products WHERE product_id = %s",
                 (product_id,)
             )
             product = cursor.fetchone()
@@ -181,81 +236,870 @@ def get_product_by_id(product_id: int):
                     "product_id": product[0],
                     "category_id": product[1],
                     "name": product[2],
-                    "price": product[3]
+                    "price": product[3],
+                    "stock": product[4]
                 }
             return None
-    except psycopg2.Error as e:
+    except DatabaseError as e:
         logging.error(f"Ошибка при получении продукта по ID: {e}")
         return None
 
 def get_products():
     """Получает все продукты из базы данных PostgreSQL."""
     try:
-        with psycopg2.connect(DATABASE_URL) as conn:
+        with reader() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT product_id, category_id, name, price FROM Products ORDER BY product_id")
             return cursor.fetchall()
-    except psycopg2.Error as e:
+    except DatabaseError as e:
         logging.error(f"Ошибка получения продуктов: {e}")
         return []
 
+def get_catalog():
+    """
+    Reads all categories and the products in stock in one transaction for the catalog cache.
+    Returns (categories, products), or None if the database is unavailable.
+    """
+    try:
+        with reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT category_id, name FROM Categories ORDER BY category_id")
+            categories = cursor.fetchall()
+            cursor.execute(f"SELECT product_id, category_id, name, price FROM Products WHERE {IN_STOCK} ORDER BY product_id")
+            products = cursor.fetchall()
+            return categories, products
+    except DatabaseError as e:
+        logging.error(f"Ошибка загрузки каталога: {e}")
+        return None
+
+def search_products(query: str, limit: int = 20) -> Optional[List[Tuple[int, int, str, int]]]:
+    """
+    Finds products in stock whose name has a word starting with each word of the query,
+    ranked as described in search.py. Returns None if the database is unavailable, and on
+    SQLite, which has no prefix full-text index: the catalog cache answers there instead.
+    """
+    if get_engine().name == "sqlite":
+        return None
+    terms = search_terms(query)
+    if not terms:
+        return []
+    try:
+        with reader() as conn:
+            cursor = conn.cursor()
+            # The query is split into words by the same parser as the index, each word a prefix match
+            cursor.execute(f'''
+                SELECT product_id, category_id, name, price FROM Products
+                WHERE {IN_STOCK} AND to_tsvector('simple', name) @@ (
+                    SELECT to_tsquery('simple', string_agg(quote_literal(lexeme) || ':*', ' & '))
+                    FROM unnest(to_tsvector('simple', %s))
+                )
+                ORDER BY starts_with(lower(name), %s) DESC, length(name), lower(name), product_id
+                LIMIT %s
+            ''', (query, terms[0], limit))
+            return cursor.fetchall()
+    except DatabaseError as e:
+        logging.error(f"Ошибка поиска продуктов: {e}")
+        return None
+
+def get_products_page(after_id: Optional[int] = None, before_id: Optional[int] = None,
+                      limit: int = 10) -> Tuple[List[Tuple[int, int, str, int]], int]:
+    """
+    Returns one page of products ordered by product_id, and the total number of products.
+    The page starts after `after_id` or ends before `before_id`.
+    """
+    try:
+        with reader() as conn:
+            cursor = conn.cursor()
+            if before_id is not None:
+                cursor.execute('''
+                    SELECT product_id, category_id, name, price FROM Products
+                    WHERE product_id < %s ORDER BY product_id DESC LIMIT %s
+                ''', (before_id, limit))
+                products = cursor.fetchall()[::-1]
+            else:
+                cursor.execute('''
+                    SELECT product_id, category_id, name, price FROM Products
+                    WHERE product_id > %s ORDER BY product_id LIMIT %s
+                ''', (after_id or 0, limit))
+                products = cursor.fetchall()
+            cursor.execute("SELECT COUNT(*) FROM Products")
+            return products, cursor.fetchone()[0]
+    except DatabaseError as e:
+        logging.error(f"Ошибка получения продуктов: {e}")
+        return [], 0
+
 def add_product(category_id: int, name: str, price: int) -> None:
     """Adds a new product to a specified category with price as an integer."""
     try:
-        with psycopg2.connect(DATABASE_URL) as conn:
+        with connection() as conn:
             cursor = conn.cursor()
             cursor.execute(
                 "INSERT INTO Products (category_id, name, price) VALUES (%s, %s, %s)",
                 (category_id, name, price)
             )
             conn.commit()
-    except psycopg2.Error as e:
+    except DatabaseError as e:
         logging.error(f"Error adding product: {e}")
 
+def set_product_stock(product_id: int, stock: Optional[int]) -> bool:
+    """Sets how many units of a product are left; None stops tracking its stock. Returns True if it exists."""
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE Products SET stock = %s WHERE product_id = %s", (stock, product_id))
+            updated = cursor.rowcount > 0
+            conn.commit()
+            return updated
+    except DatabaseError as e:
+        logging.error(f"Ошибка изменения остатка товара: {e}")
+        return False
+
 def delete_product(product_id: int) -> bool:
     """Deletes a product by ID."""
     try:
-        with psycopg2.connect(DATABASE_URL) as conn:
+        with connection() as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM Products WHERE product_id = %s", (product_id,))
             deleted = cursor.rowcount > 0
             conn.commit()
             return deleted
-    except psycopg2.Error as e:
+    except DatabaseError as e:
         logging.error(f"Ошибка удаления товара: {e}")
         return False
-    
-def create_order(user_id: int, cart: list, location: str):
-    """Создает заказ для пользователя с множеством товаров в корзине и возвращает ID заказа."""
+
+IMPORT_LOCK_ID = 727402
+
+def import_products(rows: Iterable[Tuple[int, str, str, int]]) -> Optional[dict]:
+    """
+    Imports (line, category, name, price) rows in one transaction. The rows are bulk-loaded
+    into a staging table, missing categories are created, and products are matched by
+    category and name: existing ones get the new price, the others are added. A product
+    listed twice keeps the price from its last line.
+
+    Returns the counts {"loaded", "duplicates", "categories", "inserted", "updated", "unchanged"},
+    or None if the import failed and nothing was changed.
+    """
+    engine = get_engine()
+    if engine.name == "sqlite":
+        # The writer is shared by every checkout: parse the whole file before taking it,
+        # so it is held only for the load and the upsert, not for reading the upload
+        rows = list(rows)
     try:
-        with psycopg2.connect(DATABASE_URL) as conn:
+        with connection() as conn:
             cursor = conn.cursor()
-            for item in cart:
-                cursor.execute(
-                    "INSERT INTO Orders (user_id, product_id, location, status) VALUES (%s, %s, %s, 'New')",
-                    (user_id, item['product_id'], location)
+            if engine.name == "sqlite":
+                cursor.execute("DROP TABLE IF EXISTS temp.ImportStaging")
+                cursor.execute("CREATE TEMP TABLE ImportStaging (line INTEGER, category TEXT, name TEXT, price INTEGER)")
+            else:
+                # One import at a time; product reads and checkouts are not blocked
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", (IMPORT_LOCK_ID,))
+                cursor.execute('''
+                    CREATE TEMP TABLE ImportStaging (line INTEGER, category TEXT, name TEXT, price INTEGER)
+                    ON COMMIT DROP
+                ''')
+            loaded = engine.copy_rows(cursor, "ImportStaging", ("line", "category", "name", "price"), rows)
+
+            cursor.execute('''
+                DELETE FROM ImportStaging WHERE line NOT IN (
+                    SELECT MAX(line) FROM ImportStaging GROUP BY category, name
                 )
+            ''')
+            duplicates = cursor.rowcount
+            cursor.execute('''
+                INSERT INTO Categories (name) SELECT DISTINCT category FROM ImportStaging WHERE true
+                ON CONFLICT DO NOTHING
+            ''')
+            categories = cursor.rowcount
+
+            if engine.name == "sqlite":
+                # No data-modifying CTEs in SQLite; the single writer makes two statements just as safe
+                cursor.execute('''
+                    UPDATE Products SET price = incoming.price
+                    FROM (
+                        SELECT Categories.category_id, ImportStaging.name, ImportStaging.price
+                        FROM ImportStaging JOIN Categories ON Categories.name = ImportStaging.category
+                    ) AS incoming
+                    WHERE Products.category_id = incoming.category_id AND Products.name = incoming.name
+                      AND Products.price IS NOT incoming.price
+                ''')
+                updated = cursor.rowcount
+                cursor.execute('''
+                    INSERT INTO Products (category_id, name, price)
+                    SELECT Categories.category_id, ImportStaging.name, ImportStaging.price
+                    FROM ImportStaging JOIN Categories ON Categories.name = ImportStaging.category
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM Products
+                        WHERE Products.category_id = Categories.category_id AND Products.name = ImportStaging.name
+                    )
+                ''')
+                inserted = cursor.rowcount
+                cursor.execute("DROP TABLE temp.ImportStaging")
+            else:
+                cursor.execute('''
+                    WITH incoming AS (
+                        SELECT Categories.category_id, ImportStaging.name, ImportStaging.price
+                        FROM ImportStaging JOIN Categories ON Categories.name = ImportStaging.category
+                    ),
+                    updated AS (
+                        UPDATE Products SET price = incoming.price
+                        FROM incoming
+                        WHERE Products.category_id = incoming.category_id AND Products.name = incoming.name
+                          AND Products.price IS DISTINCT FROM incoming.price
+                        RETURNING 1
+                    ),
+                    inserted AS (
+                        INSERT INTO Products (category_id, name, price)
+                        SELECT category_id, name, price FROM incoming
+                        WHERE NOT EXISTS (
+                            SELECT 1 FROM Products
+                            WHERE Products.category_id = incoming.category_id AND Products.name = incoming.name
+                        )
+                        RETURNING 1
+                    )
+                    SELECT (SELECT COUNT(*) FROM inserted), (SELECT COUNT(*) FROM updated)
+                ''')
+                inserted, updated = cursor.fetchone()
             conn.commit()
-            cursor.execute("SELECT LASTVAL()")
-            order_id = cursor.fetchone()[0]
-            return order_id
-    except psycopg2.Error as e:
+            return {
+                "loaded": loaded,
+                "duplicates": duplicates,
+                "categories": categories,
+                "inserted": inserted,
+                "updated": updated,
+                "unchanged": max(loaded - duplicates - inserted - updated, 0),
+            }
+    except DatabaseError as e:
+        logging.error(f"Ошибка импорта товаров: {e}")
+        return None
+
+class OutOfStock(Exception):
+    """Some cart items are not available in the requested quantity; no order was created."""
+
+    def __init__(self, shortages: List[Tuple[int, int, int]]):
+        super().__init__(f"Not enough stock: {shortages}")
+        self.shortages = shortages  # (product_id, requested, available) per cart item
+
+# Takes the stock of each cart item, writes the items that got it (or whose stock is not
+# tracked) and reports what was inserted and which products sold out. The decrement is a
+# conditional UPDATE: a concurrent checkout of the same product waits for the row lock and
+# re-checks the stock it left, so a product is never oversold. The INSERT sees Products as
+# it was before the UPDATE; it only reads the price and whether the stock is tracked there.
+_ORDER_ITEMS_CTE = '''
+    WITH items (order_id, product_id, quantity) AS (VALUES %s),
+    taken AS (
+        UPDATE Products SET stock = Products.stock - items.quantity
+        FROM items
+        WHERE Products.product_id = items.product_id AND Products.stock >= items.quantity
+        RETURNING Products.product_id, Products.stock
+    ),
+    inserted AS (
+        INSERT INTO OrderItems (order_id, product_id, quantity, price)
+        SELECT items.order_id, Products.product_id, items.quantity, Products.price
+        FROM items JOIN Products ON Products.product_id = items.product_id
+        WHERE Products.stock IS NULL OR Products.product_id IN (SELECT product_id FROM taken)
+        RETURNING product_id
+    )
+    SELECT ARRAY(SELECT product_id FROM inserted), ARRAY(SELECT product_id FROM taken WHERE stock = 0)
+'''
+
+def _shortages(cursor, cart: list, inserted: set) -> List[Tuple[int, int, int]]:
+    """(product_id, requested, available) of the cart items that were not inserted."""
+    missing = [item for item in cart if item['product_id'] not in inserted]
+    placeholders = ", ".join(["%s"] * len(missing))
+    cursor.execute(f"SELECT product_id, stock FROM Products WHERE product_id IN ({placeholders})",
+                   [item['product_id'] for item in missing])
+    stock = dict(cursor.fetchall())
+    return [
+        # A product deleted meanwhile has none left
+        (item['product_id'], item['quantity'], stock.get(item['product_id'], 0) or 0)
+        for item in missing
+    ]
+
+def create_order(user_id: int, cart: list, location: str, idempotency_key: Optional[str] = None,
+                 notify_chat_id: Optional[str] = None) -> Optional[Tuple[int, bool, List[int]]]:
+    """
+    Создает заказ с позициями корзины в одной транзакции.
+    Цена каждой позиции фиксируется по текущей цене товара, а её количество списывается
+    с остатка товара, если остаток ведётся. Если указан notify_chat_id, в той же транзакции
+    в Outbox ставятся уведомления о заказе для этого чата.
+
+    Возвращает (order_id, created, sold_out), где sold_out — ID товаров, остаток которых
+    закончился на этом заказе. Если заказ с тем же idempotency_key уже существует,
+    новый не создаётся и возвращается ID существующего с created=False.
+    Если какого-то товара не хватает, заказ не создаётся и выбрасывается OutOfStock.
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO Orders (user_id, location, status, idempotency_key) VALUES (%s, %s, 'New', %s)
+                ON CONFLICT (idempotency_key) DO NOTHING
+                RETURNING order_id
+            ''', (user_id, location, idempotency_key))
+            row = cursor.fetchone()
+            if row is None:
+                # A concurrent or earlier checkout with the same key has committed
+                cursor.execute("SELECT order_id FROM Orders WHERE idempotency_key = %s", (idempotency_key,))
+                return cursor.fetchone()[0], False, []
+
+            order_id = row[0]
+            # In product order, so checkouts of the same products take their row locks in the same order
+            items = sorted((order_id, item['product_id'], item['quantity']) for item in cart)
+            if get_engine().name == "sqlite":
+                # In-process, one statement per item costs no round trips
+                inserted, sold_out = set(), []
+                for order_id, product_id, quantity in items:
+                    cursor.execute(
+                        "UPDATE Products SET stock = stock - %s WHERE product_id = %s AND stock >= %s RETURNING stock",
+                        (quantity, product_id, quantity)
+                    )
+                    taken = cursor.fetchone()
+                    if taken is not None and taken[0] == 0:
+                        sold_out.append(product_id)
+                    cursor.execute('''
+                        INSERT INTO OrderItems (order_id, product_id, quantity, price)
+                        SELECT %s, product_id, %s, price FROM Products
+                        WHERE product_id = %s AND (stock IS NULL OR %s)
+                    ''', (order_id, quantity, product_id, taken is not None))
+                    if cursor.rowcount:
+                        inserted.add(product_id)
+            else:
+                execute_values(cursor, _ORDER_ITEMS_CTE, items, page_size=len(items))
+                inserted, sold_out = cursor.fetchone()
+                inserted = set(inserted)
+            if len(inserted) != len(cart):
+                conn.rollback()
+                shortages = _shortages(cursor, cart, inserted)
+                logging.info(f"Заказ не создан, не хватает товаров: {shortages}")
+                raise OutOfStock(shortages)
+            if notify_chat_id is not None:
+                # Location first, then the order text: the dispatcher sends a chat's messages in order
+                cursor.execute('''
+                    INSERT INTO Outbox (chat_id, kind, order_id)
+                    VALUES (%s, 'order_location', %s), (%s, 'order_message', %s)
+                ''', (notify_chat_id, order_id, notify_chat_id, order_id))
+            # Counted in the sales summary by refresh_sales_summary; a row of its own, so
+            # concurrent checkouts do not queue on a shared summary row
+            cursor.execute("INSERT INTO SalesPending (order_id) VALUES (%s)", (order_id,))
+            conn.commit()
+            return order_id, True, sold_out
+    except DatabaseError as e:
         logging.error(f"Ошибка при создании заказа: {e}")
         return None
 
-def get_user_orders(user_id: int) -> List[Tuple[int, str]]:
-    """Retrieves all orders for a specific user."""
+def get_order(order_id: int) -> Optional[dict]:
+    """Returns an order with its customer and items, or None if it does not exist."""
     try:
-        with psycopg2.connect(DATABASE_URL) as conn:
+        with reader() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                SELECT Orders.order_id, Products.name
+                SELECT Orders.order_id, Orders.user_id, Orders.location, Orders.status, Orders.created_at,
+                       Users.full_name, Users.phone_number
                 FROM Orders
-                JOIN Products ON Orders.product_id = Products.product_id
+                LEFT JOIN Users ON Users.user_id = Orders.user_id
+                WHERE Orders.order_id = %s
+            ''', (order_id,))
+            order = cursor.fetchone()
+            if not order:
+                return None
+            cursor.execute('''
+                SELECT COALESCE(Products.name, '—'), OrderItems.quantity, OrderItems.price
+                FROM OrderItems
+                LEFT JOIN Products ON Products.product_id = OrderItems.product_id
+                WHERE OrderItems.order_id = %s
+                ORDER BY OrderItems.item_id
+            ''', (order_id,))
+            return {
+                "order_id": order[0],
+                "user_id": order[1],
+                "location": order[2],
+                "status": order[3],
+                "created_at": order[4],
+                "full_name": order[5],
+                "phone_number": order[6],
+                "items": cursor.fetchall()
+            }
+    except DatabaseError as e:
+        logging.error(f"Error retrieving order: {e}")
+        return None
+
+def get_user_orders(user_id: int) -> List[Tuple[int, str, str, int, int]]:
+    """
+    Retrieves the items of all orders of a specific user
+    as (order_id, status, product_name, quantity, price) rows.
+    """
+    try:
+        with reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT Orders.order_id, Orders.status, COALESCE(Products.name, '—'), OrderItems.quantity, OrderItems.price
+                FROM Orders
+                JOIN OrderItems ON OrderItems.order_id = Orders.order_id
+                LEFT JOIN Products ON Products.product_id = OrderItems.product_id
                 WHERE Orders.user_id = %s
-                ORDER BY Orders.status, Orders.order_id
+                ORDER BY Orders.status, Orders.order_id, OrderItems.item_id
             ''', (user_id,))
             return cursor.fetchall()
-    except psycopg2.Error as e:
+    except DatabaseError as e:
         logging.error(f"Error retrieving user orders: {e}")
-        return []
\ No newline at end of file
+        return []
+
+def get_sales_summary(days: int, top: int = 10) -> Optional[dict]:
+    """
+    Sales of the last `days` days, today included, with the `top` categories and products,
+    read from the summary tables, so the cost depends on the period and catalog size rather
+    than the order history. Orders still waiting in SalesPending are not counted yet; call
+    refresh_sales_summary first for an exact figure. Names are the current ones.
+    """
+    if get_engine().name == "sqlite":
+        since, param = "date('now', %s)", f"-{days - 1} days"
+    else:
+        since, param = "CURRENT_DATE - %s", days - 1
+    try:
+        with reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT day, orders, items, revenue FROM SalesDaily WHERE day >= {since} ORDER BY day DESC",
+                (param,)
+            )
+            daily = cursor.fetchall()
+            cursor.execute(f'''
+                SELECT COALESCE(Categories.name, '—'), sold.orders, sold.quantity, sold.revenue
+                FROM (
+                    SELECT category_id, SUM(orders) AS orders, SUM(quantity) AS quantity,
+                           CAST(SUM(revenue) AS BIGINT) AS revenue
+                    FROM SalesDailyCategories WHERE day >= {since}
+                    GROUP BY category_id ORDER BY 4 DESC LIMIT %s
+                ) AS sold
+                LEFT JOIN Categories ON Categories.category_id = sold.category_id
+                ORDER BY sold.revenue DESC
+            ''', (param, top))
+            categories = cursor.fetchall()
+            cursor.execute(f'''
+                SELECT COALESCE(Products.name, '—'), sold.orders, sold.quantity, sold.revenue
+                FROM (
+                    SELECT product_id, SUM(orders) AS orders, SUM(quantity) AS quantity,
+                           CAST(SUM(revenue) AS BIGINT) AS revenue
+                    FROM SalesDailyProducts WHERE day >= {since}
+                    GROUP BY product_id ORDER BY 3 DESC, 4 DESC LIMIT %s
+                ) AS sold
+                LEFT JOIN Products ON Products.product_id = sold.product_id
+                ORDER BY sold.quantity DESC, sold.revenue DESC
+            ''', (param, top))
+            products = cursor.fetchall()
+            cursor.execute(f'''
+                SELECT (SELECT COUNT(*) FROM CustomerActivity WHERE last_order_day >= {since}),
+                       (SELECT COUNT(*) FROM CustomerActivity WHERE first_order_day >= {since})
+            ''', (param, param))
+            customers, new_customers = cursor.fetchone()
+            return {
+                "daily": daily,
+                "categories": categories,
+                "products": products,
+                "customers": customers,
+                "new_customers": new_customers,
+            }
+    except DatabaseError as e:
+        logging.error(f"Error retrieving sales summary: {e}")
+        return None
+
+SALES_SUMMARY_LOCK_ID = 727403
+
+def refresh_sales_summary(limit: int = 1000) -> Optional[int]:
+    """
+    Adds up to `limit` of the orders create_order queued in SalesPending to the sales summary
+    tables, each under the day it was placed, and takes them off the queue.
+    Returns how many orders were added, or None if the refresh failed and nothing was changed.
+    """
+    if get_engine().name == "sqlite":
+        day = "date(Orders.created_at)"
+    else:
+        day = "CAST(Orders.created_at AS DATE)"
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            if get_engine().name != "sqlite":
+                # One refresh or rebuild at a time, so no order is counted twice
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", (SALES_SUMMARY_LOCK_ID,))
+            cursor.execute("SELECT order_id FROM SalesPending ORDER BY order_id LIMIT %s", (limit,))
+            order_ids = [row[0] for row in cursor.fetchall()]
+            if not order_ids:
+                return 0
+            # The queued IDs, not a subquery: checkouts committing meanwhile stay queued for the next refresh
+            placeholders = ", ".join(["%s"] * len(order_ids))
+            pending = f"Orders.order_id IN ({placeholders})"
+            cursor.execute(f'''
+                INSERT INTO SalesDaily (day, orders, items, revenue)
+                SELECT day, COUNT(*), SUM(items), SUM(revenue)
+                FROM (
+                    SELECT {day} AS day, SUM(OrderItems.quantity) AS items,
+                           SUM(CAST(OrderItems.quantity AS BIGINT) * OrderItems.price) AS revenue
+                    FROM Orders
+                    JOIN OrderItems ON OrderItems.order_id = Orders.order_id
+                    WHERE {pending}
+                    GROUP BY Orders.order_id
+                ) AS totals
+                GROUP BY day
+                ON CONFLICT (day) DO UPDATE SET orders = SalesDaily.orders + excluded.orders,
+                                                items = SalesDaily.items + excluded.items,
+                                                revenue = SalesDaily.revenue + excluded.revenue
+            ''', order_ids)
+            cursor.execute(f'''
+                INSERT INTO SalesDailyProducts (day, product_id, orders, quantity, revenue)
+                SELECT {day}, COALESCE(OrderItems.product_id, 0), COUNT(DISTINCT Orders.order_id),
+                       SUM(OrderItems.quantity), SUM(CAST(OrderItems.quantity AS BIGINT) * OrderItems.price)
+                FROM Orders
+                JOIN OrderItems ON OrderItems.order_id = Orders.order_id
+                WHERE {pending}
+                GROUP BY 1, 2
+                ON CONFLICT (day, product_id) DO UPDATE SET orders = SalesDailyProducts.orders + excluded.orders,
+                                                            quantity = SalesDailyProducts.quantity + excluded.quantity,
+                                                            revenue = SalesDailyProducts.revenue + excluded.revenue
+            ''', order_ids)
+            cursor.execute(f'''
+                INSERT INTO SalesDailyCategories (day, category_id, orders, quantity, revenue)
+                SELECT {day}, COALESCE(Products.category_id, 0), COUNT(DISTINCT Orders.order_id),
+                       SUM(OrderItems.quantity), SUM(CAST(OrderItems.quantity AS BIGINT) * OrderItems.price)
+                FROM Orders
+                JOIN OrderItems ON OrderItems.order_id = Orders.order_id
+                LEFT JOIN Products ON Products.product_id = OrderItems.product_id
+                WHERE {pending}
+                GROUP BY 1, 2
+                ON CONFLICT (day, category_id) DO UPDATE SET orders = SalesDailyCategories.orders + excluded.orders,
+                                                             quantity = SalesDailyCategories.quantity + excluded.quantity,
+                                                             revenue = SalesDailyCategories.revenue + excluded.revenue
+            ''', order_ids)
+            cursor.execute(f'''
+                INSERT INTO CustomerActivity (user_id, first_order_day, last_order_day, orders, revenue)
+                SELECT Orders.user_id, MIN({day}), MAX({day}), COUNT(DISTINCT Orders.order_id),
+                       SUM(CAST(OrderItems.quantity AS BIGINT) * OrderItems.price)
+                FROM Orders
+                JOIN OrderItems ON OrderItems.order_id = Orders.order_id
+                WHERE {pending} AND Orders.user_id IS NOT NULL
+                GROUP BY Orders.user_id
+                ON CONFLICT (user_id) DO UPDATE SET
+                    first_order_day = CASE WHEN excluded.first_order_day < CustomerActivity.first_order_day
+                                           THEN excluded.first_order_day ELSE CustomerActivity.first_order_day END,
+                    last_order_day = CASE WHEN excluded.last_order_day > CustomerActivity.last_order_day
+                                          THEN excluded.last_order_day ELSE CustomerActivity.last_order_day END,
+                    orders = CustomerActivity.orders + excluded.orders,
+                    revenue = CustomerActivity.revenue + excluded.revenue
+            ''', order_ids)
+            cursor.execute(f"DELETE FROM SalesPending WHERE order_id IN ({placeholders})", order_ids)
+            conn.commit()
+            return len(order_ids)
+    except DatabaseError as e:
+        logging.error(f"Error refreshing sales summary: {e}")
+        return None
+
+def rebuild_sales_summary() -> bool:
+    """
+    Recomputes the sales summary tables from the whole order history and empties the
+    SalesPending queue. refresh_sales_summary only ever adds to them, so this is the repair
+    after orders were deleted or edited by hand.
+    """
+    if get_engine().name == "sqlite":
+        day = "date(Orders.created_at)"
+    else:
+        day = "CAST(Orders.created_at AS DATE)"
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            if get_engine().name != "sqlite":
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", (SALES_SUMMARY_LOCK_ID,))
+                # Checkouts wait to queue their orders, so each order is either counted here or queued after
+                cursor.execute("LOCK TABLE SalesPending IN SHARE MODE")
+            for table in ("SalesPending", "SalesDaily", "SalesDailyProducts", "SalesDailyCategories",
+                          "CustomerActivity"):
+                cursor.execute(f"DELETE FROM {table}")
+            cursor.execute(f'''
+                INSERT INTO SalesDaily (day, orders, items, revenue)
+                SELECT day, COUNT(*), SUM(items), SUM(revenue)
+                FROM (
+                    SELECT {day} AS day, SUM(OrderItems.quantity) AS items,
+                           SUM(CAST(OrderItems.quantity AS BIGINT) * OrderItems.price) AS revenue
+                    FROM Orders
+                    JOIN OrderItems ON OrderItems.order_id = Orders.order_id
+                    GROUP BY Orders.order_id
+                ) AS totals
+                GROUP BY day
+            ''')
+            cursor.execute(f'''
+                INSERT INTO SalesDailyProducts (day, product_id, orders, quantity, revenue)
+                SELECT {day}, COALESCE(OrderItems.product_id, 0), COUNT(DISTINCT Orders.order_id),
+                       SUM(OrderItems.quantity), SUM(CAST(OrderItems.quantity AS BIGINT) * OrderItems.price)
+                FROM Orders
+                JOIN OrderItems ON OrderItems.order_id = Orders.order_id
+                GROUP BY 1, 2
+            ''')
+            cursor.execute(f'''
+                INSERT INTO SalesDailyCategories (day, category_id, orders, quantity, revenue)
+                SELECT {day}, COALESCE(Products.category_id, 0), COUNT(DISTINCT Orders.order_id),
+                       SUM(OrderItems.quantity), SUM(CAST(OrderItems.quantity AS BIGINT) * OrderItems.price)
+                FROM Orders
+                JOIN OrderItems ON OrderItems.order_id = Orders.order_id
+                LEFT JOIN Products ON Products.product_id = OrderItems.product_id
+                GROUP BY 1, 2
+            ''')
+            cursor.execute(f'''
+                INSERT INTO CustomerActivity (user_id, first_order_day, last_order_day, orders, revenue)
+                SELECT Orders.user_id, MIN({day}), MAX({day}), COUNT(DISTINCT Orders.order_id),
+                       SUM(CAST(OrderItems.quantity AS BIGINT) * OrderItems.price)
+                FROM Orders
+                JOIN OrderItems ON OrderItems.order_id = Orders.order_id
+                WHERE Orders.user_id IS NOT NULL
+                GROUP BY Orders.user_id
+            ''')
+            conn.commit()
+            return True
+    except DatabaseError as e:
+        logging.error(f"Error rebuilding sales summary: {e}")
+        return False
+
+def claim_outbox(limit: int, lease_seconds: int = 60) -> List[Tuple[int, str, str, int, int]]:
+    """
+    Claims up to `limit` due outbox messages as (outbox_id, chat_id, kind, order_id, attempts).
+    Claimed messages are leased: they are not handed out again for `lease_seconds`.
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            if get_engine().name == "sqlite":
+                # A single writer: no other claim can run concurrently, so no row locks to skip
+                cursor.execute('''
+                    UPDATE Outbox SET next_attempt_at = datetime('now', %s || ' seconds')
+                    WHERE outbox_id IN (
+                        SELECT outbox_id FROM Outbox
+                        WHERE status = 'pending' AND next_attempt_at <= datetime('now')
+                        ORDER BY outbox_id
+                        LIMIT %s
+                    )
+                    RETURNING outbox_id, chat_id, kind, order_id, attempts
+                ''', (lease_seconds, limit))
+            else:
+                cursor.execute('''
+                    UPDATE Outbox SET next_attempt_at = NOW() + %s * INTERVAL '1 second'
+                    WHERE outbox_id IN (
+                        SELECT outbox_id FROM Outbox
+                        WHERE status = 'pending' AND next_attempt_at <= NOW()
+                        ORDER BY outbox_id
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING outbox_id, chat_id, kind, order_id, attempts
+                ''', (lease_seconds, limit))
+            return sorted(cursor.fetchall())
+    except DatabaseError as e:
+        logging.error(f"Error claiming outbox messages: {e}")
+        return []
+
+def mark_outbox_sent(outbox_ids: List[int]) -> None:
+    """Marks outbox messages as delivered."""
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            if get_engine().name == "sqlite":
+                cursor.executemany(
+                    "UPDATE Outbox SET status = 'sent', sent_at = CURRENT_TIMESTAMP WHERE outbox_id = %s",
+                    [(outbox_id,) for outbox_id in outbox_ids]
+                )
+            else:
+                cursor.execute(
+                    "UPDATE Outbox SET status = 'sent', sent_at = NOW() WHERE outbox_id = ANY(%s)",
+                    (list(outbox_ids),)
+                )
+            conn.commit()
+    except DatabaseError as e:
+        logging.error(f"Error marking outbox messages as sent: {e}")
+
+def mark_outbox_failed(outbox_id: int, error: str, retry_in: Optional[float]) -> None:
+    """Records a failed delivery; schedules a retry in `retry_in` seconds or gives up if it is None."""
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            if get_engine().name == "sqlite":
+                next_attempt_at = "datetime('now', COALESCE(%s, 0) || ' seconds')"
+            else:
+                next_attempt_at = "NOW() + COALESCE(%s, 0) * INTERVAL '1 second'"
+            cursor.execute(f'''
+                UPDATE Outbox
+                SET attempts = attempts + 1,
+                    last_error = %s,
+                    status = CASE WHEN %s IS NULL THEN 'failed' ELSE 'pending' END,
+                    next_attempt_at = {next_attempt_at}
+                WHERE outbox_id = %s
+            ''', (error, retry_in, retry_in, outbox_id))
+            conn.commit()
+    except DatabaseError as e:
+        logging.error(f"Error marking outbox message as failed: {e}")
+
+def defer_outbox(outbox_ids: List[int], delay: float) -> None:
+    """Postpones claimed outbox messages by `delay` seconds without counting an attempt."""
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            if get_engine().name == "sqlite":
+                cursor.executemany(
+                    "UPDATE Outbox SET next_attempt_at = datetime('now', %s || ' seconds') WHERE outbox_id = %s",
+                    [(delay, outbox_id) for outbox_id in outbox_ids]
+                )
+            else:
+                cursor.execute(
+                    "UPDATE Outbox SET next_attempt_at = NOW() + %s * INTERVAL '1 second' WHERE outbox_id = ANY(%s)",
+                    (delay, list(outbox_ids))
+                )
+            conn.commit()
+    except DatabaseError as e:
+        logging.error(f"Error deferring outbox messages: {e}")
+
+def outbox_depth() -> int:
+    """Returns the number of outbox messages waiting to be delivered."""
+    try:
+        with reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM Outbox WHERE status = 'pending'")
+            return cursor.fetchone()[0]
+    except DatabaseError as e:
+        logging.error(f"Error counting outbox messages: {e}")
+        return 0
+
+def get_media_files() -> Dict[str, Tuple[str, str]]:
+    """Returns the registered media as {media_key: (checksum, file_id)}."""
+    try:
+        with reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT media_key, checksum, file_id FROM MediaFiles")
+            return {key: (checksum, file_id) for key, checksum, file_id in cursor.fetchall()}
+    except DatabaseError as e:
+        logging.error(f"Error retrieving media files: {e}")
+        return {}
+
+def save_media_file(media_key: str, checksum: str, file_id: str) -> None:
+    """Records the Telegram file_id of an uploaded media file, replacing an older upload."""
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO MediaFiles (media_key, checksum, file_id) VALUES (%s, %s, %s)
+                ON CONFLICT (media_key) DO UPDATE
+                SET checksum = EXCLUDED.checksum, file_id = EXCLUDED.file_id, updated_at = CURRENT_TIMESTAMP
+            ''', (media_key, checksum, file_id))
+            conn.commit()
+    except DatabaseError as e:
+        logging.error(f"Error saving media file: {e}")
+
+def delete_media_file(media_key: str) -> None:
+    """Forgets a file_id that Telegram no longer accepts."""
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM MediaFiles WHERE media_key = %s", (media_key,))
+            conn.commit()
+    except DatabaseError as e:
+        logging.error(f"Error deleting media file: {e}")
+
+BROADCAST_COLUMNS = ("broadcast_id", "admin_chat_id", "text", "total", "last_user_id", "sent", "blocked", "failed")
+
+def create_broadcast(admin_chat_id: int, text: str) -> Optional[dict]:
+    """Records a new broadcast to all users and returns it."""
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO Broadcasts (admin_chat_id, text, total)
+                VALUES (%s, %s, (SELECT COUNT(*) FROM Users))
+                RETURNING broadcast_id, admin_chat_id, text, total, last_user_id, sent, blocked, failed
+            ''', (admin_chat_id, text))
+            broadcast = dict(zip(BROADCAST_COLUMNS, cursor.fetchone()))
+            conn.commit()
+            return broadcast
+    except DatabaseError as e:
+        logging.error(f"Error creating broadcast: {e}")
+        return None
+
+def get_running_broadcasts() -> List[dict]:
+    """Returns the broadcasts that have not finished, e.g. interrupted by a restart."""
+    try:
+        with reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT broadcast_id, admin_chat_id, text, total, last_user_id, sent, blocked, failed
+                FROM Broadcasts WHERE status = 'running' ORDER BY broadcast_id
+            ''')
+            return [dict(zip(BROADCAST_COLUMNS, row)) for row in cursor.fetchall()]
+    except DatabaseError as e:
+        logging.error(f"Error retrieving broadcasts: {e}")
+        return []
+
+def save_broadcast_progress(broadcast_id: int, last_user_id: int, sent: int, blocked: int, failed: int,
+                            status: str = 'running') -> None:
+    """Records how far a broadcast got; users up to `last_user_id` have been handled."""
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE Broadcasts
+                SET last_user_id = %s, sent = %s, blocked = %s, failed = %s, status = %s,
+                    updated_at = CURRENT_TIMESTAMP,
+                    finished_at = CASE WHEN %s = 'running' THEN NULL ELSE CURRENT_TIMESTAMP END
+                WHERE broadcast_id = %s
+            ''', (last_user_id, sent, blocked, failed, status, status, broadcast_id))
+            conn.commit()
+    except DatabaseError as e:
+        logging.error(f"Error saving broadcast progress: {e}")
+
+def stream_user_ids(after_user_id: int = 0, batch_size: int = 1000):
+    """
+    Yields batches of user IDs above `after_user_id` in ascending order. The rows are streamed
+    on a dedicated connection (Engine.stream), so a long broadcast neither loads every user
+    into memory nor holds a pooled connection. Database errors propagate.
+    """
+    batches = get_engine().stream("SELECT user_id FROM Users WHERE user_id > %s ORDER BY user_id",
+                                  (after_user_id,), batch_size)
+    try:
+        for rows in batches:
+            yield [row[0] for row in rows]
+    finally:
+        batches.close()
+
+def stream_orders(date_from: Optional[date] = None, date_to: Optional[date] = None,
+                  status: Optional[str] = None, batch_size: int = 5000):
+    """
+    Yields batches of order items for the export, oldest order first, as (order_id, created_at,
+    status, user_id, username, full_name, phone_number, location, category, product, quantity,
+    price, total) rows. `date_to` is exclusive. Streamed like stream_user_ids; database errors
+    propagate.
+    """
+    conditions, params = [], []
+    if date_from is not None:
+        conditions.append("Orders.created_at >= %s")
+        params.append(date_from)
+    if date_to is not None:
+        conditions.append("Orders.created_at < %s")
+        params.append(date_to)
+    if status is not None:
+        conditions.append("Orders.status = %s")
+        params.append(status)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    batches = get_engine().stream(f'''
+        SELECT Orders.order_id, Orders.created_at, Orders.status, Orders.user_id,
+               Users.username, Users.full_name, Users.phone_number, Orders.location,
+               Categories.name, Products.name, OrderItems.quantity, OrderItems.price,
+               OrderItems.quantity * OrderItems.price
+        FROM Orders
+        JOIN OrderItems ON OrderItems.order_id = Orders.order_id
+        LEFT JOIN Users ON Users.user_id = Orders.user_id
+        LEFT JOIN Products ON Products.product_id = OrderItems.product_id
+        LEFT JOIN Categories ON Categories.category_id = Products.category_id
+        {where}
+        ORDER BY Orders.created_at, Orders.order_id, OrderItems.item_id
+    ''', tuple(params), batch_size)
+    try:
+        yield from batches
+    finally:
+        batches.close()
+
+
+# Time every query function above (generators such as stream_user_ids are left as they are)
+metrics.instrument_functions(globals(), exclude={"get_engine", "connection", "reader", "pool_stats"})
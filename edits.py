@@ -0,0 +1,117 @@
+"""
+Coalesced message edits.
+
+Rapid taps on one inline keyboard (quantity +/-, page arrows, cart item removal) each want
+to edit the same message. The first edit is sent at once and opens a window; edits asked
+for during the window replace each other, and only the latest is sent when it closes.
+A message thus gets at most one edit per window and always ends up showing the latest state.
+
+Handlers answer the callback themselves and then hand the new content to `message_edits`;
+the edits are sent in the background.
+"""
+import asyncio
+import logging
+from typing import Dict, Optional, Tuple
+
+from aiogram import types
+from aiogram.utils.exceptions import MessageNotModified, MessageToEditNotFound, RetryAfter, TelegramAPIError
+
+from config import EDIT_COALESCE_WINDOW
+
+Key = Tuple[int, int]
+Content = Tuple[str, Optional[types.InlineKeyboardMarkup]]
+
+
+class _Window:
+    __slots__ = ("message", "pending", "shown", "task")
+
+    def __init__(self, message: types.Message):
+        self.message = message
+        self.pending: Optional[Content] = None  # latest content asked for during the window
+        self.shown = None  # content the message shows, as sent to Telegram
+        self.task: Optional[asyncio.Task] = None
+
+
+class EditCoalescer:
+    def __init__(self, window: float = 1.0):
+        self.window = window
+        self._windows: Dict[Key, _Window] = {}
+        self.sent = 0
+        self.coalesced = 0
+
+    async def edit(self, message: types.Message, text: str,
+                   reply_markup: Optional[types.InlineKeyboardMarkup] = None) -> None:
+        """Schedules an edit of the message's text and inline keyboard."""
+        key = (message.chat.id, message.message_id)
+        window = self._windows.get(key)
+        if window is not None:
+            if window.pending is not None:
+                self.coalesced += 1
+            window.pending = (text, reply_markup)
+            return
+
+        window = self._windows[key] = _Window(message)
+        window.pending = (text, reply_markup)
+        window.task = asyncio.get_running_loop().create_task(self._run(key, window))
+
+    def discard(self, chat_id: int, message_id: int) -> None:
+        """Drops pending edits of a message that is about to be deleted."""
+        window = self._windows.pop((chat_id, message_id), None)
+        if window is not None and window.task is not None:
+            window.task.cancel()
+
+    async def close(self) -> None:
+        """Sends the pending edits right away; used on shutdown."""
+        windows = list(self._windows.values())
+        self._windows.clear()
+        for window in windows:
+            window.task.cancel()
+        await asyncio.gather(*(window.task for window in windows), return_exceptions=True)
+        await asyncio.gather(*(self._send(window) for window in windows if window.pending is not None),
+                             return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {"windows": len(self._windows), "sent": self.sent, "coalesced": self.coalesced}
+
+    async def _run(self, key: Key, window: _Window) -> None:
+        try:
+            while window.pending is not None:
+                await self._send(window)
+                await asyncio.sleep(self.window)
+        finally:
+            if self._windows.get(key) is window:
+                del self._windows[key]
+
+    async def _send(self, window: _Window) -> None:
+        text, reply_markup = window.pending
+        window.pending = None
+        shown = (text, reply_markup.to_python() if reply_markup is not None else None)
+        if shown == window.shown:
+            return
+        try:
+            await window.message.edit_text(text, reply_markup=reply_markup)
+            self.sent += 1
+        except MessageNotModified:
+            pass
+        except asyncio.CancelledError:
+            # Interrupted by close(): keep the content so it is still sent
+            if window.pending is None:
+                window.pending = (text, reply_markup)
+            raise
+        except MessageToEditNotFound:
+            # The message was deleted: nothing left to edit
+            window.pending = None
+            return
+        except RetryAfter as e:
+            # Flood control: wait it out, then send whatever is latest by then
+            if window.pending is None:
+                window.pending = (text, reply_markup)
+            await asyncio.sleep(e.timeout)
+            return
+        except TelegramAPIError as e:
+            logging.warning(f"Failed to edit message {window.message.message_id}: {e}")
+            return
+        window.shown = shown
+
+
+message_edits = EditCoalescer(EDIT_COALESCE_WINDOW)
@@ -0,0 +1,49 @@
+def format_order_items(items) -> str:
+    """Formats (name, quantity, price) rows of an order for a message."""
+    content = "\n".join(
+        f"🔹 {name} - {quantity} шт. x {price:,} UZS = {quantity * price:,} UZS".replace(",", " ")
+        for name, quantity, price in items
+    )
+    total_price = sum(quantity * price for _, quantity, price in items)
+    return f"{content}\n\n💵 Итого: {total_price:,} UZS".replace(",", " ")
+
+def order_notification_text(order: dict) -> str:
+    """Text of the new-order message posted to the group chat."""
+    customer_info = f"👤 Имя: {order['full_name']}\n📞 Телефон: +{order['phone_number']}"
+    return (
+        f"🆕 Новый заказ #{order['order_id']}:\n"
+        f"\n{format_order_items(order['items'])}\n\n"
+        f"{customer_info}\n"
+        f"📍 Локация: {order['location']}"
+    )
+
+def sales_summary_text(summary: dict, days: int) -> str:
+    """Text of the admin sales analytics for the last `days` days."""
+    def money(value) -> str:
+        return f"{value:,} UZS".replace(",", " ")
+
+    orders = sum(row[1] for row in summary["daily"])
+    items = sum(row[2] for row in summary["daily"])
+    revenue = sum(row[3] for row in summary["daily"])
+    period = "сегодня" if days == 1 else f"за {days} дн."
+    lines = [
+        f"📊 Продажи {period}",
+        "",
+        f"🧾 Заказов: {orders}, позиций: {items}",
+        f"💵 Выручка: {money(revenue)}",
+        f"🧮 Средний чек: {money(revenue // orders) if orders else '—'}",
+        f"👥 Покупателей: {summary['customers']}, из них новых: {summary['new_customers']}",
+    ]
+    if days > 1 and summary["daily"]:
+        lines += ["", "📅 По дням:"]
+        lines += [f"{day:%d.%m} — {day_orders} зак., {money(day_revenue)}"
+                  for day, day_orders, _, day_revenue in summary["daily"]]
+    if summary["categories"]:
+        lines += ["", "📂 По категориям:"]
+        lines += [f"{name} — {category_orders} зак., {quantity} шт., {money(category_revenue)}"
+                  for name, category_orders, quantity, category_revenue in summary["categories"]]
+    if summary["products"]:
+        lines += ["", "🏆 Лидеры продаж:"]
+        lines += [f"{i}. {name} — {quantity} шт. в {product_orders} зак., {money(product_revenue)}"
+                  for i, (name, product_orders, quantity, product_revenue) in enumerate(summary["products"], 1)]
+    return "\n".join(lines)
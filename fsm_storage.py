@@ -0,0 +1,242 @@
+"""
+Persistent FSM storage backed by a local SQLite file.
+
+Records live in a bounded in-memory hot layer; changes are coalesced and written to SQLite
+in one transaction every `flush_interval` seconds, so a restart keeps carts and order-flow
+state. Sessions idle for longer than `ttl` are evicted from both layers.
+"""
+import asyncio
+import copy
+import json
+import logging
+import sqlite3
+import time
+import typing
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from aiogram.dispatcher.storage import BaseStorage
+
+EMPTY_RECORD = {'state': None, 'data': {}, 'bucket': {}}
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM storage with an LRU hot layer in front of a SQLite table.
+    """
+
+    def __init__(self, path: str, hot_size: int = 10000, ttl: float = 14 * 86400,
+                 flush_interval: float = 1.0, cleanup_interval: float = 600.0):
+        self.path = path
+        self.hot_size = hot_size
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.cleanup_interval = cleanup_interval
+
+        self._hot: 'OrderedDict[typing.Tuple[str, str], dict]' = OrderedDict()
+        self._dirty: typing.Set[typing.Tuple[str, str]] = set()
+        # Every SQLite call runs on this single thread, off the event loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm")
+        self._flush_task: typing.Optional[asyncio.Task] = None
+        self._last_cleanup = time.time()
+        self._closed = False
+
+        self._conn = self._executor.submit(self._open).result()
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS fsm_records (
+                chat TEXT NOT NULL,
+                user TEXT NOT NULL,
+                state TEXT,
+                data TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (chat, user)
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_records_updated ON fsm_records (updated_at)")
+        conn.commit()
+        return conn
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    # Hot layer
+
+    def _load(self, key) -> typing.Optional[dict]:
+        row = self._conn.execute(
+            "SELECT state, data, bucket, updated_at FROM fsm_records WHERE chat = ? AND user = ?", key
+        ).fetchone()
+        if row is None or row[3] < time.time() - self.ttl:
+            return None
+        return {'state': row[0], 'data': json.loads(row[1]), 'bucket': json.loads(row[2]), 'touched': row[3]}
+
+    async def _get(self, chat, user) -> dict:
+        chat, user = map(str, self.check_address(chat=chat, user=user))
+        key = (chat, user)
+        record = self._hot.get(key)
+        if record is None:
+            loaded = await self._run(self._load, key)
+            # Another coroutine may have created the record while we were loading
+            record = self._hot.get(key)
+            if record is None:
+                record = loaded or dict(copy.deepcopy(EMPTY_RECORD), touched=time.time())
+                self._hot[key] = record
+        self._hot.move_to_end(key)
+        return record
+
+    def _touch(self, chat, user, record: dict) -> None:
+        chat, user = map(str, self.check_address(chat=chat, user=user))
+        record['touched'] = time.time()
+        self._dirty.add((chat, user))
+        if self._flush_task is None and not self._closed:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    # Write-behind
+
+    def _write(self, rows: list, deleted: list, expire_before: typing.Optional[float]) -> None:
+        with self._conn:
+            if rows:
+                self._conn.executemany('''
+                    INSERT INTO fsm_records (chat, user, state, data, bucket, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (chat, user) DO UPDATE SET
+                        state = excluded.state, data = excluded.data,
+                        bucket = excluded.bucket, updated_at = excluded.updated_at
+                ''', rows)
+            if deleted:
+                self._conn.executemany("DELETE FROM fsm_records WHERE chat = ? AND user = ?", deleted)
+            if expire_before is not None:
+                self._conn.execute("DELETE FROM fsm_records WHERE updated_at < ?", (expire_before,))
+
+    async def flush(self) -> None:
+        """Writes every changed record to SQLite and trims the hot layer."""
+        dirty, self._dirty = self._dirty, set()
+        rows, deleted = [], []
+        for key in dirty:
+            record = self._hot.get(key)
+            if record is None:
+                continue
+            if record['state'] is None and not record['data'] and not record['bucket']:
+                deleted.append(key)
+            else:
+                rows.append(key + (record['state'], json.dumps(record['data']),
+                                   json.dumps(record['bucket']), record['touched']))
+
+        now = time.time()
+        expire_before = None
+        if now - self._last_cleanup >= self.cleanup_interval:
+            self._last_cleanup = now
+            expire_before = now - self.ttl
+            for key in [key for key, record in self._hot.items() if record['touched'] < expire_before]:
+                self._dirty.discard(key)
+                del self._hot[key]
+
+        if rows or deleted or expire_before is not None:
+            try:
+                await self._run(self._write, rows, deleted, expire_before)
+            except sqlite3.Error as e:
+                logging.error(f"Failed to persist FSM state: {e}")
+                self._dirty |= dirty
+                return
+
+        # Only clean records can leave the hot layer without losing writes
+        for key in list(self._hot):
+            if len(self._hot) <= self.hot_size:
+                break
+            if key not in self._dirty:
+                del self._hot[key]
+
+    async def _flush_loop(self) -> None:
+        while not self._closed:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def close(self):
+        self._closed = True
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+    async def wait_closed(self):
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
+
+    # BaseStorage
+
+    async def get_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        record = await self._get(chat, user)
+        return record['state'] if record['state'] is not None else self.resolve_state(default)
+
+    async def get_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[dict] = None) -> typing.Dict:
+        record = await self._get(chat, user)
+        return copy.deepcopy(record['data'])
+
+    async def update_data(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          data: typing.Dict = None, **kwargs):
+        if data is None:
+            data = {}
+        record = await self._get(chat, user)
+        record['data'].update(copy.deepcopy(data), **copy.deepcopy(kwargs))
+        self._touch(chat, user, record)
+
+    async def set_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        state: typing.AnyStr = None):
+        record = await self._get(chat, user)
+        record['state'] = self.resolve_state(state)
+        self._touch(chat, user, record)
+
+    async def set_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        record = await self._get(chat, user)
+        record['data'] = copy.deepcopy(data) if data else {}
+        self._touch(chat, user, record)
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         default: typing.Optional[dict] = None) -> typing.Dict:
+        record = await self._get(chat, user)
+        return copy.deepcopy(record['bucket'])
+
+    async def set_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         bucket: typing.Dict = None):
+        record = await self._get(chat, user)
+        record['bucket'] = copy.deepcopy(bucket) if bucket else {}
+        self._touch(chat, user, record)
+
+    async def update_bucket(self, *,
+                            chat: typing.Union[str, int, None] = None,
+                            user: typing.Union[str, int, None] = None,
+                            bucket: typing.Dict = None, **kwargs):
+        if bucket is None:
+            bucket = {}
+        record = await self._get(chat, user)
+        record['bucket'].update(copy.deepcopy(bucket), **copy.deepcopy(kwargs))
+        self._touch(chat, user, record)
+
+    def stats(self) -> dict:
+        return {"hot": len(self._hot), "dirty": len(self._dirty), "hot_size": self.hot_size}
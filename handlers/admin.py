@@ -1,10 +1,19 @@
+import logging
+import tempfile
 from aiogram import types
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.dispatcher import FSMContext
-from db import add_category, add_product, delete_category, delete_product, get_categories, get_products, get_product_by_id, get_category_by_id, get_users
-from keyboards import get_products_keyboard
+from async_db import add_category, add_product, delete_category, delete_product, get_categories, get_product_by_id, get_products_page, get_category_by_id, set_product_stock, get_users_page, import_products, get_sales_summary
+from keyboards import get_cursor_keyboard, get_products_keyboard, parse_page_callback
 from config import ADMIN_ID
 from states import AdminStates
+from edits import message_edits
+from formatting import sales_summary_text
+from broadcast import broadcaster
+from catalog_import import PriceList, PriceListError
+from order_export import MAX_DOCUMENT_SIZE, export_orders, parse_filters
+from storage import DatabaseError
+import metrics
 
 items_per_page = 10
 users_per_page = 20
@@ -13,86 +22,85 @@ users_per_page = 20
 async def admin_menu(message: types.Message):
     if message.from_user.id in ADMIN_ID:
         keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
-        keyboard.add("🛒 Товары").add("📂 Категории").add("👤 Пользователи")
+        keyboard.add("🛒 Товары").add("📂 Категории").add("👤 Пользователи").add("📣 Рассылка").add("📥 Импорт").add("📊 Аналитика")
         await message.answer("🤖 Панель управления:", reply_markup=keyboard)
         await AdminStates.admin_menu.set()
     else:
         await message.answer("❌ Эта команда доступна только для администратора.")
 
-async def product_listing(message: types.Message, state: FSMContext, page: int = 1):
-    products = get_products()
+def product_page(products: list, total: int, page: int):
+    """Builds the text and keyboard of one page of the admin product list."""
+    total_pages = (total - 1) // items_per_page + 1
+    first_number = (page - 1) * items_per_page + 1
+    page_content = "\n".join(
+        f"{number}. {product[2]} - {product[3]} UZS"
+        for number, product in enumerate(products, start=first_number)
+    )
+    text = f"{page}/{total_pages}\n\n{page_content}\n\nВыберите продукт для редактирования"
+    keyboard = get_cursor_keyboard(page, total_pages, first_number, [product[0] for product in products]).add(
+        InlineKeyboardButton("Добавить товар", callback_data="add_product")
+    )
+    return text, keyboard
+
+async def product_listing(message: types.Message, state: FSMContext):
+    products, total = await get_products_page(limit=items_per_page)
     if products:
-        total_pages = (len(products) - 1) // items_per_page + 1
-        start_idx = (page - 1) * items_per_page
-        end_idx = min(start_idx + items_per_page, len(products))
-        page_content = "\n".join(
-            f"{i + 1}. {products[i][2]} - {products[i][3]} UZS"
-            for i in range(start_idx, end_idx)
-        )
-        text = f"{page}/{total_pages}\n\n{page_content}\n\nВыберите продукт для редактирования"
+        text, keyboard = product_page(products, total, 1)
         
         await message.answer("Список товаров:", reply_markup=ReplyKeyboardMarkup(resize_keyboard=True).add("Назад"))
-        product_list_message = await message.answer(text, reply_markup=
-        get_products_keyboard(page, total_pages, items_per_page, products).add(
-            InlineKeyboardButton("Добавить товар", callback_data="add_product")
-            )
-        )
-        await state.update_data(products=products, product_list_message_id=product_list_message.message_id)
+        product_list_message = await message.answer(text, reply_markup=keyboard)
+        await state.update_data(product_list_message_id=product_list_message.message_id)
 
         await AdminStates.selecting_product.set()
     else:
         await message.answer("⚠️ Продуктов нет.", reply_markup=InlineKeyboardMarkup().add(InlineKeyboardButton("Добавить товар", callback_data="add_product")))
 
 async def change_page(callback_query: types.CallbackQuery, state: FSMContext):
-    admin_data = await state.get_data()
-    products = admin_data['products']
-    page = int(callback_query.data.split("_")[1])
-    total_pages = (len(products) - 1) // items_per_page + 1
-
-    start_idx = (page - 1) * items_per_page
-    end_idx = min(start_idx + items_per_page, len(products))
-    page_content = "\n".join(
-        f"{i + 1}. {products[i][2]} - {products[i][3]} UZS"
-        for i in range(start_idx, end_idx)
-    )
-
-    text = f"{page}/{total_pages}\n\n{page_content}\n\nВыберите продукт для редактирования"
-
-    await callback_query.message.edit_text(text, reply_markup=
-        get_products_keyboard(page, total_pages, items_per_page, products).add(
-            InlineKeyboardButton("Добавить товар", callback_data="add_product")
-        )
-    )
+    page, after_id, before_id = parse_page_callback(callback_query.data)
+    products, total = await get_products_page(after_id, before_id, items_per_page)
+    if not products:
+        # The cursor ran past the end (products were deleted meanwhile): start over
+        page = 1
+        products, total = await get_products_page(limit=items_per_page)
+    if not products:
+        await callback_query.answer("⚠️ Продуктов нет.")
+        return
+
+    text, keyboard = product_page(products, total, page)
     await callback_query.answer()
+    await message_edits.edit(callback_query.message, text, reply_markup=keyboard)
 
 async def product_selection(callback_query: types.CallbackQuery, state: FSMContext):
-    admin_data = await state.get_data()
-    products = admin_data['products']
-    item_index = int(callback_query.data.split("_")[1])
+    product_id = int(callback_query.data.split("_")[1])
+    product = await get_product_by_id(product_id)
+    if product is None:
+        await callback_query.answer("⚠️ Товар не найден.")
+        return
 
-    if item_index < len(products):
-        selected_product = products[item_index]
-        await state.update_data(selected_product=selected_product)
-        await AdminStates.viewing_product.set()
-        await view_product(callback_query, state)
+    selected_product = (product['product_id'], product['category_id'], product['name'], product['price'], product['stock'])
+    await state.update_data(selected_product=selected_product)
+    await AdminStates.viewing_product.set()
+    await view_product(callback_query, state)
 
 async def view_product(callback_query: types.CallbackQuery, state: FSMContext):
     admin_data = await state.get_data()
     product = admin_data['selected_product']
-    category_name = get_category_by_id(product[1])
+    category_name = await get_category_by_id(product[1])
     if product:
         product_id = product[0]
         product_text = (
             f"ID: {product[0]}\n"
             f"Название: {product[2]}\n"
             f"Категория: {category_name}\n"
-            f"Цена: {product[3]} UZS"
+            f"Цена: {product[3]} UZS\n"
+            f"Остаток: {'не ведётся' if product[4] is None else f'{product[4]} шт.'}"
         )
 
         keyboard = InlineKeyboardMarkup().add(
+            InlineKeyboardButton("Изменить остаток", callback_data=f"stock_product:{product_id}"),
             InlineKeyboardButton("Удалить", callback_data=f"delete_product:{product_id}")
         )
-        await callback_query.message.edit_text(product_text, reply_markup=keyboard)
+        await message_edits.edit(callback_query.message, product_text, reply_markup=keyboard)
     else:
         await callback_query.answer("⚠️ Товар не найден.")
 
@@ -100,8 +108,8 @@ async def delete_product_handler(callback_query: types.CallbackQuery, state: FSM
     product_id = int(callback_query.data.split(":")[1])
 
     try:
-        delete_product(product_id)
-        await callback_query.message.edit_text("✅ Товар успешно удалён.")
+        await delete_product(product_id)
+        await message_edits.edit(callback_query.message, "✅ Товар успешно удалён.")
         
         await product_listing(callback_query.message, state)
     except Exception as e:
@@ -109,13 +117,43 @@ async def delete_product_handler(callback_query: types.CallbackQuery, state: FSM
 
     await callback_query.answer()
 
+async def product_stock_prompt(callback_query: types.CallbackQuery, state: FSMContext):
+    product_id = int(callback_query.data.split(":")[1])
+    await state.update_data(stock_product_id=product_id)
+    await callback_query.answer()
+    await callback_query.message.answer(
+        "Введите остаток товара в штуках или «-», чтобы не вести остаток:",
+        reply_markup=ReplyKeyboardMarkup(resize_keyboard=True).add("Отмена")
+    )
+    await AdminStates.entering_product_stock.set()
+
+async def product_stock_set(message: types.Message, state: FSMContext):
+    text = (message.text or "").strip()
+    if text == "-":
+        stock = None
+    else:
+        try:
+            stock = int(text)
+        except ValueError:
+            stock = None
+        if stock is None or stock < 0:
+            await message.answer("❌ Введите целое число не меньше нуля или «-».")
+            return
+
+    admin_data = await state.get_data()
+    if await set_product_stock(admin_data['stock_product_id'], stock):
+        await message.answer("✅ Остаток товара обновлён.", reply_markup=types.ReplyKeyboardRemove())
+    else:
+        await message.answer("⚠️ Товар не найден.", reply_markup=types.ReplyKeyboardRemove())
+    await admin_menu(message)
+
 async def add_product_handler(callback_query: types.CallbackQuery, state: FSMContext):
     await callback_query.message.delete()
     await callback_query.message.answer("Введите название нового товара:", reply_markup=ReplyKeyboardMarkup(resize_keyboard=True).add("Отмена"))
     await AdminStates.entering_product_name.set()
 
 async def product_name_set(message: types.Message, state: FSMContext):
-    categories = get_categories()
+    categories = await get_categories()
     await state.update_data(product_name=message.text, categories = categories)
     if categories:
         category_buttons = [KeyboardButton(category[1]) for category in categories]
@@ -149,7 +187,7 @@ async def product_price_set(message: types.Message, state: FSMContext):
         product_name = admin_data['product_name']
         product_category = admin_data['product_category']
         
-        add_product(product_category, product_name, price)
+        await add_product(product_category, product_name, price)
 
         await message.answer("✅ Новый товар успешно добавлен!", reply_markup=types.ReplyKeyboardRemove())
         await admin_menu(message)
@@ -162,7 +200,7 @@ async def handle_cancel(message: types.Message, state: FSMContext):
 
 
 async def category_listing(message: types.Message, state: FSMContext, page: int = 1):
-    categories = get_categories()
+    categories = await get_categories()
     if categories:
         total_pages = (len(categories) - 1) // items_per_page + 1
         start_idx = (page - 1) * items_per_page
@@ -198,12 +236,12 @@ async def change_category_page(callback_query: types.CallbackQuery, state: FSMCo
     )
     text = f"{page}/{total_pages}\n\n{page_content}\n\nВыберите категорию для редактирования"
 
-    await callback_query.message.edit_text(text, reply_markup=
+    await callback_query.answer()
+    await message_edits.edit(callback_query.message, text, reply_markup=
         get_products_keyboard(page, total_pages, items_per_page, categories).add(
             InlineKeyboardButton("Добавить категорию", callback_data="add_category")
         )
     )
-    await callback_query.answer()
 
 async def category_selection(callback_query: types.CallbackQuery, state: FSMContext):
     admin_data = await state.get_data()
@@ -229,7 +267,7 @@ async def view_category(callback_query: types.CallbackQuery, state: FSMContext):
         keyboard = InlineKeyboardMarkup().add(
             InlineKeyboardButton("Удалить", callback_data=f"delete_category:{category_id}")
         )
-        await callback_query.message.edit_text(category_text, reply_markup=keyboard)
+        await message_edits.edit(callback_query.message, category_text, reply_markup=keyboard)
     else:
         await callback_query.answer("⚠️ Категория не найдена.")
 
@@ -237,8 +275,8 @@ async def delete_category_handler(callback_query: types.CallbackQuery, state: FS
     category_id = int(callback_query.data.split(":")[1])
 
     try:
-        delete_category(category_id)
-        await callback_query.message.edit_text("✅ Категория успешно удалена.")
+        await delete_category(category_id)
+        await message_edits.edit(callback_query.message, "✅ Категория успешно удалена.")
         await category_listing(callback_query.message, state)
     except Exception as e:
         await callback_query.message.answer(f"❌ Ошибка при удалении категории: {e}")
@@ -254,58 +292,196 @@ async def category_name_set(message: types.Message, state: FSMContext):
     category_name = message.text
 
     try:
-        add_category(category_name)
+        await add_category(category_name)
         await message.answer("✅ Новая категория успешно добавлена!", reply_markup=types.ReplyKeyboardRemove())
         await admin_menu(message)
     except Exception as e:
         await message.answer(f"❌ Ошибка при добавлении категории: {e}")
 
-async def user_listing(message: types.Message, state: FSMContext, page: int = 1):
-    users = get_users()  # Получаем список пользователей из базы данных
+def user_page(users: list, total: int, page: int):
+    """Builds the text and keyboard of one page of the admin user list."""
+    total_pages = (total - 1) // users_per_page + 1
+    first_number = (page - 1) * users_per_page + 1
+    page_content = "\n".join(
+        f"{number}. {user[1]} - ID: {user[0]}"
+        for number, user in enumerate(users, start=first_number)
+    )
+    text = f"{page}/{total_pages}\n\n{page_content}"
+    keyboard = get_cursor_keyboard(page, total_pages, first_number, [user[0] for user in users],
+                                   page_prefix="usrpage", item_prefix=None)
+    return text, keyboard
+
+async def user_listing(message: types.Message, state: FSMContext):
+    users, total = await get_users_page(limit=users_per_page)
     if users:
-        total_pages = (len(users) - 1) // users_per_page + 1
-        start_idx = (page - 1) * users_per_page
-        end_idx = min(start_idx + users_per_page, len(users))
-        page_content = "\n".join(
-            f"{i + 1}. {users[i][1]} - ID: {users[i][0]}"
-            for i in range(start_idx, end_idx)
-        )
-        text = f"{page}/{total_pages}\n\n{page_content}"
+        text, keyboard = user_page(users, total, 1)
 
         await message.answer("Список пользователей:", reply_markup=ReplyKeyboardMarkup(resize_keyboard=True).add("Назад"))
-        user_list_message = await message.answer(text, reply_markup=get_users_keyboard(page, total_pages))
-        await state.update_data(users=users, user_list_message_id=user_list_message.message_id)
+        user_list_message = await message.answer(text, reply_markup=keyboard)
+        await state.update_data(user_list_message_id=user_list_message.message_id)
 
         await AdminStates.viewing_user_list.set()
     else:
         await message.answer("⚠️ Нет доступных пользователей.")
 
-def get_users_keyboard(page: int, total_pages: int):
-    keyboard = InlineKeyboardMarkup()
-    if page > 1:
-        keyboard.add(InlineKeyboardButton("⬅️", callback_data=f"usrpage_{page - 1}"))
-    if page < total_pages:
-        keyboard.add(InlineKeyboardButton("➡️", callback_data=f"usrpage_{page + 1}"))
-    return keyboard
-
 async def change_user_page(callback_query: types.CallbackQuery, state: FSMContext):
-    admin_data = await state.get_data()
-    users = admin_data['users']
-    page = int(callback_query.data.split("_")[1])
-    total_pages = (len(users) - 1) // users_per_page + 1
+    page, after_id, before_id = parse_page_callback(callback_query.data)
+    users, total = await get_users_page(after_id, before_id, users_per_page)
+    if not users:
+        page = 1
+        users, total = await get_users_page(limit=users_per_page)
+    if not users:
+        await callback_query.answer("⚠️ Нет доступных пользователей.")
+        return
+
+    text, keyboard = user_page(users, total, page)
+    await callback_query.answer()
+    await message_edits.edit(callback_query.message, text, reply_markup=keyboard)
 
-    start_idx = (page - 1) * users_per_page
-    end_idx = min(start_idx + users_per_page, len(users))
-    page_content = "\n".join(
-        f"{i + 1}. {users[i][1]} - ID: {users[i][0]}"
-        for i in range(start_idx, end_idx)
+
+
+async def broadcast_prompt(message: types.Message, state: FSMContext):
+    await message.answer("Введите текст рассылки для всех пользователей:", reply_markup=ReplyKeyboardMarkup(resize_keyboard=True).add("Отмена"))
+    await AdminStates.entering_broadcast_text.set()
+
+async def broadcast_text_set(message: types.Message, state: FSMContext):
+    # Рассылка идёт в фоне; о ходе отправки сообщает отдельное сообщение со статусом
+    broadcast_id = await broadcaster.create(message.chat.id, message.text)
+    if broadcast_id is None:
+        await message.answer("❌ Ошибка при создании рассылки.")
+    else:
+        await message.answer(f"✅ Рассылка #{broadcast_id} запущена.", reply_markup=types.ReplyKeyboardRemove())
+    await admin_menu(message)
+
+async def broadcast_cancel_handler(callback_query: types.CallbackQuery, state: FSMContext):
+    if callback_query.from_user.id not in ADMIN_ID:
+        await callback_query.answer("❌ Доступно только администратору.")
+        return
+    _, _, broadcast_id = callback_query.data.partition(":")
+    if not broadcast_id.isdigit():
+        await callback_query.answer()
+        return
+    if broadcaster.cancel(int(broadcast_id)):
+        await callback_query.answer("Рассылка будет остановлена.")
+    else:
+        await callback_query.answer("Рассылка уже завершена.")
+
+async def import_prompt(message: types.Message, state: FSMContext):
+    await message.answer(
+        "Отправьте прайс-лист файлом .csv: в каждой строке категория, название и цена.\n"
+        "Первой строкой может идти заголовок (Категория, Название, Цена). "
+        "Товары с тем же названием в категории получат новую цену, остальные будут добавлены.",
+        reply_markup=ReplyKeyboardMarkup(resize_keyboard=True).add("Отмена")
     )
-    text = f"{page}/{total_pages}\n\n{page_content}"
+    await AdminStates.uploading_price_list.set()
+
+def import_report(result: dict, price_list: PriceList) -> str:
+    """Text of the import summary sent to the admin."""
+    lines = [
+        f"✅ Импорт завершён, строк: {price_list.rows}",
+        f"Добавлено: {result['inserted']}",
+        f"Обновлено: {result['updated']}",
+        f"Без изменений: {result['unchanged']}",
+        f"Новых категорий: {result['categories']}",
+        f"Отклонено: {price_list.rejected}",
+    ]
+    if result['duplicates']:
+        lines.append(f"Повторы (взята последняя строка): {result['duplicates']}")
+    lines += [f"  строка {line}: {reason}" for line, reason in price_list.errors]
+    if price_list.rejected > len(price_list.errors):
+        lines.append("  …")
+    return "\n".join(lines)
+
+async def price_list_uploaded(message: types.Message, state: FSMContext):
+    document = message.document
+    if not (document.file_name or "").lower().endswith((".csv", ".txt")):
+        await message.answer("❌ Нужен файл .csv. Таблицу Excel сохраните как «CSV (разделитель — точка с запятой)».")
+        return
+
+    # Файл читается построчно прямо в промежуточную таблицу, целиком в память он не загружается
+    with tempfile.TemporaryFile() as file:
+        await document.download(destination_file=file)
+        price_list = PriceList(file)
+        try:
+            result = await import_products(price_list)
+        except PriceListError as e:
+            await message.answer(f"❌ {e}. Каталог не изменён.")
+            return
+
+    if result is None:
+        await message.answer("❌ Ошибка при импорте. Каталог не изменён.")
+    else:
+        await message.answer(import_report(result, price_list), reply_markup=types.ReplyKeyboardRemove())
+    await admin_menu(message)
 
-    await callback_query.message.edit_text(text, reply_markup=get_users_keyboard(page, total_pages))
+async def price_list_expected(message: types.Message, state: FSMContext):
+    await message.answer("Отправьте прайс-лист файлом .csv или нажмите «Отмена».")
+
+ANALYTICS_PERIODS = ((1, "Сегодня"), (7, "7 дней"), (30, "30 дней"))
+
+def analytics_keyboard(days: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(row_width=3).add(*(
+        InlineKeyboardButton(f"• {label} •" if period == days else label, callback_data=f"analytics:{period}")
+        for period, label in ANALYTICS_PERIODS
+    ))
+
+async def analytics_view(message: types.Message, state: FSMContext):
+    summary = await get_sales_summary(7)
+    if summary is None:
+        await message.answer("❌ Не удалось получить статистику продаж.")
+        return
+    await message.answer(sales_summary_text(summary, 7), reply_markup=analytics_keyboard(7))
+
+async def analytics_period_handler(callback_query: types.CallbackQuery, state: FSMContext):
+    if callback_query.from_user.id not in ADMIN_ID:
+        await callback_query.answer("❌ Доступно только администратору.")
+        return
+    _, _, period = callback_query.data.partition(":")
+    days = int(period) if period.isdigit() else None
+    if days not in dict(ANALYTICS_PERIODS):
+        await callback_query.answer()
+        return
+    summary = await get_sales_summary(days)
+    if summary is None:
+        await callback_query.answer("❌ Не удалось получить статистику продаж.")
+        return
     await callback_query.answer()
+    await message_edits.edit(callback_query.message, sales_summary_text(summary, days),
+                             reply_markup=analytics_keyboard(days))
 
+async def stats_command(message: types.Message):
+    if message.from_user.id not in ADMIN_ID:
+        await message.answer("❌ Эта команда доступна только для администратора.")
+        return
+    await message.answer(f"📊 Статистика\n\n{metrics.summary()}")
 
+async def export_command(message: types.Message):
+    if message.from_user.id not in ADMIN_ID:
+        await message.answer("❌ Эта команда доступна только для администратора.")
+        return
+    try:
+        filters = parse_filters(message.get_args() or "")
+    except ValueError as e:
+        await message.answer(f"❌ {e}.\nПример: /export 2024-01-01 2024-01-31 New")
+        return
+
+    await message.answer(f"⏳ Готовлю выгрузку заказов ({filters.describe()})…")
+    with tempfile.TemporaryFile() as file:
+        try:
+            rows = await export_orders(file, filters)
+        except DatabaseError as e:
+            logging.error(f"Order export failed: {e}")
+            await message.answer("❌ Ошибка при выгрузке заказов.")
+            return
+        if rows == 0:
+            await message.answer("Заказов с такими условиями нет.")
+            return
+        if file.tell() > MAX_DOCUMENT_SIZE:
+            await message.answer("❌ Файл больше 50 МБ, Telegram его не примет. Укажите период покороче.")
+            return
+        file.seek(0)
+        await message.answer_document(types.InputFile(file, filename=filters.filename()),
+                                      caption=f"📦 Заказы ({filters.describe()}): {rows} позиций")
 
 async def handle_back(message: types.Message, state: FSMContext):
     current_state = await state.get_state()
@@ -332,6 +508,8 @@ async def handle_back(message: types.Message, state: FSMContext):
 # Регистрация обработчиков
 def register_admin_handlers(dp):
     dp.register_message_handler(admin_menu, commands=['admin'], state="*")
+    dp.register_message_handler(stats_command, commands=['stats'], state="*")
+    dp.register_message_handler(export_command, commands=['export'], state="*")
 
     dp.register_message_handler(handle_back, lambda message: message.text == 'Назад', state="*")
     dp.register_message_handler(handle_cancel, lambda message: message.text == 'Отмена', state="*")
@@ -344,6 +522,8 @@ def register_admin_handlers(dp):
     dp.register_callback_query_handler(product_selection, lambda c: c.data.startswith("item_"), state=AdminStates.selecting_product)
     dp.register_callback_query_handler(add_product_handler, lambda c: c.data == "add_product", state="*")
     dp.register_callback_query_handler(delete_product_handler, lambda c: c.data.startswith("delete_product:"), state=AdminStates.viewing_product)
+    dp.register_callback_query_handler(product_stock_prompt, lambda c: c.data.startswith("stock_product:"), state=AdminStates.viewing_product)
+    dp.register_message_handler(product_stock_set, state=AdminStates.entering_product_stock)
     dp.register_message_handler(product_name_set, state=AdminStates.entering_product_name)
     dp.register_message_handler(product_category_selection, state=AdminStates.selecting_product_category)
     dp.register_message_handler(product_price_set, state=AdminStates.entering_product_price)
@@ -354,4 +534,14 @@ def register_admin_handlers(dp):
     dp.register_callback_query_handler(delete_category_handler, lambda c: c.data.startswith("delete_category:"), state=AdminStates.viewing_category)
     dp.register_message_handler(category_name_set, state=AdminStates.entering_category_name)
 
-    dp.register_callback_query_handler(change_user_page, lambda c: c.data.startswith("usrpage_"), state=AdminStates.viewing_user_list)
\ No newline at end of file
+    dp.register_callback_query_handler(change_user_page, lambda c: c.data.startswith("usrpage_"), state=AdminStates.viewing_user_list)
+
+    dp.register_message_handler(broadcast_prompt, text="📣 Рассылка", state=AdminStates.admin_menu)
+    dp.register_message_handler(broadcast_text_set, state=AdminStates.entering_broadcast_text)
+    dp.register_callback_query_handler(broadcast_cancel_handler, lambda c: c.data.startswith("broadcast_cancel:"), state="*")
+
+    dp.register_message_handler(import_prompt, text="📥 Импорт", state=AdminStates.admin_menu)
+    dp.register_message_handler(analytics_view, text="📊 Аналитика", state=AdminStates.admin_menu)
+    dp.register_callback_query_handler(analytics_period_handler, lambda c: c.data.startswith("analytics:"), state="*")
+    dp.register_message_handler(price_list_uploaded, content_types=types.ContentType.DOCUMENT, state=AdminStates.uploading_price_list)
+    dp.register_message_handler(price_list_expected, content_types=types.ContentType.ANY, state=AdminStates.uploading_price_list)
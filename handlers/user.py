@@ -1,17 +1,31 @@
+import functools
+import hashlib
+import json
+import uuid
 from aiogram import types
 from aiogram.dispatcher import FSMContext
 from aiogram.types import ContentType
-from db import add_user, user_exists, create_order, get_categories, get_products_by_category, get_user_orders, get_user
+from aiogram.utils.exceptions import TelegramAPIError
+from db import OutOfStock
+from async_db import add_user, user_exists, create_order, get_catalog, get_categories, get_user_orders, search_products
 from keyboards import main_keyboard, get_category_keyboard, get_products_keyboard, get_product_keyboard, cart_keyboard, get_cart_keyboard, location_keyboard, phone_keyboard, back_keyboard
 from states import OrderStates, RegistrationStates, UserStates
 from config import GROUP_CHAT_ID
+from formatting import format_order_items
+from outbox import outbox
+from edits import message_edits
+from media import media, product_photo_path
 
 items_per_page = 10
+search_limit = 20
+min_query_length = 2
+inline_limit = 50
 
 def registration_required(handler):
+    @functools.wraps(handler)
     async def wrapper(message: types.Message, state: FSMContext, *args, **kwargs):
         user_id = message.from_user.id
-        if not user_exists(user_id):
+        if not await user_exists(user_id):
             await start(message, state)
         else:
             return await handler(message, state)
@@ -20,7 +34,7 @@ def registration_required(handler):
 # Start
 async def start(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
-    if not user_exists(user_id):
+    if not await user_exists(user_id):
         await message.answer("👋 Добро пожаловать в наш магазин!")
         await message.answer("Пожалуйста, введите своё имя:", reply_markup=types.ReplyKeyboardRemove())
         await RegistrationStates.entering_name.set()
@@ -43,7 +57,7 @@ async def process_phone(message: types.Message, state: FSMContext):
         phone = message.contact.phone_number
 
         # Register user in the database
-        add_user(message.from_user.id, message.from_user.username, name, phone)
+        await add_user(message.from_user.id, message.from_user.username, name, phone)
         await message.answer("✅ Регистрация завершена! \nВыберите опцию ниже для просмотра товаров или получения помощи.", reply_markup=main_keyboard)
         await state.finish()
 
@@ -59,9 +73,9 @@ async def location_handler(message: types.Message, state: FSMContext):
         await category_listing(message, state)
         
 async def category_listing(message: types.Message, state: FSMContext):
-    categories = get_categories()
+    categories = await get_categories()
     if categories:
-        await message.answer("Выберите категорию:", reply_markup=get_category_keyboard(categories))
+        await message.answer("Выберите категорию или введите название товара:", reply_markup=get_category_keyboard(categories))
         await OrderStates.selecting_category.set()
     else:
         await message.answer("⚠️ Категории пока отсутствуют.", reply_markup=main_keyboard)
@@ -69,32 +83,64 @@ async def category_listing(message: types.Message, state: FSMContext):
 
 async def category_selection(message: types.Message, state: FSMContext):
     category_name = message.text
-    categories = get_categories()
-    category = next((c for c in categories if c[1] == category_name), None)
-    await state.update_data(selected_category=category)
+    category = (await get_catalog()).categories_by_name.get(category_name)
     if category:
+        await state.update_data(category_id=category[0], search_results=None)
         await product_listing(message, state)
     else:
+        await product_search(message, state)
+
+async def product_search(message: types.Message, state: FSMContext):
+    query = message.text or ""
+    if len(query.strip()) < min_query_length:
         await message.answer("❌ Категория не найдена. Попробуйте снова.")
+        return
+
+    products = await search_products(query, search_limit)
+    if products:
+        # Only the found IDs are kept; pages resolve them against the shared catalog
+        await state.update_data(category_id=None, search_results=[product[0] for product in products])
+        await product_listing(message, state)
+    else:
+        await message.answer("❌ Ничего не найдено. Выберите категорию или введите другое название.")
+
+def listed_products(user_data: dict, catalog) -> list:
+    """The products of the list the user is browsing: a category or search results."""
+    search_results = user_data.get('search_results')
+    if search_results is not None:
+        return [catalog.products_by_id[product_id] for product_id in search_results
+                if product_id in catalog.products_by_id]
+    return catalog.products_by_category.get(user_data.get('category_id'), [])
+
+def product_page(products: list, page: int):
+    """Builds the text and keyboard of one page of a category's product list."""
+    total_pages = (len(products) - 1) // items_per_page + 1
+    start_idx = (page - 1) * items_per_page
+    end_idx = min(start_idx + items_per_page, len(products))
+    page_content = "\n".join(
+        f"{i + 1}. {products[i][2]} - {products[i][3]:,} UZS".replace(",", " ")
+        for i in range(start_idx, end_idx)
+    )
+    text = f"{page}/{total_pages}\n\n{page_content}\n\nВыберите продукт для просмотра"
+    return text, get_products_keyboard(page, total_pages, items_per_page, products)
+
+def listed_page(user_data: dict, catalog, products: list, page: int):
+    """Text and keyboard of a page of the listed products; category pages are rendered once per catalog version."""
+    if user_data.get('search_results') is not None:
+        return product_page(products, page)
+    return catalog.rendered(("product_page", user_data.get('category_id'), page), lambda: product_page(products, page))
 
 async def product_listing(message: types.Message, state: FSMContext, page: int = 1):
     user_data = await state.get_data()
-    selected_category = user_data['selected_category']
-    category_id = selected_category[0]
-    products = get_products_by_category(category_id)
+    catalog = await get_catalog()
+    products = listed_products(user_data, catalog)
     if products:
-        total_pages = (len(products) - 1) // items_per_page + 1
-        start_idx = (page - 1) * items_per_page
-        end_idx = min(start_idx + items_per_page, len(products))
-        page_content = "\n".join(
-            f"{i + 1}. {products[i][2]} - {products[i][3]:,} UZS".replace(",", " ")
-            for i in range(start_idx, end_idx)
-        )
-        text = f"{page}/{total_pages}\n\n{page_content}\n\nВыберите продукт для просмотра"
+        text, keyboard = listed_page(user_data, catalog, products, page)
 
         await message.answer("📦 Выберите товар для заказа:", reply_markup=cart_keyboard)
-        product_list_message = await message.answer(text, reply_markup=get_products_keyboard(page, total_pages, items_per_page, products))
-        await state.update_data(category_id=category_id, products=products, product_list_message_id=product_list_message.message_id)
+        product_list_message = await message.answer(text, reply_markup=keyboard)
+        # Only the category or search results and the catalog version are kept per user; pages resolve against the shared catalog
+        await state.update_data(catalog_version=catalog.version, product_list_message_id=product_list_message.message_id)
 
         await OrderStates.selecting_product.set()
     else:
@@ -102,33 +148,42 @@ async def product_listing(message: types.Message, state: FSMContext, page: int =
 
 async def change_page(callback_query: types.CallbackQuery, state: FSMContext):
     user_data = await state.get_data()
-    products = user_data['products']
-    page = int(callback_query.data.split("_")[1])
-    total_pages = (len(products) - 1) // items_per_page + 1
-
-    start_idx = (page - 1) * items_per_page
-    end_idx = min(start_idx + items_per_page, len(products))
-    page_content = "\n".join(
-        f"{i + 1}. {products[i][2]} - {products[i][3]:,} UZS".replace(",", " ")
-        for i in range(start_idx, end_idx)
-    )
+    catalog = await get_catalog()
+    products = listed_products(user_data, catalog)
+    if not products:
+        await callback_query.answer("⚠️ В этом каталоге нет товаров.")
+        return
 
-    text = f"{page}/{total_pages}\n\n{page_content}\n\nВыберите продукт для просмотра"
+    total_pages = (len(products) - 1) // items_per_page + 1
+    page = min(int(callback_query.data.split("_")[1]), total_pages)
+    text, keyboard = listed_page(user_data, catalog, products, page)
 
-    await callback_query.message.edit_text(text, reply_markup=get_products_keyboard(page, total_pages, items_per_page, products))
+    await state.update_data(catalog_version=catalog.version)
     await callback_query.answer()
+    await message_edits.edit(callback_query.message, text, reply_markup=keyboard)
 
 async def product_selection(callback_query: types.CallbackQuery, state: FSMContext):
     user_data = await state.get_data()
-    products = user_data['products']
+    catalog = await get_catalog()
+    products = listed_products(user_data, catalog)
     item_index = int(callback_query.data.split("_")[1])
 
+    # The list the user sees was rendered from an older catalog: indexes may have shifted
+    if user_data.get('catalog_version') != catalog.version:
+        if products:
+            text, keyboard = listed_page(user_data, catalog, products, 1)
+            await message_edits.edit(callback_query.message, text, reply_markup=keyboard)
+        await state.update_data(catalog_version=catalog.version)
+        await callback_query.answer("Каталог обновился, выберите товар снова.")
+        return
+
     if item_index < len(products):
         selected_product = products[item_index]
         await state.update_data(selected_product=selected_product, quantity=1)
         
         await view_product(callback_query.message, state)
         await OrderStates.viewing_product.set()
+        message_edits.discard(callback_query.message.chat.id, callback_query.message.message_id)
         await callback_query.message.delete()
         await state.update_data(product_list_message_id=None)
 
@@ -138,7 +193,15 @@ async def view_product(message: types.Message, state: FSMContext):
     quantity = user_data['quantity']
     text = f"🛒 {selected_product[2]}\nЦена: {selected_product[3]:,} UZS\nКоличество: {quantity}\nИтого: {selected_product[3] * quantity:,} UZS".replace(",", " ")
 
-    await message.answer("Выберите количество продукта", reply_markup=back_keyboard)
+    photo = product_photo_path(selected_product[0])
+    if photo is not None:
+        try:
+            await media.answer_photo(message, photo, caption="Выберите количество продукта", reply_markup=back_keyboard)
+        except (OSError, TelegramAPIError) as e:
+            print(f"Failed to send product photo: {e}")
+            photo = None
+    if photo is None:
+        await message.answer("Выберите количество продукта", reply_markup=back_keyboard)
     product_message = await message.answer(text, reply_markup=get_product_keyboard(quantity))
 
     await state.update_data(product_message_id=product_message.message_id)
@@ -164,8 +227,9 @@ async def update_quantity_message(callback_query: types.CallbackQuery, state: FS
 
     text = f"🛒 {product[2]}\nЦена: {product[3]:,} UZS\nКоличество: {quantity}\nИтого: {product[3] * quantity:,} UZS".replace(",", " ")
 
-    await callback_query.message.edit_text(text, reply_markup=get_product_keyboard(quantity))
     await callback_query.answer()
+    # Rapid taps collapse into one edit showing the latest quantity
+    await message_edits.edit(callback_query.message, text, reply_markup=get_product_keyboard(quantity))
 
 async def add_to_cart_handler(callback_query: types.CallbackQuery, state: FSMContext):
     user_data = await state.get_data()
@@ -180,12 +244,24 @@ async def add_to_cart_handler(callback_query: types.CallbackQuery, state: FSMCon
     else:
         cart.append({"product_id": product[0], "name": product[2], "price": product[3], "quantity": quantity})
     
-    await state.update_data(cart=cart)
+    # A new order session starts with the first item; it ends when the state is finished
+    order_session = user_data.get("order_session") or uuid.uuid4().hex
+    await state.update_data(cart=cart, order_session=order_session)
+    message_edits.discard(callback_query.message.chat.id, callback_query.message.message_id)
     await callback_query.message.delete()
     await callback_query.message.answer(f"✅ Товар добавлен в корзину: {quantity} шт.")
     await show_cart(callback_query.message, state)
     await callback_query.answer()
 
+def cart_text(cart: list) -> str:
+    """Text of the cart message: the items and the total."""
+    cart_content = "\n".join(
+        f"{item['name']} - {item['quantity']} шт. x {item['price']:,} UZS = {item['quantity'] * item['price']:,} UZS".replace(",", " ")
+        for item in cart
+    )
+    total_price = sum(item['quantity'] * item['price'] for item in cart)
+    return f"🛒 Ваша корзина:\n\n{cart_content}\n\nИтого: {total_price:,} UZS".replace(",", " ")
+
 async def show_cart(message: types.Message, state: FSMContext):
     user_data = await state.get_data()
     cart = user_data.get("cart", [])
@@ -198,12 +274,7 @@ async def show_cart(message: types.Message, state: FSMContext):
         await message.bot.delete_message(chat_id=message.chat.id, message_id=product_list_message_id)
         await state.update_data(product_list_message_id=None)
 
-    cart_content = "\n".join(
-        f"{item['name']} - {item['quantity']} шт. x {item['price']:,} UZS = {item['quantity'] * item['price']:,} UZS".replace(",", " ")
-        for item in cart
-    )
-    total_price = sum(item['quantity'] * item['price'] for item in cart)
-    text = f"🛒 Ваша корзина:\n\n{cart_content}\n\nИтого: {total_price:,} UZS".replace(",", " ")
+    text = cart_text(cart)
     
     await message.answer("Корзина:", reply_markup=back_keyboard)
     cart_message = await message.answer(text, reply_markup=get_cart_keyboard(cart))
@@ -213,8 +284,8 @@ async def show_cart(message: types.Message, state: FSMContext):
 
 async def clear_cart_handler(callback_query: types.CallbackQuery, state: FSMContext):
     await state.update_data(cart=[])
-    await callback_query.message.edit_text("🛒 Корзина очищена.")
     await callback_query.answer()
+    await message_edits.edit(callback_query.message, "🛒 Корзина очищена.")
 
 async def delete_item_handler(callback_query: types.CallbackQuery, state: FSMContext):
     user_data = await state.get_data()
@@ -223,19 +294,18 @@ async def delete_item_handler(callback_query: types.CallbackQuery, state: FSMCon
 
     cart = [item for item in cart if item['product_id'] != product_id]
     await state.update_data(cart=cart)
+    await callback_query.answer("Товар удалён из корзины.")
 
     if cart:
-        cart_content = "\n".join(
-            f"{item['name']} - {item['quantity']} шт. x {item['price']:,} UZS = {item['quantity'] * item['price']:,} UZS".replace(",", " ")
-            for item in cart
-        )
-        total_price = sum(item['quantity'] * item['price'] for item in cart)
-        text = f"🛒 Ваша корзина:\n\n{cart_content}\n\nИтого: {total_price:,} UZS".replace(",", " ")
-        await callback_query.message.edit_text(text, reply_markup=get_cart_keyboard(cart))
+        await message_edits.edit(callback_query.message, cart_text(cart), reply_markup=get_cart_keyboard(cart))
     else:
-        await callback_query.message.edit_text("🛒 Ваша корзина пуста.")
-    
-    await callback_query.answer("Товар удалён из корзины.")
+        await message_edits.edit(callback_query.message, "🛒 Ваша корзина пуста.")
+
+def checkout_key(user_id: int, session: str, cart: list, location: list) -> str:
+    """Idempotency key of a checkout: the same session, cart and location give the same key."""
+    items = sorted((item['product_id'], item['quantity']) for item in cart)
+    payload = json.dumps([user_id, session, items, location])
+    return hashlib.sha256(payload.encode()).hexdigest()
 
 async def checkout_order_handler(callback_query: types.CallbackQuery, state: FSMContext):
     user_id = callback_query.from_user.id
@@ -247,46 +317,34 @@ async def checkout_order_handler(callback_query: types.CallbackQuery, state: FSM
         await callback_query.answer("Ваша корзина пуста.", show_alert=True)
         return
 
-    # Получаем данные пользователя из базы данных
-    user_info = get_user(user_id)
-    if not user_info:
-        await callback_query.answer("Ошибка получения данных пользователя.", show_alert=True)
-        return
-
-    full_name, phone_number = user_info
-
-    # Формируем содержимое корзины
-    cart_content = "\n".join(
-        f"🔹 {item['name']} - {item['quantity']} шт. x {item['price']:,} UZS = {item['quantity'] * item['price']:,} UZS".replace(",", " ")
-        for item in cart
-    )
-    total_price = sum(item['quantity'] * item['price'] for item in cart)
-    order_summary = f"\n{cart_content}\n\n💵 Итого: {total_price:,} UZS".replace(",", " ")
-
     # Получаем локацию из состояния
     location = user_data.get('location')
     if not location:
         await callback_query.answer("Локация не указана.", show_alert=True)
         return
 
-    # Создаем заказ в базе данных
-    order_id = create_order(user_id, cart, f"{location[0]}, {location[1]}")
-    if not order_id:
+    # Создаем заказ в базе данных; повторное нажатие или повторная доставка
+    # callback'а с той же корзиной возвращает уже созданный заказ
+    key = checkout_key(user_id, user_data.get("order_session", ""), cart, location)
+    try:
+        result = await create_order(user_id, cart, f"{location[0]}, {location[1]}", idempotency_key=key, notify_chat_id=GROUP_CHAT_ID)
+    except OutOfStock as e:
+        await out_of_stock(callback_query, state, cart, e.shortages)
+        return
+    if not result:
         await callback_query.answer("Ошибка создания заказа.", show_alert=True)
         return
 
-    # Формируем текст сообщения
-    customer_info = f"👤 Имя: {full_name}\n📞 Телефон: +{phone_number}"
-    message_text = (
-        f"🆕 Новый заказ #{order_id}:\n"
-        f"{order_summary}\n\n"
-        f"{customer_info}\n"
-        f"📍 Локация: {location[0]}, {location[1]}"
-    )
+    order_id, created = result
+    message_edits.discard(callback_query.message.chat.id, callback_query.message.message_id)
+    if not created:
+        await callback_query.message.delete()
+        await state.finish()
+        await callback_query.answer(f"Заказ #{order_id} уже оформлен.")
+        return
 
-    # Отправляем сообщение в группу
-    await callback_query.bot.send_location(GROUP_CHAT_ID, location[0], location[1])
-    await callback_query.bot.send_message(GROUP_CHAT_ID, message_text)
+    # Уведомление в группу отправит диспетчер outbox, не задерживая ответ пользователю
+    outbox.wake()
 
     # Сообщаем пользователю об успешном заказе
     await callback_query.message.answer(
@@ -300,39 +358,83 @@ async def checkout_order_handler(callback_query: types.CallbackQuery, state: FSM
     await state.finish()
     await callback_query.answer()
 
+async def out_of_stock(callback_query: types.CallbackQuery, state: FSMContext, cart: list, shortages: list):
+    """Reports the items that ran out and cuts the cart down to what is left, for the user to check out again."""
+    available = {product_id: left for product_id, requested, left in shortages}
+    lines = []
+    for item in cart:
+        if item['product_id'] not in available:
+            continue
+        left = min(available[item['product_id']], item['quantity'])
+        if left:
+            lines.append(f"{item['name']}: осталось {left} шт., в корзине было {item['quantity']}")
+        else:
+            lines.append(f"{item['name']}: нет в наличии")
+        item['quantity'] = left
+    cart = [item for item in cart if item['quantity'] > 0]
+    await state.update_data(cart=cart)
+
+    report = "⚠️ Не хватает товара:\n" + "\n".join(lines)
+    await callback_query.answer("Некоторых товаров не хватает.")
+    if cart:
+        text = f"{report}\n\nКорзина обновлена, проверьте её и оформите заказ снова.\n\n{cart_text(cart)}"
+        await message_edits.edit(callback_query.message, text, reply_markup=get_cart_keyboard(cart))
+    else:
+        await message_edits.edit(callback_query.message, f"{report}\n\n🛒 Ваша корзина пуста.")
+
 async def continue_order_handler(callback_query: types.CallbackQuery, state: FSMContext):
     await handle_back(callback_query.message, state)
 
 @registration_required
 async def viewing_orders(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
-    orders = get_user_orders(user_id)
+    orders = await get_user_orders(user_id)
 
     if not orders:
         await message.answer("У вас пока нет заказов.")
         return
 
+    # Group the order items by order
+    grouped = {}
+    for order_id, status, product_name, quantity, price in orders:
+        grouped.setdefault(order_id, []).append((product_name, quantity, price))
+
     # Format the orders into a message
     orders_text = "Ваши заказы:\n\n"
-    for order in orders:
-        order_id, product_name = order
+    for order_id, items in grouped.items():
         orders_text += (
             f"Заказ #{order_id}:\n"
-            f"Товар: {product_name}\n\n"
+            f"{format_order_items(items)}\n\n"
         )
     await message.answer(orders_text, reply_markup=back_keyboard)
     await UserStates.viewing_orders.set()
 
 async def viewing_info(message: types.Message):
     try:
-        with open("statics/logo.jpg", 'rb') as photo:
-            await message.answer_photo(photo=photo, caption="Alcho Market\n\nНомер телефона:\n+998999999999", reply_markup=back_keyboard)
+        await media.answer_photo(message, "statics/logo.jpg", caption="Alcho Market\n\nНомер телефона:\n+998999999999", reply_markup=back_keyboard)
         await UserStates.viewing_info.set()
     except Exception as e:
         print(f"Failed to send message with image: {e}")
 
 
 
+# Inline mode (@bot <название>): needs inline mode enabled for the bot in @BotFather
+async def inline_search(inline_query: types.InlineQuery):
+    query = inline_query.query
+    products = await search_products(query, inline_limit) if len(query.strip()) >= min_query_length else []
+    results = [
+        types.InlineQueryResultArticle(
+            id=str(product[0]),
+            title=product[2],
+            description=f"{product[3]:,} UZS".replace(",", " "),
+            input_message_content=types.InputTextMessageContent(
+                f"🛒 {product[2]}\nЦена: {product[3]:,} UZS".replace(",", " ")
+            ),
+        )
+        for product in products
+    ]
+    await inline_query.answer(results, cache_time=60)
+
 async def handle_back(message: types.Message, state: FSMContext):
     current_state = await state.get_state()
     user_data = await state.get_data()
@@ -385,4 +487,6 @@ def register_user_handlers(dp):
     dp.register_callback_query_handler(clear_cart_handler, lambda c: c.data == "clear_cart", state=OrderStates.showing_cart)
     dp.register_callback_query_handler(checkout_order_handler, lambda c: c.data == "checkout_order", state=OrderStates.showing_cart)
     dp.register_callback_query_handler(continue_order_handler, lambda c: c.data == "continue_order", state=OrderStates.showing_cart)
-    dp.register_callback_query_handler(delete_item_handler, lambda c: c.data.startswith("delete_item_"), state=OrderStates.showing_cart)
\ No newline at end of file
+    dp.register_callback_query_handler(delete_item_handler, lambda c: c.data.startswith("delete_item_"), state=OrderStates.showing_cart)
+
+    dp.register_inline_handler(inline_search, state="*")
@@ -32,6 +32,32 @@ def get_products_keyboard(page: int, total_pages: int, items_per_page: int, prod
 
     return keyboard
 
+# Keyset-paginated list keyboard: items carry their IDs, arrows carry the page boundary as cursor
+def get_cursor_keyboard(page: int, total_pages: int, first_number: int, item_ids: list,
+                        page_prefix: str = "page", item_prefix: str = "item") -> InlineKeyboardMarkup:
+    keyboard = InlineKeyboardMarkup(row_width=5)
+
+    if item_prefix:
+        for number, item_id in enumerate(item_ids, start=first_number):
+            keyboard.insert(InlineKeyboardButton(str(number), callback_data=f"{item_prefix}_{item_id}"))
+
+    navigation_buttons = []
+    if page > 1 and item_ids:
+        navigation_buttons.append(InlineKeyboardButton("⬅️", callback_data=f"{page_prefix}_{page - 1}_p{item_ids[0]}"))
+    if page < total_pages and item_ids:
+        navigation_buttons.append(InlineKeyboardButton("➡️", callback_data=f"{page_prefix}_{page + 1}_n{item_ids[-1]}"))
+    keyboard.row(*navigation_buttons)
+
+    return keyboard
+
+def parse_page_callback(data: str):
+    """Parses `<prefix>_<page>_<n|p><id>` into (page, after_id, before_id)."""
+    _, page, cursor = data.split("_")
+    cursor_id = int(cursor[1:])
+    if cursor[0] == "n":
+        return int(page), cursor_id, None
+    return int(page), None, cursor_id
+
 # Product viewing keyboard
 def get_product_keyboard(quantity):
     keyboard = InlineKeyboardMarkup(row_width=3)
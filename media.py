@@ -0,0 +1,94 @@
+"""
+Registry of Telegram file_ids for photos sent from disk.
+
+A file is uploaded once; the file_id Telegram returns is stored in MediaFiles with the
+file's checksum, and later sends reuse it instead of reading and uploading the file again.
+Replacing a file on disk changes its checksum, so the next send uploads the new version.
+
+Product photos are looked up as PRODUCT_PHOTOS_DIR/<product_id>.jpg.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+from typing import Dict, Optional, Tuple
+
+from aiogram import types
+from aiogram.utils.exceptions import BadRequest
+
+import async_db
+import db
+from config import PRODUCT_PHOTOS_DIR
+
+
+def product_photo_path(product_id: int) -> Optional[str]:
+    """Path of the product's photo, or None if it has none."""
+    path = os.path.join(PRODUCT_PHOTOS_DIR, f"{product_id}.jpg")
+    return path if os.path.isfile(path) else None
+
+
+class MediaRegistry:
+    def __init__(self):
+        self._file_ids: Optional[Dict[str, Tuple[str, str]]] = None
+        self._checksums: Dict[str, Tuple[int, int, str]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self.uploads = 0
+        self.cached_sends = 0
+
+    def checksum(self, path: str) -> str:
+        """sha256 of the file; it is only read again when its size or mtime changes."""
+        stat = os.stat(path)
+        cached = self._checksums.get(path)
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        with open(path, 'rb') as f:
+            checksum = hashlib.sha256(f.read()).hexdigest()
+        self._checksums[path] = (stat.st_mtime_ns, stat.st_size, checksum)
+        return checksum
+
+    async def _file_id(self, path: str, checksum: str) -> Optional[str]:
+        if self._file_ids is None:
+            file_ids = await async_db.run(db.get_media_files)
+            if self._file_ids is None:
+                self._file_ids = file_ids
+        registered = self._file_ids.get(path)
+        if registered is not None and registered[0] == checksum:
+            return registered[1]
+        return None
+
+    async def answer_photo(self, message: types.Message, path: str, **kwargs) -> types.Message:
+        """Sends the photo at `path` to the message's chat, uploading it only if needed."""
+        checksum = self.checksum(path)
+        file_id = await self._file_id(path, checksum)
+        if file_id is not None:
+            try:
+                sent = await message.answer_photo(file_id, **kwargs)
+                self.cached_sends += 1
+                return sent
+            except BadRequest as e:
+                # file_ids belong to the bot that uploaded them, e.g. after a token change
+                logging.warning(f"Stored file_id of {path} was rejected, uploading again: {e}")
+                self._file_ids.pop(path, None)
+                await async_db.run(db.delete_media_file, path)
+
+        # One upload per file even when several users ask for it at once
+        async with self._locks.setdefault(path, asyncio.Lock()):
+            file_id = await self._file_id(path, checksum)
+            if file_id is not None:
+                sent = await message.answer_photo(file_id, **kwargs)
+                self.cached_sends += 1
+                return sent
+
+            with open(path, 'rb') as photo:
+                sent = await message.answer_photo(photo, **kwargs)
+            self.uploads += 1
+            file_id = sent.photo[-1].file_id
+            self._file_ids[path] = (checksum, file_id)
+            await async_db.run(db.save_media_file, path, checksum, file_id)
+            return sent
+
+    def stats(self) -> dict:
+        return {"registered": len(self._file_ids or {}), "uploads": self.uploads, "cached_sends": self.cached_sends}
+
+
+media = MediaRegistry()
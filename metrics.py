@@ -0,0 +1,265 @@
+"""
+In-process metrics in the Prometheus text format.
+
+- MetricsMiddleware: latency and errors per handler.
+- instrument_functions: call timings of the db.py functions.
+- InstrumentedBot: latency and errors per Bot API method.
+- register_stats: gauges read from the stats() of the pool, caches and workers at scrape time.
+
+start_server serves them on /metrics; summary() is the admin /stats view.
+Recording a sample costs a few microseconds: a bisect and a short locked update.
+"""
+import bisect
+import functools
+import inspect
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+from aiohttp import web
+from aiogram import Bot, types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+PREFIX = "alcho"
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class Histogram:
+    """Latency histogram with one label; buckets are upper bounds in seconds."""
+
+    def __init__(self, name: str, help: str, label: Optional[str] = None, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(buckets)
+        # label value -> [count per bucket..., count above the last bucket, sum]
+        self._series: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value: str, seconds: float) -> None:
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += seconds
+
+    def series(self) -> Dict[str, Tuple[int, float, List[int]]]:
+        """{label value: (count, sum, counts per bucket)}"""
+        with self._lock:
+            return {key: (sum(s[:-1]), s[-1], s[:-1]) for key, s in self._series.items()}
+
+    @staticmethod
+    def quantile(buckets: tuple, counts: List[int], q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile (inf if above the last bucket)."""
+        rank = q * sum(counts)
+        cumulative = 0
+        for bound, count in zip(buckets + (float("inf"),), counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return float("inf")
+
+    def render(self, lines: List[str]) -> None:
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} histogram")
+        for label_value, (count, total, counts) in sorted(self.series().items()):
+            labels = f'{self.label}="{_escape(label_value)}"' if self.label else ""
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{{{labels + "," if labels else ""}le="{le}"}} {cumulative}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {count}")
+
+
+class Counter:
+    """Counter with one label."""
+
+    def __init__(self, name: str, help: str, label: str):
+        self.name = name
+        self.help = help
+        self.label = label
+        self._values: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_value: str) -> None:
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + 1
+
+    def values(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._values)
+
+    def render(self, lines: List[str]) -> None:
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} counter")
+        for label_value, value in sorted(self.values().items()):
+            lines.append(f'{self.name}{{{self.label}="{_escape(label_value)}"}} {value}')
+
+
+handler_latency = Histogram(f"{PREFIX}_handler_seconds", "Handler run time", "handler")
+handler_errors = Counter(f"{PREFIX}_handler_errors_total", "Exceptions raised by handlers", "handler")
+db_latency = Histogram(f"{PREFIX}_db_call_seconds", "db.py call time, including the pool checkout", "function")
+db_executor_wait = Histogram(f"{PREFIX}_db_executor_wait_seconds", "Time a db call waited for a free executor thread")
+api_latency = Histogram(f"{PREFIX}_telegram_api_seconds", "Bot API request time", "method")
+api_errors = Counter(f"{PREFIX}_telegram_api_errors_total", "Failed Bot API requests", "method")
+
+METRICS = [handler_latency, handler_errors, db_latency, db_executor_wait, api_latency, api_errors]
+_stats_sources: List[Tuple[str, Callable[[], dict]]] = []
+
+
+def register_stats(name: str, stats: Callable[[], dict]) -> None:
+    """Exposes the numeric values of stats() as gauges named <prefix>_<name>_<key>."""
+    _stats_sources.append((name, stats))
+
+
+def _collect_stats() -> Dict[str, Dict[str, float]]:
+    collected = {}
+    for name, stats in _stats_sources:
+        try:
+            values = stats()
+        except Exception:
+            continue
+        collected[name] = {key: value for key, value in values.items()
+                           if isinstance(value, (int, float)) and not isinstance(value, bool)}
+    return collected
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines: List[str] = []
+    for metric in METRICS:
+        metric.render(lines)
+    for name, values in _collect_stats().items():
+        for key, value in sorted(values.items()):
+            lines.append(f"# TYPE {PREFIX}_{name}_{key} gauge")
+            lines.append(f"{PREFIX}_{name}_{key} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def _summarise(histogram: Histogram, limit: int, errors: Optional[Counter] = None) -> List[str]:
+    error_counts = errors.values() if errors is not None else {}
+    rows = sorted(histogram.series().items(), key=lambda item: item[1][1], reverse=True)[:limit]
+    lines = []
+    for label_value, (count, total, counts) in rows:
+        p50 = Histogram.quantile(histogram.buckets, counts, 0.5) * 1000
+        p99 = Histogram.quantile(histogram.buckets, counts, 0.99) * 1000
+        line = f"{label_value or '—'}: {count} × {total / count * 1000:.1f} мс, p50 ≤{p50:g} мс, p99 ≤{p99:g} мс"
+        if error_counts.get(label_value):
+            line += f", ошибок {error_counts[label_value]}"
+        lines.append(line)
+    return lines or ["нет данных"]
+
+
+def summary(limit: int = 8) -> str:
+    """Human-readable digest for the admin /stats command: the most time-consuming entries first."""
+    sections = [
+        ("Обработчики", _summarise(handler_latency, limit, handler_errors)),
+        ("Запросы к БД", _summarise(db_latency, limit)),
+        ("Ожидание потока БД", _summarise(db_executor_wait, 1)),
+        ("Telegram API", _summarise(api_latency, limit, api_errors)),
+    ]
+    for name, values in _collect_stats().items():
+        sections.append((name, [", ".join(f"{key}={value:g}" for key, value in values.items())]))
+    return "\n\n".join(f"{title}:\n" + "\n".join(lines) for title, lines in sections)
+
+
+def instrument_functions(namespace: dict, exclude=frozenset()) -> None:
+    """Replaces the plain functions defined in a module namespace with timed wrappers."""
+    module = namespace["__name__"]
+    for name, func in list(namespace.items()):
+        if (name.startswith("_") or name in exclude or not inspect.isfunction(func)
+                or func.__module__ != module or inspect.isgeneratorfunction(func)):
+            continue
+        namespace[name] = _timed(func)
+
+
+def _timed(func):
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            db_latency.observe(name, time.perf_counter() - started)
+    return wrapper
+
+
+# The handler of the update being processed and when it started
+_handler_call: ContextVar[Optional[list]] = ContextVar("handler_call", default=None)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Records the run time and the exceptions of every message, callback and inline handler."""
+
+    def __init__(self):
+        super().__init__()
+        self._names: Dict[Callable, str] = {}
+
+    def _name(self, handler) -> str:
+        name = self._names.get(handler)
+        if name is None:
+            if handler is None:
+                return "unknown"
+            module = handler.__module__.rsplit(".", 1)[-1]
+            name = self._names[handler] = f"{module}.{handler.__name__}"
+        return name
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        _handler_call.set(None)
+
+    async def _started(self, event, data: dict):
+        _handler_call.set([current_handler.get(None), time.perf_counter()])
+
+    async def _finished(self, event, results, data: dict):
+        call = _handler_call.get()
+        if call is not None and call[1] is not None:
+            handler_latency.observe(self._name(call[0]), time.perf_counter() - call[1])
+            call[1] = None
+
+    on_process_message = on_process_callback_query = on_process_inline_query = _started
+    on_post_process_message = on_post_process_callback_query = on_post_process_inline_query = _finished
+
+    async def on_pre_process_error(self, update: types.Update, error: Exception, data: dict):
+        call = _handler_call.get()
+        handler_errors.inc(self._name(call[0] if call is not None else None))
+
+
+class InstrumentedBot(Bot):
+    """Bot that times every Bot API request by method."""
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().request(method, data, files, **kwargs)
+        except Exception:
+            api_errors.inc(method)
+            raise
+        finally:
+            api_latency.observe(method, time.perf_counter() - started)
+
+
+async def _metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_server(host: str, port: int) -> web.AppRunner:
+    """Serves GET /metrics; returns the runner to clean up on shutdown."""
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+from typing import Dict, Optional, Tuple
+
+from aiogram import types
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+
+def update_user_id(update: types.Update) -> Optional[int]:
+    """Returns the ID of the user who sent the update, if any."""
+    event = (update.message or update.edited_message or update.callback_query
+             or update.inline_query or update.chosen_inline_result)
+    if event is not None and event.from_user is not None:
+        return event.from_user.id
+    return None
+
+
+class UserSerialMiddleware(BaseMiddleware):
+    """
+    Processes updates of the same user one at a time, in arrival order,
+    while updates of different users run in parallel.
+
+    At most `max_pending` updates per user are kept in flight; the rest are dropped.
+    A callback whose data equals one already pending for the user is redundant (a double
+    tap or a redelivery) and is dropped too, except for callbacks in `non_idempotent`,
+    where every tap counts.
+
+    An update is counted when it is admitted: by the webhook as soon as it arrives (see
+    admit), otherwise when the dispatcher starts processing it.
+    """
+
+    def __init__(self, max_pending: int = 10,
+                 non_idempotent=frozenset({"increase_quantity", "decrease_quantity"})):
+        super().__init__()
+        self.max_pending = max_pending
+        self.non_idempotent = non_idempotent
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._pending: Dict[int, int] = {}
+        self._pending_callbacks: Dict[int, Dict[str, int]] = {}
+        self._admitted: Dict[int, Tuple[int, Optional[str]]] = {}
+        self.dropped = 0
+
+    async def _drop(self, update: types.Update, reason: str) -> None:
+        self.dropped += 1
+        logging.debug(f"Dropping update {update.update_id}: {reason}")
+        if update.callback_query is not None:
+            try:
+                await update.callback_query.answer()
+            except Exception:
+                pass
+
+    async def admit(self, update: types.Update) -> bool:
+        """
+        Counts an update against its user's limits; returns False if it was dropped.
+        Processing it later does not count it again.
+        """
+        user_id = update_user_id(update)
+        if user_id is None:
+            return True
+        if update.update_id in self._admitted:
+            await self._drop(update, "redelivered while still pending")
+            return False
+
+        pending = self._pending.get(user_id, 0)
+        if pending >= self.max_pending:
+            await self._drop(update, f"{pending} updates already pending for user {user_id}")
+            return False
+
+        callback_data = update.callback_query.data if update.callback_query is not None else None
+        if callback_data is not None and callback_data not in self.non_idempotent:
+            callbacks = self._pending_callbacks.setdefault(user_id, {})
+            if callbacks.get(callback_data):
+                await self._drop(update, f"duplicate callback {callback_data!r} from user {user_id}")
+                return False
+            callbacks[callback_data] = callbacks.get(callback_data, 0) + 1
+        else:
+            callback_data = None
+
+        self._pending[user_id] = pending + 1
+        self._locks.setdefault(user_id, asyncio.Lock())
+        self._admitted[update.update_id] = (user_id, callback_data)
+        return True
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        if update.update_id not in self._admitted:
+            if not await self.admit(update):
+                raise CancelHandler()
+            if update.update_id not in self._admitted:
+                return  # not from a user
+        user_id, callback_data = self._admitted.pop(update.update_id)
+
+        lock = self._locks[user_id]
+        try:
+            await lock.acquire()
+        except BaseException:
+            self._forget(user_id, callback_data)
+            raise
+        data["serial_key"] = (user_id, callback_data)
+
+    async def on_post_process_update(self, update: types.Update, results, data: dict):
+        key = data.pop("serial_key", None)
+        if key is None:
+            return
+        user_id, callback_data = key
+        self._locks[user_id].release()
+        self._forget(user_id, callback_data)
+
+    def _forget(self, user_id: int, callback_data: Optional[str]) -> None:
+        if callback_data is not None:
+            callbacks = self._pending_callbacks[user_id]
+            callbacks[callback_data] -= 1
+            if not callbacks[callback_data]:
+                del callbacks[callback_data]
+        self._pending[user_id] -= 1
+        if not self._pending[user_id]:
+            # Nobody is waiting: forget the user so memory tracks active users only
+            del self._pending[user_id]
+            del self._locks[user_id]
+            self._pending_callbacks.pop(user_id, None)
@@ -0,0 +1,555 @@
+"""
+Versioned schema migrations.
+
+Each migration is applied once, in its own transaction, and recorded in SchemaMigrations.
+Add new schema changes as a new entry at the end of MIGRATIONS; never edit an applied one.
+
+SQLITE_MIGRATIONS is the same schema for the SQLite engine, version for version. An entry
+is either a script or a function of a cursor, for changes SQLite cannot express in SQL.
+"""
+import logging
+import sqlite3
+from typing import List
+
+MIGRATION_LOCK_ID = 727401
+
+MIGRATIONS = [
+    (1, "Initial schema", '''
+        CREATE TABLE IF NOT EXISTS Users (
+            user_id BIGINT PRIMARY KEY,
+            username TEXT,
+            full_name TEXT,
+            phone_number TEXT
+        );
+
+        CREATE TABLE IF NOT EXISTS Categories (
+            category_id SERIAL PRIMARY KEY,
+            name TEXT UNIQUE NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS Products (
+            product_id SERIAL PRIMARY KEY,
+            category_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            price INTEGER CHECK(price >= 0),
+            FOREIGN KEY (category_id) REFERENCES Categories (category_id) ON DELETE CASCADE
+        );
+
+        CREATE TABLE IF NOT EXISTS Orders (
+            order_id SERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            location TEXT NOT NULL,
+            status TEXT DEFAULT 'New',
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            FOREIGN KEY (user_id) REFERENCES Users (user_id) ON DELETE SET NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS OrderItems (
+            item_id SERIAL PRIMARY KEY,
+            order_id INTEGER NOT NULL,
+            product_id INTEGER,
+            quantity INTEGER NOT NULL CHECK(quantity > 0),
+            price INTEGER NOT NULL CHECK(price >= 0),
+            FOREIGN KEY (order_id) REFERENCES Orders (order_id) ON DELETE CASCADE,
+            FOREIGN KEY (product_id) REFERENCES Products (product_id) ON DELETE SET NULL
+        );
+    '''),
+
+    (2, "Move one-row-per-product orders into OrderItems", '''
+        ALTER TABLE Orders ADD COLUMN IF NOT EXISTS created_at TIMESTAMP NOT NULL DEFAULT NOW();
+        ALTER TABLE Orders ALTER COLUMN user_id TYPE BIGINT;
+
+        DO $$
+        BEGIN
+            IF EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'orders' AND column_name = 'product_id'
+            ) THEN
+                INSERT INTO OrderItems (order_id, product_id, quantity, price)
+                SELECT Orders.order_id, Orders.product_id, 1, COALESCE(Products.price, 0)
+                FROM Orders
+                LEFT JOIN Products ON Products.product_id = Orders.product_id;
+                ALTER TABLE Orders DROP COLUMN product_id;
+            END IF;
+        END
+        $$;
+    '''),
+
+    (3, "Indexes for browse, order history and admin listings", '''
+        -- get_products_by_category: WHERE category_id = ? ORDER BY name
+        CREATE INDEX IF NOT EXISTS idx_products_category_name ON Products (category_id, name);
+        -- get_user_orders: WHERE user_id = ? ORDER BY status, order_id
+        CREATE INDEX IF NOT EXISTS idx_orders_user_status ON Orders (user_id, status, order_id);
+        -- order items by order, and ON DELETE SET NULL when a product is deleted
+        CREATE INDEX IF NOT EXISTS idx_order_items_order ON OrderItems (order_id);
+        CREATE INDEX IF NOT EXISTS idx_order_items_product ON OrderItems (product_id);
+        -- admin user list: ORDER BY username
+        CREATE INDEX IF NOT EXISTS idx_users_username ON Users (username, user_id);
+    '''),
+
+    (4, "Idempotency key for checkout", '''
+        ALTER TABLE Orders ADD COLUMN IF NOT EXISTS idempotency_key TEXT;
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_idempotency_key ON Orders (idempotency_key);
+    '''),
+
+    (5, "Transactional outbox for group notifications", '''
+        CREATE TABLE IF NOT EXISTS Outbox (
+            outbox_id BIGSERIAL PRIMARY KEY,
+            chat_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            order_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            last_error TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            sent_at TIMESTAMP,
+            FOREIGN KEY (order_id) REFERENCES Orders (order_id) ON DELETE CASCADE
+        );
+        CREATE INDEX IF NOT EXISTS idx_outbox_pending ON Outbox (next_attempt_at) WHERE status = 'pending';
+    '''),
+
+    (6, "Keyset index for the admin user list", '''
+        -- get_users_page: ORDER BY COALESCE(username, ''), user_id with a row-value cursor
+        CREATE INDEX IF NOT EXISTS idx_users_username_keyset ON Users ((COALESCE(username, '')), user_id);
+        DROP INDEX IF EXISTS idx_users_username;
+    '''),
+
+    (7, "Full-text index for product search", '''
+        -- search_products: to_tsvector('simple', name) @@ prefix query
+        CREATE INDEX IF NOT EXISTS idx_products_name_search ON Products USING GIN (to_tsvector('simple', name));
+    '''),
+
+    (8, "Telegram file_id registry for uploaded media", '''
+        CREATE TABLE IF NOT EXISTS MediaFiles (
+            media_key TEXT PRIMARY KEY,
+            checksum TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+    '''),
+
+    (9, "Admin broadcasts with resumable progress", '''
+        CREATE TABLE IF NOT EXISTS Broadcasts (
+            broadcast_id SERIAL PRIMARY KEY,
+            admin_chat_id BIGINT NOT NULL,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            total INTEGER NOT NULL DEFAULT 0,
+            last_user_id BIGINT NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            finished_at TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_broadcasts_running ON Broadcasts (broadcast_id) WHERE status = 'running';
+    '''),
+
+    (10, "Date index for the order export", '''
+        -- stream_orders: WHERE created_at >= ? AND created_at < ?
+        CREATE INDEX IF NOT EXISTS idx_orders_created ON Orders (created_at);
+    '''),
+
+    (11, "Sales summary tables for admin analytics", '''
+        CREATE TABLE IF NOT EXISTS SalesDaily (
+            day DATE PRIMARY KEY,
+            orders INTEGER NOT NULL DEFAULT 0,
+            items INTEGER NOT NULL DEFAULT 0,
+            revenue BIGINT NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS SalesDailyProducts (
+            day DATE NOT NULL,
+            product_id INTEGER NOT NULL,
+            orders INTEGER NOT NULL DEFAULT 0,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            revenue BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, product_id)
+        );
+        CREATE TABLE IF NOT EXISTS SalesDailyCategories (
+            day DATE NOT NULL,
+            category_id INTEGER NOT NULL,
+            orders INTEGER NOT NULL DEFAULT 0,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            revenue BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, category_id)
+        );
+        CREATE TABLE IF NOT EXISTS CustomerActivity (
+            user_id BIGINT PRIMARY KEY,
+            first_order_day DATE NOT NULL,
+            last_order_day DATE NOT NULL,
+            orders INTEGER NOT NULL DEFAULT 0,
+            revenue BIGINT NOT NULL DEFAULT 0
+        );
+        -- get_sales_summary: customers who ordered, or first ordered, since a day
+        CREATE INDEX IF NOT EXISTS idx_customer_activity_last ON CustomerActivity (last_order_day);
+        CREATE INDEX IF NOT EXISTS idx_customer_activity_first ON CustomerActivity (first_order_day);
+
+        -- The history so far; create_order keeps the tables up to date from here on
+        INSERT INTO SalesDaily (day, orders, items, revenue)
+        SELECT day, COUNT(*), SUM(items), SUM(revenue)
+        FROM (
+            SELECT Orders.created_at::date AS day, SUM(OrderItems.quantity) AS items,
+                   SUM(OrderItems.quantity::bigint * OrderItems.price) AS revenue
+            FROM Orders
+            JOIN OrderItems ON OrderItems.order_id = Orders.order_id
+            GROUP BY Orders.order_id
+        ) AS totals
+        GROUP BY day;
+
+        INSERT INTO SalesDailyProducts (day, product_id, orders, quantity, revenue)
+        SELECT Orders.created_at::date, COALESCE(OrderItems.product_id, 0), COUNT(DISTINCT Orders.order_id),
+               SUM(OrderItems.quantity), SUM(OrderItems.quantity::bigint * OrderItems.price)
+        FROM Orders
+        JOIN OrderItems ON OrderItems.order_id = Orders.order_id
+        GROUP BY 1, 2;
+
+        INSERT INTO SalesDailyCategories (day, category_id, orders, quantity, revenue)
+        SELECT Orders.created_at::date, COALESCE(Products.category_id, 0), COUNT(DISTINCT Orders.order_id),
+               SUM(OrderItems.quantity), SUM(OrderItems.quantity::bigint * OrderItems.price)
+        FROM Orders
+        JOIN OrderItems ON OrderItems.order_id = Orders.order_id
+        LEFT JOIN Products ON Products.product_id = OrderItems.product_id
+        GROUP BY 1, 2;
+
+        INSERT INTO CustomerActivity (user_id, first_order_day, last_order_day, orders, revenue)
+        SELECT Orders.user_id, MIN(Orders.created_at)::date, MAX(Orders.created_at)::date,
+               COUNT(DISTINCT Orders.order_id), SUM(OrderItems.quantity::bigint * OrderItems.price)
+        FROM Orders
+        JOIN OrderItems ON OrderItems.order_id = Orders.order_id
+        WHERE Orders.user_id IS NOT NULL
+        GROUP BY Orders.user_id;
+    '''),
+
+    (12, "Per-product stock", '''
+        -- NULL: stock is not tracked and the product never sells out
+        ALTER TABLE Products ADD COLUMN IF NOT EXISTS stock INTEGER CHECK (stock >= 0);
+    '''),
+
+    (13, "Queue of orders not yet in the sales summary", '''
+        -- create_order adds a row per order; refresh_sales_summary folds them into the summary
+        CREATE TABLE IF NOT EXISTS SalesPending (
+            order_id INTEGER PRIMARY KEY
+        );
+    '''),
+]
+
+
+def migrate(conn) -> List[int]:
+    """Applies pending migrations on the given connection and returns their versions."""
+    cursor = conn.cursor()
+    # Serialise concurrent starts (e.g. two dynos booting at once)
+    cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+    try:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS SchemaMigrations (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+            )
+        ''')
+        conn.commit()
+
+        cursor.execute("SELECT version FROM SchemaMigrations")
+        applied_versions = {row[0] for row in cursor.fetchall()}
+
+        applied = []
+        for version, description, sql in MIGRATIONS:
+            if version in applied_versions:
+                continue
+            try:
+                cursor.execute(sql)
+                cursor.execute(
+                    "INSERT INTO SchemaMigrations (version, description) VALUES (%s, %s)",
+                    (version, description)
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                logging.exception(f"Migration {version} ({description}) failed")
+                raise
+            logging.info(f"Applied migration {version}: {description}")
+            applied.append(version)
+        return applied
+    finally:
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+        conn.commit()
+
+
+def _split_legacy_orders(cursor) -> None:
+    """Moves one-row-per-product orders (as in the bundled restaurants.db) into OrderItems."""
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(Orders)")}
+    if "product_id" not in columns:
+        return
+    # SQLite cannot add a column with a non-constant default, so Orders is rebuilt
+    cursor.execute('''
+        CREATE TABLE Orders_new (
+            order_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            location TEXT NOT NULL,
+            status TEXT DEFAULT 'New',
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES Users (user_id) ON DELETE SET NULL
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO OrderItems (order_id, product_id, quantity, price)
+        SELECT Orders.order_id, Orders.product_id, 1, COALESCE(Products.price, 0)
+        FROM Orders
+        LEFT JOIN Products ON Products.product_id = Orders.product_id
+    ''')
+    cursor.execute('''
+        INSERT INTO Orders_new (order_id, user_id, location, status)
+        SELECT order_id, user_id, location, status FROM Orders
+    ''')
+    cursor.execute("DROP TABLE Orders")
+    cursor.execute("ALTER TABLE Orders_new RENAME TO Orders")
+
+
+SQLITE_MIGRATIONS = [
+    (1, "Initial schema", '''
+        CREATE TABLE IF NOT EXISTS Users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            full_name TEXT,
+            phone_number TEXT
+        );
+
+        CREATE TABLE IF NOT EXISTS Categories (
+            category_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS Products (
+            product_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            category_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            price INTEGER CHECK(price >= 0),
+            FOREIGN KEY (category_id) REFERENCES Categories (category_id) ON DELETE CASCADE
+        );
+
+        CREATE TABLE IF NOT EXISTS Orders (
+            order_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            location TEXT NOT NULL,
+            status TEXT DEFAULT 'New',
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES Users (user_id) ON DELETE SET NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS OrderItems (
+            item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL,
+            product_id INTEGER,
+            quantity INTEGER NOT NULL CHECK(quantity > 0),
+            price INTEGER NOT NULL CHECK(price >= 0),
+            FOREIGN KEY (order_id) REFERENCES Orders (order_id) ON DELETE CASCADE,
+            FOREIGN KEY (product_id) REFERENCES Products (product_id) ON DELETE SET NULL
+        );
+    '''),
+
+    (2, "Move one-row-per-product orders into OrderItems", _split_legacy_orders),
+
+    (3, "Indexes for browse, order history and admin listings", '''
+        CREATE INDEX IF NOT EXISTS idx_products_category_name ON Products (category_id, name);
+        CREATE INDEX IF NOT EXISTS idx_orders_user_status ON Orders (user_id, status, order_id);
+        CREATE INDEX IF NOT EXISTS idx_order_items_order ON OrderItems (order_id);
+        CREATE INDEX IF NOT EXISTS idx_order_items_product ON OrderItems (product_id);
+    '''),
+
+    (4, "Idempotency key for checkout", '''
+        ALTER TABLE Orders ADD COLUMN idempotency_key TEXT;
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_idempotency_key ON Orders (idempotency_key);
+    '''),
+
+    (5, "Transactional outbox for group notifications", '''
+        CREATE TABLE IF NOT EXISTS Outbox (
+            outbox_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            order_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            last_error TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP,
+            FOREIGN KEY (order_id) REFERENCES Orders (order_id) ON DELETE CASCADE
+        );
+        CREATE INDEX IF NOT EXISTS idx_outbox_pending ON Outbox (next_attempt_at) WHERE status = 'pending';
+    '''),
+
+    (6, "Keyset index for the admin user list", '''
+        CREATE INDEX IF NOT EXISTS idx_users_username_keyset ON Users (COALESCE(username, ''), user_id);
+    '''),
+
+    # No prefix full-text index on SQLite: product search is answered from the catalog cache
+    (7, "Full-text index for product search", ""),
+
+    (8, "Telegram file_id registry for uploaded media", '''
+        CREATE TABLE IF NOT EXISTS MediaFiles (
+            media_key TEXT PRIMARY KEY,
+            checksum TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+    '''),
+
+    (9, "Admin broadcasts with resumable progress", '''
+        CREATE TABLE IF NOT EXISTS Broadcasts (
+            broadcast_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            total INTEGER NOT NULL DEFAULT 0,
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_broadcasts_running ON Broadcasts (broadcast_id) WHERE status = 'running';
+    '''),
+
+    (10, "Date index for the order export", '''
+        -- stream_orders: WHERE created_at >= ? AND created_at < ?
+        CREATE INDEX IF NOT EXISTS idx_orders_created ON Orders (created_at);
+    '''),
+
+    (11, "Sales summary tables for admin analytics", '''
+        CREATE TABLE IF NOT EXISTS SalesDaily (
+            day DATE PRIMARY KEY,
+            orders INTEGER NOT NULL DEFAULT 0,
+            items INTEGER NOT NULL DEFAULT 0,
+            revenue INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS SalesDailyProducts (
+            day DATE NOT NULL,
+            product_id INTEGER NOT NULL,
+            orders INTEGER NOT NULL DEFAULT 0,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            revenue INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, product_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS SalesDailyCategories (
+            day DATE NOT NULL,
+            category_id INTEGER NOT NULL,
+            orders INTEGER NOT NULL DEFAULT 0,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            revenue INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, category_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS CustomerActivity (
+            user_id INTEGER PRIMARY KEY,
+            first_order_day DATE NOT NULL,
+            last_order_day DATE NOT NULL,
+            orders INTEGER NOT NULL DEFAULT 0,
+            revenue INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_customer_activity_last ON CustomerActivity (last_order_day);
+        CREATE INDEX IF NOT EXISTS idx_customer_activity_first ON CustomerActivity (first_order_day);
+
+        INSERT INTO SalesDaily (day, orders, items, revenue)
+        SELECT day, COUNT(*), SUM(items), SUM(revenue)
+        FROM (
+            SELECT date(Orders.created_at) AS day, SUM(OrderItems.quantity) AS items,
+                   SUM(OrderItems.quantity * OrderItems.price) AS revenue
+            FROM Orders
+            JOIN OrderItems ON OrderItems.order_id = Orders.order_id
+            GROUP BY Orders.order_id
+        )
+        GROUP BY day;
+
+        INSERT INTO SalesDailyProducts (day, product_id, orders, quantity, revenue)
+        SELECT date(Orders.created_at), COALESCE(OrderItems.product_id, 0), COUNT(DISTINCT Orders.order_id),
+               SUM(OrderItems.quantity), SUM(OrderItems.quantity * OrderItems.price)
+        FROM Orders
+        JOIN OrderItems ON OrderItems.order_id = Orders.order_id
+        GROUP BY 1, 2;
+
+        INSERT INTO SalesDailyCategories (day, category_id, orders, quantity, revenue)
+        SELECT date(Orders.created_at), COALESCE(Products.category_id, 0), COUNT(DISTINCT Orders.order_id),
+               SUM(OrderItems.quantity), SUM(OrderItems.quantity * OrderItems.price)
+        FROM Orders
+        JOIN OrderItems ON OrderItems.order_id = Orders.order_id
+        LEFT JOIN Products ON Products.product_id = OrderItems.product_id
+        GROUP BY 1, 2;
+
+        INSERT INTO CustomerActivity (user_id, first_order_day, last_order_day, orders, revenue)
+        SELECT Orders.user_id, date(MIN(Orders.created_at)), date(MAX(Orders.created_at)),
+               COUNT(DISTINCT Orders.order_id), SUM(OrderItems.quantity * OrderItems.price)
+        FROM Orders
+        JOIN OrderItems ON OrderItems.order_id = Orders.order_id
+        WHERE Orders.user_id IS NOT NULL
+        GROUP BY Orders.user_id;
+    '''),
+
+    (12, "Per-product stock", '''
+        ALTER TABLE Products ADD COLUMN stock INTEGER CHECK (stock >= 0);
+    '''),
+
+    (13, "Queue of orders not yet in the sales summary", '''
+        CREATE TABLE IF NOT EXISTS SalesPending (
+            order_id INTEGER PRIMARY KEY
+        );
+    '''),
+]
+
+
+def _statements(script: str) -> List[str]:
+    """Splits a script into statements; executescript would commit the migration's transaction."""
+    statements, current = [], ""
+    for line in script.splitlines(keepends=True):
+        current += line
+        if sqlite3.complete_statement(current):
+            statements.append(current)
+            current = ""
+    if current.strip():
+        statements.append(current)
+    return statements
+
+
+def migrate_sqlite(conn) -> List[int]:
+    """Applies pending SQLite migrations on an autocommit sqlite3 connection."""
+    # Rebuilding a table must not cascade to the rows that reference it
+    conn.execute("PRAGMA foreign_keys=OFF")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS SchemaMigrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    applied = []
+    for version, description, migration in SQLITE_MIGRATIONS:
+        cursor = conn.cursor()
+        # IMMEDIATE takes the write lock up front, so concurrent starts apply each migration once
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            if cursor.execute("SELECT 1 FROM SchemaMigrations WHERE version = ?", (version,)).fetchone():
+                cursor.execute("COMMIT")
+                continue
+            if callable(migration):
+                migration(cursor)
+            else:
+                for statement in _statements(migration):
+                    cursor.execute(statement)
+            violations = cursor.execute("PRAGMA foreign_key_check").fetchall()
+            if violations:
+                logging.warning(f"Migration {version}: {len(violations)} rows reference missing rows")
+            cursor.execute(
+                "INSERT INTO SchemaMigrations (version, description) VALUES (?, ?)",
+                (version, description)
+            )
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            logging.exception(f"Migration {version} ({description}) failed")
+            raise
+        logging.info(f"Applied migration {version}: {description}")
+        applied.append(version)
+    return applied
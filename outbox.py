@@ -0,0 +1,151 @@
+"""
+Background delivery of outbox messages written by create_order.
+
+The dispatcher claims due messages in batches, renders them from the stored order and
+sends them while keeping each chat under Telegram's per-chat rate limit. Failed sends are
+retried with exponential backoff; errors that cannot succeed on retry are not retried.
+The number of messages waiting is counted every depth_interval and exported with the stats.
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+
+from aiogram import Bot
+from aiogram.utils.exceptions import BadRequest, RetryAfter, TelegramAPIError, Unauthorized
+
+import async_db
+import db
+from formatting import order_notification_text
+
+
+class OutboxDispatcher:
+    def __init__(self, batch_size: int = 20, poll_interval: float = 2.0, per_chat_interval: float = 3.0,
+                 max_attempts: int = 8, base_backoff: float = 5.0, max_backoff: float = 600.0,
+                 depth_interval: float = 10.0):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        # Telegram allows about 20 messages per minute in a group
+        self.per_chat_interval = per_chat_interval
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.depth_interval = depth_interval
+
+        self.bot: Optional[Bot] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._next_send_at: Dict[str, float] = {}
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.depth = 0  # pending messages as of the last count; stats() must not query
+        self._depth_due = 0.0
+
+    def start(self, bot: Bot) -> None:
+        self.bot = bot
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def wake(self) -> None:
+        """Tells the dispatcher new messages were committed, skipping the poll delay."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def stats(self) -> dict:
+        return {"sent": self.sent, "retried": self.retried, "failed": self.failed, "depth": self.depth}
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if time.monotonic() >= self._depth_due:
+                    self._depth_due = time.monotonic() + self.depth_interval
+                    self.depth = await async_db.run(db.outbox_depth)
+                batch = await async_db.run(db.claim_outbox, self.batch_size)
+                if batch:
+                    by_chat = {}
+                    for message in batch:
+                        by_chat.setdefault(message[1], []).append(message)
+                    await asyncio.gather(*(self._send_chat(messages) for messages in by_chat.values()))
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("Outbox dispatcher iteration failed")
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _send_chat(self, messages: list) -> None:
+        """
+        Sends one chat's messages in order, respecting the per-chat interval.
+        After a failure the chat's remaining messages wait for the retry, so they stay in order.
+        """
+        delivered = []
+        for index, (outbox_id, chat_id, kind, order_id, attempts) in enumerate(messages):
+            delay = self._next_send_at.get(chat_id, 0) - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            retry_in = None
+            try:
+                await self._send(chat_id, kind, order_id)
+            except RetryAfter as e:
+                self._next_send_at[chat_id] = time.monotonic() + e.timeout
+                retry_in = e.timeout
+                await self._failed(outbox_id, attempts, str(e), retry_in)
+            except (BadRequest, Unauthorized) as e:
+                # Will not succeed on retry: wrong chat, bot removed from the group
+                retry_in = 0
+                await self._failed(outbox_id, attempts, str(e), None)
+            except (TelegramAPIError, LookupError, asyncio.TimeoutError, OSError) as e:
+                retry_in = min(self.base_backoff * 2 ** attempts, self.max_backoff)
+                await self._failed(outbox_id, attempts, str(e), retry_in)
+            finally:
+                self._next_send_at[chat_id] = max(self._next_send_at.get(chat_id, 0),
+                                                  time.monotonic() + self.per_chat_interval)
+
+            if retry_in is not None:
+                rest = [message[0] for message in messages[index + 1:]]
+                if rest:
+                    await async_db.run(db.defer_outbox, rest, retry_in)
+                break
+            delivered.append(outbox_id)
+            self.sent += 1
+
+        if delivered:
+            await async_db.run(db.mark_outbox_sent, delivered)
+
+    async def _send(self, chat_id: str, kind: str, order_id: int) -> None:
+        order = await async_db.get_order(order_id)
+        if order is None:
+            raise LookupError(f"order #{order_id} not found")
+
+        if kind == 'order_location':
+            latitude, longitude = (float(value) for value in order['location'].split(","))
+            await self.bot.send_location(chat_id, latitude, longitude)
+        elif kind == 'order_message':
+            await self.bot.send_message(chat_id, order_notification_text(order))
+        else:
+            raise LookupError(f"unknown outbox message kind {kind!r}")
+
+    async def _failed(self, outbox_id: int, attempts: int, error: str, retry_in: Optional[float]) -> None:
+        if retry_in is not None and attempts + 1 < self.max_attempts:
+            self.retried += 1
+        else:
+            retry_in = None
+            self.failed += 1
+            logging.error(f"Giving up on outbox message {outbox_id}: {error}")
+        await async_db.run(db.mark_outbox_failed, outbox_id, error, retry_in)
+
+
+outbox = OutboxDispatcher()
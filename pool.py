@@ -0,0 +1,231 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+import psycopg2
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """Raised when no connection could be checked out within the timeout."""
+
+
+class _PooledConnection:
+    """A psycopg2 connection together with its bookkeeping timestamps."""
+
+    __slots__ = ("conn", "created_at", "last_used_at")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used_at = self.created_at
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections.
+
+    Connections are health-checked on checkout when they have been idle for longer
+    than ``check_interval`` seconds, and recycled once they are older than ``max_age``
+    or have been idle for longer than ``max_idle`` seconds.
+    """
+
+    def __init__(self, dsn: str, minconn: int = 1, maxconn: int = 10, timeout: float = 10.0,
+                 max_age: float = 1800.0, max_idle: float = 300.0, check_interval: float = 30.0):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Invalid pool size: minconn=%s, maxconn=%s" % (minconn, maxconn))
+
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_age = max_age
+        self.max_idle = max_idle
+        self.check_interval = check_interval
+
+        self._idle: List[_PooledConnection] = []
+        self._in_use: Dict[int, _PooledConnection] = {}
+        self._cond = threading.Condition()
+        self._connecting = 0
+        self._closed = False
+
+        self._stats = {
+            "connections_created": 0,
+            "connections_closed": 0,
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time": 0.0,
+            "timeouts": 0,
+            "health_check_failures": 0,
+            "recycled": 0,
+        }
+
+        for _ in range(minconn):
+            self._idle.append(self._connect())
+
+    def _connect(self) -> _PooledConnection:
+        conn = psycopg2.connect(self.dsn)
+        self._stats["connections_created"] += 1
+        return _PooledConnection(conn)
+
+    def _close(self, pooled: _PooledConnection) -> None:
+        self._stats["connections_closed"] += 1
+        try:
+            pooled.conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _is_stale(self, pooled: _PooledConnection, now: float) -> bool:
+        if pooled.conn.closed:
+            return True
+        if self.max_age and now - pooled.created_at > self.max_age:
+            return True
+        if self.max_idle and now - pooled.last_used_at > self.max_idle:
+            return True
+        return False
+
+    def _is_healthy(self, pooled: _PooledConnection, now: float) -> bool:
+        """Pings a connection that has been idle for a while."""
+        if now - pooled.last_used_at < self.check_interval:
+            return True
+        try:
+            with pooled.conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            pooled.conn.rollback()
+            return True
+        except psycopg2.Error:
+            self._stats["health_check_failures"] += 1
+            return False
+
+    def getconn(self):
+        """Checks out a connection, waiting up to ``timeout`` seconds for a free one."""
+        deadline = time.monotonic() + self.timeout
+        waited = False
+        wait_started = 0.0
+
+        while True:
+            pooled = None
+            reserved = False
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise psycopg2.InterfaceError("connection pool is closed")
+
+                    now = time.monotonic()
+                    if self._idle:
+                        pooled = self._idle.pop()
+                        break
+                    if len(self._in_use) + self._connecting < self.maxconn:
+                        self._connecting += 1
+                        reserved = True
+                        break
+
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout("no database connection available after %.1fs" % self.timeout)
+                    if not waited:
+                        waited = True
+                        wait_started = now
+                        self._stats["waits"] += 1
+                    self._cond.wait(remaining)
+
+            # Network round trips (connecting, pinging) happen outside the lock
+            if reserved:
+                try:
+                    pooled = self._connect()
+                finally:
+                    with self._cond:
+                        self._connecting -= 1
+                        if pooled is None:
+                            self._cond.notify()
+            elif self._is_stale(pooled, now):
+                self._stats["recycled"] += 1
+                self._close(pooled)
+                continue
+            elif not self._is_healthy(pooled, now):
+                self._close(pooled)
+                continue
+
+            with self._cond:
+                if waited:
+                    self._stats["wait_time"] += time.monotonic() - wait_started
+                self._stats["checkouts"] += 1
+                self._in_use[id(pooled.conn)] = pooled
+            return pooled.conn
+
+    def _prune(self) -> None:
+        """Closes idle connections that went stale, keeping at least ``minconn`` open."""
+        now = time.monotonic()
+        keep = []
+        for pooled in self._idle:
+            if len(keep) + len(self._in_use) < self.minconn or not self._is_stale(pooled, now):
+                keep.append(pooled)
+            else:
+                self._stats["recycled"] += 1
+                self._close(pooled)
+        self._idle = keep
+
+    def putconn(self, conn, discard: bool = False) -> None:
+        """Returns a connection to the pool, closing it if it is broken or ``discard`` is set."""
+        with self._cond:
+            pooled = self._in_use.pop(id(conn), None)
+            if pooled is None:
+                raise psycopg2.InterfaceError("connection does not belong to this pool")
+
+            if not discard and not conn.closed:
+                try:
+                    if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                        conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+
+            if discard or conn.closed or self._closed:
+                self._close(pooled)
+            else:
+                pooled.last_used_at = time.monotonic()
+                self._idle.append(pooled)
+                self._prune()
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager that checks out a connection and returns it to the pool.
+        Commits on success and rolls back if the block raises.
+        """
+        conn = self.getconn()
+        discard = False
+        try:
+            yield conn
+            conn.commit()
+        except BaseException as e:
+            discard = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                discard = True
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    def stats(self) -> dict:
+        """Returns a snapshot of the pool counters."""
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(
+                size=len(self._idle) + len(self._in_use),
+                idle=len(self._idle),
+                in_use=len(self._in_use),
+                minconn=self.minconn,
+                maxconn=self.maxconn,
+            )
+            return stats
+
+    def closeall(self) -> None:
+        """Closes every idle connection; connections in use are closed when returned."""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._close(self._idle.pop())
+            self._cond.notify_all()
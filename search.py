@@ -0,0 +1,64 @@
+"""
+Product search by name.
+
+A query matches a product when every word of the query is a prefix of some word of the
+product name ("балт 0.5" finds "Балтика №3 0.5л"). Results are ranked with names starting
+with the first query word first, then shorter names, then alphabetically.
+
+PostgreSQL runs the same match against a full-text index (db.search_products);
+ProductSearchIndex answers it from memory for a catalog snapshot, which is how product
+search works on SQLite.
+"""
+import bisect
+import heapq
+import re
+from typing import Dict, List, Sequence, Set, Tuple
+
+Product = Tuple[int, int, str, int]
+
+_WORD = re.compile(r"\w+")
+
+
+def search_terms(query: str) -> List[str]:
+    """Splits a query into lower-case words, dropping punctuation and duplicates."""
+    terms = []
+    for term in _WORD.findall(query.lower()):
+        if term not in terms:
+            terms.append(term)
+    return terms
+
+
+def rank_key(product: Product, first_term: str):
+    name = product[2].lower()
+    return not name.startswith(first_term), len(name), name, product[0]
+
+
+class ProductSearchIndex:
+    """Sorted (word, product_id) pairs; a prefix lookup is a bisect over the word list."""
+
+    def __init__(self, products: Sequence[Product]):
+        self.products_by_id: Dict[int, Product] = {p[0]: p for p in products}
+        entries = sorted({(word, p[0]) for p in products for word in search_terms(p[2])})
+        self._words = [entry[0] for entry in entries]
+        self._ids = [entry[1] for entry in entries]
+
+    def _prefix_ids(self, prefix: str) -> Set[int]:
+        start = bisect.bisect_left(self._words, prefix)
+        end = bisect.bisect_left(self._words, prefix + "\U0010ffff", start)
+        return set(self._ids[start:end])
+
+    def search(self, query: str, limit: int = 20) -> List[Product]:
+        terms = search_terms(query)
+        if not terms:
+            return []
+
+        # Intersect starting from the most selective word
+        matches = sorted((self._prefix_ids(term) for term in terms), key=len)
+        ids = matches[0]
+        for other in matches[1:]:
+            ids = ids & other
+            if not ids:
+                return []
+
+        products = (self.products_by_id[product_id] for product_id in ids)
+        return heapq.nsmallest(limit, products, key=lambda p: rank_key(p, terms[0]))
@@ -25,7 +25,10 @@ class AdminStates(StatesGroup):
     entering_product_name = State()
     selecting_product_category = State()
     entering_product_price = State()
+    entering_product_stock = State()
     selecting_category = State()
     viewing_category = State()
     entering_category_name = State()
-    viewing_user_list = State()
\ No newline at end of file
+    viewing_user_list = State()
+    entering_broadcast_text = State()
+    uploading_price_list = State()
\ No newline at end of file
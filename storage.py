@@ -0,0 +1,465 @@
+"""
+Storage engines behind db.py.
+
+db.py writes its queries once, with %s placeholders, and runs them on connections handed
+out by an engine:
+
+- PostgresEngine: the psycopg2 connection pool (pool.py) and the migrations in migrations.py.
+- SQLiteEngine: a local file for small single-node deployments and benchmarks, no server.
+
+The engine is picked by DATABASE_URL: sqlite:///relative/path.db or sqlite:////absolute/path.db
+selects SQLite, anything else is a PostgreSQL DSN. A few queries differ between the two;
+db.py branches on Engine.name for those.
+
+SQLite is tuned for a bot's many short transactions: WAL journal, so readers never block
+the writer; one writer connection, since SQLite allows a single writer at a time anyway;
+and a pool of read-only connections. Concurrent write transactions are committed in
+batches: each runs in a savepoint inside the writer's open transaction, and the last
+writer in line commits all of them at once. A caller still returns only after its
+transaction is committed.
+"""
+import csv
+import io
+import queue
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
+from typing import Iterable, Iterator, List, Optional, Sequence
+
+import psycopg2
+
+from config import (DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_MAX_AGE, DB_POOL_MAX_IDLE,
+                    DB_POOL_CHECK_INTERVAL, SQLITE_READERS, SQLITE_MAX_BATCH, SQLITE_SYNCHRONOUS)
+from migrations import migrate, migrate_sqlite
+from pool import ConnectionPool
+
+# Base classes of the errors either driver raises
+DatabaseError = (psycopg2.Error, sqlite3.Error)
+
+SQLITE_PREFIX = "sqlite:///"
+
+
+class Engine:
+    """Connections, schema and statistics of one database."""
+
+    name = ""
+
+    def connection(self):
+        """Context manager yielding a connection for a read-write transaction; commits on exit."""
+        raise NotImplementedError
+
+    def reader(self):
+        """Context manager yielding a connection for read-only queries."""
+        return self.connection()
+
+    def stream(self, query: str, params=(), batch_size: int = 1000) -> Iterator[list]:
+        """
+        Yields the rows of a query in lists of up to `batch_size`, without loading the whole
+        result, on a connection of its own so no pooled connection is held meanwhile.
+        """
+        raise NotImplementedError
+
+    def copy_rows(self, cursor, table: str, columns: Sequence[str], rows: Iterable[tuple]) -> int:
+        """Bulk-loads rows into a table within the cursor's transaction; returns how many were loaded."""
+        raise NotImplementedError
+
+    def migrate(self) -> List[int]:
+        """Applies pending schema migrations and returns their versions."""
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {}
+
+    def close(self) -> None:
+        pass
+
+
+class _CopySource:
+    """File-like object COPY ... FROM STDIN reads; rows are formatted as CSV as they are read."""
+
+    def __init__(self, rows: Iterable[tuple]):
+        self._rows = iter(rows)
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator="\n")
+        self.error = None
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or self._buffer.tell() < size:
+            try:
+                row = next(self._rows, None)
+            except Exception as e:
+                # psycopg2 reports it as a generic COPY failure; kept so the caller sees the original
+                self.error = e
+                raise
+            if row is None:
+                break
+            self._writer.writerow(row)
+        data = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data
+
+    readline = read
+
+
+class PostgresEngine(Engine):
+    name = "postgres"
+
+    def __init__(self, dsn: str, **pool_options):
+        self.dsn = dsn
+        self.pool = ConnectionPool(dsn, **pool_options)
+
+    def connection(self):
+        return self.pool.connection()
+
+    def stream(self, query: str, params=(), batch_size: int = 1000) -> Iterator[list]:
+        conn = psycopg2.connect(self.dsn)
+        try:
+            # A named cursor keeps the result on the server and fetches it batch by batch
+            with conn.cursor(name="stream") as cursor:
+                cursor.itersize = batch_size
+                cursor.execute(query, params)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield rows
+        finally:
+            conn.close()
+
+    def copy_rows(self, cursor, table: str, columns: Sequence[str], rows: Iterable[tuple]) -> int:
+        # None is written as an unquoted empty field, which COPY reads as NULL
+        source = _CopySource(rows)
+        try:
+            cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", source)
+        except psycopg2.Error:
+            if source.error is not None:
+                raise source.error
+            raise
+        return cursor.rowcount
+
+    def migrate(self) -> List[int]:
+        with self.connection() as conn:
+            return migrate(conn)
+
+    def stats(self) -> dict:
+        return self.pool.stats()
+
+    def close(self) -> None:
+        self.pool.closeall()
+
+
+_PLACEHOLDER = re.compile(r"%([s%])")
+
+
+@lru_cache(maxsize=1024)
+def _qmark(query: str) -> str:
+    # %s -> ?, and %% -> % as psycopg2 reads it
+    return _PLACEHOLDER.sub(lambda match: "?" if match.group(1) == "s" else "%", query)
+
+
+class _SQLiteCursor:
+    """sqlite3 cursor that takes the %s placeholders db.py writes its queries with."""
+
+    __slots__ = ("_cursor",)
+
+    def __init__(self, cursor: sqlite3.Cursor):
+        self._cursor = cursor
+
+    def execute(self, query: str, params=()):
+        self._cursor.execute(_qmark(query), params)
+        return self
+
+    def executemany(self, query: str, seq_of_params):
+        self._cursor.executemany(_qmark(query), seq_of_params)
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size: int):
+        return self._cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self) -> int:
+        return self._cursor.lastrowid
+
+    def close(self) -> None:
+        self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _SQLiteConnection:
+    """
+    The connection a `with engine.connection()` block gets on SQLite. The engine commits
+    when the block ends, so commit() does nothing; rollback() undoes only this block's
+    statements, not the other transactions of its batch.
+    """
+
+    __slots__ = ("_conn", "_savepoint")
+
+    def __init__(self, conn: sqlite3.Connection, savepoint: Optional[str] = None):
+        self._conn = conn
+        self._savepoint = savepoint
+
+    def cursor(self) -> _SQLiteCursor:
+        return _SQLiteCursor(self._conn.cursor())
+
+    def commit(self) -> None:
+        pass
+
+    def rollback(self) -> None:
+        if self._savepoint is not None:
+            self._conn.execute(f"ROLLBACK TO {self._savepoint}")
+
+
+class _Batch:
+    """Write transactions committed together."""
+
+    __slots__ = ("size", "done", "error")
+
+    def __init__(self):
+        self.size = 0
+        self.done = threading.Event()
+        self.error: Optional[BaseException] = None
+
+
+def _parse_timestamp(value: bytes) -> datetime:
+    return datetime.fromisoformat(value.decode())
+
+
+# TIMESTAMP columns are read back as datetime, like psycopg2 does
+sqlite3.register_converter("TIMESTAMP", _parse_timestamp)
+
+
+class SQLiteEngine(Engine):
+    name = "sqlite"
+
+    def __init__(self, path: str, readers: int = 4, max_batch: int = 64, timeout: float = 10.0,
+                 synchronous: str = "NORMAL"):
+        if sqlite3.sqlite_version_info < (3, 35):
+            # db.py uses RETURNING and upserts
+            raise RuntimeError(f"SQLite 3.35 or newer is required, found {sqlite3.sqlite_version}")
+        self.path = path
+        self.readers = readers
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.synchronous = synchronous
+
+        self._writer = self._open()
+        self._writer.execute("PRAGMA journal_mode=WAL")
+        self._cond = threading.Condition()
+        self._busy = False  # a write transaction is running on the writer connection
+        self._waiting = 0  # writers queued for it
+        self._batch: Optional[_Batch] = None  # open, not yet committed batch
+
+        self._idle_readers: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._reader_count = 0
+        self._reader_lock = threading.Lock()
+
+        self._stats = {
+            "transactions": 0,
+            "commits": 0,
+            "commit_time": 0.0,
+            "max_batch_size": 0,
+            "reader_waits": 0,
+            "reader_timeouts": 0,
+        }
+
+    def _open(self, readonly: bool = False) -> sqlite3.Connection:
+        # Autocommit mode: transactions are begun and committed explicitly
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                               check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-16000")  # 16 MB per connection
+        conn.execute("PRAGMA mmap_size=268435456")
+        if readonly:
+            conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        with self._cond:
+            self._waiting += 1
+            while self._busy:
+                self._cond.wait()
+            self._waiting -= 1
+            self._busy = True
+            batch = self._batch
+            if batch is None:
+                batch = self._batch = _Batch()
+
+        conn = self._writer
+        failed = False
+        try:
+            if not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+            conn.execute("SAVEPOINT block")
+            try:
+                yield _SQLiteConnection(conn, "block")
+            except BaseException:
+                failed = True
+                conn.execute("ROLLBACK TO block")
+                raise
+            finally:
+                conn.execute("RELEASE block")
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            batch.size += 1
+            self._stats["transactions"] += 1
+            with self._cond:
+                # The last writer in line commits the batch, or anyone once it is full
+                commit = self._waiting == 0 or batch.size >= self.max_batch
+                if commit:
+                    self._batch = None
+            if commit:
+                self._commit(batch)
+            with self._cond:
+                self._busy = False
+                self._cond.notify()
+
+        batch.done.wait()
+        if batch.error is not None and not failed:
+            raise sqlite3.OperationalError(f"batch commit failed: {batch.error}")
+
+    def _commit(self, batch: _Batch) -> None:
+        started = time.perf_counter()
+        try:
+            if self._writer.in_transaction:
+                self._writer.execute("COMMIT")
+        except BaseException as e:
+            batch.error = e
+            try:
+                self._writer.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+        finally:
+            self._stats["commits"] += 1
+            self._stats["commit_time"] += time.perf_counter() - started
+            self._stats["max_batch_size"] = max(self._stats["max_batch_size"], batch.size)
+            batch.done.set()
+
+    def _checkout_reader(self) -> sqlite3.Connection:
+        try:
+            return self._idle_readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._reader_lock:
+            if self._reader_count < self.readers:
+                self._reader_count += 1
+                return self._open(readonly=True)
+        self._stats["reader_waits"] += 1
+        try:
+            return self._idle_readers.get(timeout=self.timeout)
+        except queue.Empty:
+            self._stats["reader_timeouts"] += 1
+            raise sqlite3.OperationalError(f"no database reader available after {self.timeout:.1f}s")
+
+    @contextmanager
+    def reader(self):
+        conn = self._checkout_reader()
+        try:
+            # One snapshot for all the queries of the block
+            conn.execute("BEGIN")
+            yield _SQLiteConnection(conn)
+        finally:
+            try:
+                if conn.in_transaction:
+                    conn.execute("COMMIT")
+                self._idle_readers.put(conn)
+            except sqlite3.Error:
+                conn.close()
+                with self._reader_lock:
+                    self._reader_count -= 1
+
+    def stream(self, query: str, params=(), batch_size: int = 1000) -> Iterator[list]:
+        # SQLite steps through the result as it is fetched; the read snapshot is held until
+        # the generator finishes, which keeps the WAL from being checkpointed past it meanwhile
+        conn = self._open(readonly=True)
+        try:
+            # A large ORDER BY spills to a temp file instead of growing in memory; no mmap, so
+            # the pages scanned are not counted against the process
+            conn.execute("PRAGMA temp_store=FILE")
+            conn.execute("PRAGMA mmap_size=0")
+            conn.execute("BEGIN")
+            cursor = conn.execute(_qmark(query), params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            conn.close()
+
+    def copy_rows(self, cursor, table: str, columns: Sequence[str], rows: Iterable[tuple]) -> int:
+        # No COPY in SQLite; executemany steps one prepared statement through the rows in-process
+        placeholders = ", ".join("%s" for _ in columns)
+        cursor.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", rows)
+        return cursor.rowcount
+
+    def migrate(self) -> List[int]:
+        conn = self._open()
+        try:
+            return migrate_sqlite(conn)
+        finally:
+            conn.close()
+
+    def stats(self) -> dict:
+        stats = dict(self._stats)
+        stats.update(
+            readers=self._reader_count,
+            idle_readers=self._idle_readers.qsize(),
+            transactions_per_commit=stats["transactions"] / stats["commits"] if stats["commits"] else 0.0,
+        )
+        return stats
+
+    def close(self) -> None:
+        with self._cond:
+            while self._busy:
+                self._cond.wait()
+            self._busy = True
+        self._writer.close()
+        while True:
+            try:
+                self._idle_readers.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def create_engine(url: str) -> Engine:
+    """Creates the engine for a DATABASE_URL."""
+    if url.startswith(SQLITE_PREFIX):
+        return SQLiteEngine(url[len(SQLITE_PREFIX):], readers=SQLITE_READERS, max_batch=SQLITE_MAX_BATCH,
+                            timeout=DB_POOL_TIMEOUT, synchronous=SQLITE_SYNCHRONOUS)
+    return PostgresEngine(
+        url,
+        minconn=DB_POOL_MIN,
+        maxconn=DB_POOL_MAX,
+        timeout=DB_POOL_TIMEOUT,
+        max_age=DB_POOL_MAX_AGE,
+        max_idle=DB_POOL_MAX_IDLE,
+        check_interval=DB_POOL_CHECK_INTERVAL,
+    )
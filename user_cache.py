@@ -0,0 +1,48 @@
+"""
+Cache of registered user IDs.
+
+Users never un-register, so a positive user_exists result is cached for good. Memory is
+bounded by evicting the least recently seen users; an evicted user costs one extra query
+on their next visit. Only used from the event loop thread.
+"""
+from collections import OrderedDict
+
+from config import REGISTERED_USERS_CACHE_SIZE
+
+
+class RegisteredUsers:
+    """LRU set of user IDs known to be present in Users."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._users = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, user_id: int) -> bool:
+        if user_id in self._users:
+            self._users.move_to_end(user_id)
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def add(self, user_id: int) -> None:
+        self._users[user_id] = None
+        self._users.move_to_end(user_id)
+        if len(self._users) > self.capacity:
+            self._users.popitem(last=False)
+
+    def warm(self, user_ids) -> None:
+        """Preloads user IDs, e.g. from Users at startup."""
+        for user_id in user_ids:
+            self.add(user_id)
+
+    def stats(self) -> dict:
+        return {"size": len(self._users), "capacity": self.capacity, "hits": self.hits, "misses": self.misses}
+
+
+registered_users = RegisteredUsers(REGISTERED_USERS_CACHE_SIZE)
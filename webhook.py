@@ -0,0 +1,149 @@
+"""
+Webhook entry point: an aiohttp server that accepts Telegram updates and processes them
+concurrently on a bounded pool of workers.
+
+Requests are acknowledged as soon as the update is queued. When the queue is full the
+server answers 503 and Telegram redelivers the update later.
+
+Updates are queued per user, and a worker only takes a user with no update running, the
+oldest of that user's updates first. A user's updates thus run one at a time and in order
+without a worker ever waiting for the previous one, so a few busy users cannot occupy the
+workers while the others wait. `admit` (UserSerialMiddleware.admit) applies the per-user
+limits as updates arrive.
+
+To try it locally, run the bot with BOT_MODE=webhook and POST a recorded update:
+
+    curl -X POST localhost:8080/webhook \\
+        -H "Content-Type: application/json" \\
+        -H "X-Telegram-Bot-Api-Secret-Token: $WEBHOOK_SECRET" \\
+        -d @update.json
+"""
+import asyncio
+import hmac
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Hashable, List, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+
+from middlewares import update_user_id
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    def __init__(self, dispatcher: Dispatcher, path: str, secret_token: Optional[str] = None,
+                 workers: int = 32, queue_size: int = 1000,
+                 admit: Optional[Callable[[types.Update], Awaitable[bool]]] = None):
+        self.dispatcher = dispatcher
+        self.path = path
+        self.secret_token = secret_token
+        self.workers = workers
+        self.queue_size = queue_size
+        self.admit = admit
+        self.queued = 0  # accepted updates not yet processed
+        self._updates: Dict[Hashable, Deque[types.Update]] = {}  # per user, the first one running
+        self._ready: Optional[asyncio.Queue] = None  # users whose first update can run
+        self._tasks: List[asyncio.Task] = []
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret_token:
+            received = request.headers.get(SECRET_HEADER, "")
+            if not hmac.compare_digest(received, self.secret_token):
+                return web.Response(status=401)
+
+        try:
+            update = types.Update(**(await request.json()))
+            user_id = update_user_id(update)
+        except (AttributeError, TypeError, ValueError):
+            # Not JSON, or JSON that is not an update object, or one whose message is not an object
+            return web.Response(status=400)
+
+        if self.queued >= self.queue_size:
+            logging.warning("Webhook queue is full, asking Telegram to redeliver")
+            return web.Response(status=503)
+        if self.admit is not None:
+            # A dropped callback is answered, which needs the current bot
+            Bot.set_current(self.dispatcher.bot)
+            if not await self.admit(update):
+                return web.Response()
+
+        key = user_id if user_id is not None else ("update", update.update_id)
+        self.queued += 1
+        updates = self._updates.get(key)
+        if updates is None:
+            self._updates[key] = deque([update])
+            self._ready.put_nowait(key)
+        else:
+            updates.append(update)
+        return web.Response()
+
+    async def _worker(self) -> None:
+        Bot.set_current(self.dispatcher.bot)
+        Dispatcher.set_current(self.dispatcher)
+        while True:
+            key = await self._ready.get()
+            updates = self._updates[key]
+            update = updates[0]
+            try:
+                await self.dispatcher.process_updates([update])
+            except Exception:
+                logging.exception(f"Error processing update {update.update_id}")
+            finally:
+                updates.popleft()
+                self.queued -= 1
+                # The user's next update goes to the back of the line, behind the other users
+                if updates:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._updates[key]
+                self._ready.task_done()
+
+    async def start_workers(self, app: web.Application) -> None:
+        self._ready = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop_workers(self, app: web.Application) -> None:
+        # Finish what was already acknowledged to Telegram before stopping
+        await self._ready.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        app.on_startup.append(self.start_workers)
+        app.on_shutdown.append(self.stop_workers)
+        return app
+
+
+def start_webhook(dispatcher: Dispatcher, path: str, host: str, port: int, *, webhook_url: Optional[str] = None,
+                  secret_token: Optional[str] = None, workers: int = 32, queue_size: int = 1000,
+                  admit=None, on_startup=None, on_shutdown=None) -> None:
+    """
+    Serves the webhook until interrupted. If `webhook_url` is given, it is registered
+    with Telegram on startup together with the secret token.
+    """
+    server = WebhookServer(dispatcher, path, secret_token=secret_token, workers=workers, queue_size=queue_size,
+                           admit=admit)
+    app = server.make_app()
+
+    async def startup(app: web.Application) -> None:
+        if webhook_url:
+            await dispatcher.bot.set_webhook(webhook_url, secret_token=secret_token)
+        if on_startup is not None:
+            await on_startup(dispatcher)
+
+    async def shutdown(app: web.Application) -> None:
+        if on_shutdown is not None:
+            await on_shutdown(dispatcher)
+        await dispatcher.storage.close()
+        await dispatcher.storage.wait_closed()
+        session = await dispatcher.bot.get_session()
+        await session.close()
+
+    app.on_startup.append(startup)
+    app.on_shutdown.append(shutdown)
+    web.run_app(app, host=host, port=port)